@@ -0,0 +1,151 @@
+"""
+Rate limiting and admission control for the web API.
+
+RateLimiter keeps a token bucket per key (a vehicle, a dashboard session,
+a client address), so one misbehaving client is throttled without touching
+anyone else's budget.
+
+AdmissionController bounds how many requests a worker process works on at
+once, by priority:
+
+    CRITICAL  stop commands and the vehicles' command channel: always
+              admitted at once
+    NORMAL    everything else: may use every slot, waits up to max_wait
+              for one
+    LOW       telemetry and dashboard polling: at most low_max_active LOW
+              requests at once (by default half the slots; the rest stay
+              free for NORMAL work), yields to queued NORMAL requests and
+              waits only briefly
+
+A request that gets no slot in time is shed. Under overload LOW traffic is
+therefore turned away first, NORMAL traffic queues, and a CRITICAL request
+shares the CPU with at most max_active others, which bounds its latency.
+A worker runs Python code on one core at a time, so a few slots keep it
+busy; more only let requests interleave and all finish later.
+
+Both are per process and keep no shared state, so they cost a lock and a
+few arithmetic operations per request.
+"""
+import threading
+import time
+
+CRITICAL, NORMAL, LOW = 0, 1, 2
+PRIORITY_NAMES = ("critical", "normal", "low")
+
+class RateLimiter:
+    """
+    Token buckets: each key may make `rate` requests per second on average
+    and `burst` back to back. Thread-safe. Idle buckets are dropped once
+    more than `max_keys` keys are tracked.
+    """
+
+    def __init__(self, rate, burst, max_keys=100000):
+        self.rate = rate
+        self.burst = max(1.0, burst)
+        self.max_keys = max_keys
+        self._lock = threading.Lock()
+        self._buckets = {}   # key -> [tokens, time of last refill]
+
+    def acquire(self, key, now=None):
+        """
+        Takes a token from the bucket of `key`. Returns 0.0 if the request
+        may proceed, else the seconds until the next token.
+        """
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                if len(self._buckets) >= self.max_keys:
+                    self._prune(now)
+                self._buckets[key] = [self.burst - 1, now]
+                return 0.0
+            tokens = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+            if tokens >= 1:
+                bucket[0] = tokens - 1
+                return 0.0
+            bucket[0] = tokens
+            return (1 - tokens) / self.rate
+
+    def _prune(self, now):
+        # Caller holds self._lock. A bucket idle long enough to be full
+        # again is the same as no bucket.
+        idle = self.burst / self.rate
+        for key in [key for key, (_, last) in self._buckets.items() if now - last >= idle]:
+            del self._buckets[key]
+
+    def __len__(self):
+        return len(self._buckets)
+
+class AdmissionController:
+    """
+    Priority gate in front of request handling; see the module docstring.
+    LOW requests may hold at most `low_max_active` of the `max_active` slots
+    (default: half) and wait up to `low_max_wait` seconds, NORMAL
+    requests up to `max_wait`. `active` counts admitted requests of every
+    priority, `low_active` the LOW ones among them.
+    """
+
+    def __init__(self, max_active, low_max_active=None, max_wait=0.5, low_max_wait=0.05):
+        self.max_active = max_active
+        if low_max_active is None:
+            low_max_active = max_active // 2
+        self.low_limit = max(1, min(low_max_active, max_active))
+        self._max_wait = {NORMAL: max_wait, LOW: low_max_wait}
+        self._lock = threading.Lock()
+        self._ready = {NORMAL: threading.Condition(self._lock), LOW: threading.Condition(self._lock)}
+        self._waiting = {NORMAL: 0, LOW: 0}
+        self.active = 0
+        self.low_active = 0
+
+    def _has_room(self, priority):
+        # Caller holds self._lock
+        if priority == NORMAL:
+            return self.active < self.max_active
+        return (self.active < self.max_active and self.low_active < self.low_limit
+                and not self._waiting[NORMAL])
+
+    def admit(self, priority):
+        """
+        Takes a slot. Returns True once admitted (call release(priority)
+        when the request is done), or False if the request should be shed.
+        """
+        with self._lock:
+            if priority == CRITICAL or self._has_room(priority):
+                self.active += 1
+                self.low_active += priority == LOW
+                return True
+            deadline = time.monotonic() + self._max_wait[priority]
+            self._waiting[priority] += 1
+            try:
+                while not self._has_room(priority):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        return False
+                    self._ready[priority].wait(remaining)
+                self.active += 1
+                self.low_active += priority == LOW
+                return True
+            finally:
+                self._waiting[priority] -= 1
+                if priority == NORMAL and not self._waiting[NORMAL] and self._has_room(LOW):
+                    # The last queued NORMAL request no longer blocks LOW ones
+                    self._ready[LOW].notify()
+
+    def release(self, priority=NORMAL):
+        """
+        Gives back the slot of a request admitted with `priority`.
+        """
+        with self._lock:
+            self.active -= 1
+            self.low_active -= priority == LOW
+            if self._waiting[NORMAL]:
+                self._ready[NORMAL].notify()
+            elif self._waiting[LOW] and self._has_room(LOW):
+                self._ready[LOW].notify()
+
+    def stats(self):
+        with self._lock:
+            return {"active": self.active, "low_active": self.low_active,
+                    "max_active": self.max_active, "low_limit": self.low_limit,
+                    "waiting": {PRIORITY_NAMES[p]: n for p, n in self._waiting.items()}}
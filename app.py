@@ -1,48 +1,383 @@
-import threading
 import time
-import random
 import os
-from flask import Flask, render_template, jsonify, request, session, redirect, url_for
-from crypto import encrypt_command, decrypt_execute
-
-app = Flask(__name__)
-app.secret_key = os.urandom(24)
-
-# Simulated Car Data - LIMITED TO 3 CARS
-# [INTEGRATION POINT]
-# Replace this 'CARS' dictionary with a database call or Firebase listener.
-# In a real scenario, your Android app pushes GPS data to Firebase/DB,
-# and this Flask app should query that DB to populate this 'CARS' object.
-# Updated to TiHAN IITH Coordinates
-CARS = {
-    "ACS01": {"lat": 17.601838, "lon": 78.126866, "status": "Stopped", "path": "Path-A"},
-    "ACS02": {"lat": 17.601938, "lon": 78.126966, "status": "Stopped", "path": "Path-B"},
-    "ACS03": {"lat": 17.601738, "lon": 78.126766, "status": "Stopped", "path": "Path-C"},
+import gzip
+import json
+import atexit
+import math
+import threading
+import zlib
+from flask import Blueprint, Flask, Response, g, render_template, jsonify, request, session, redirect, url_for
+from crypto import ACTIONS, encrypt_command, seal_command, CODEC, ENVELOPE
+from state_server import FleetState, RemoteState, FLEET_STATE_SOCKET, TRACK_RETENTION_HOURS, connect
+from metrics import FAST_BUCKETS_MS, MetricsRegistry, merge_raw, render_prometheus, series
+from profiler import SamplingProfiler
+from admission import CRITICAL, LOW, NORMAL, PRIORITY_NAMES, AdmissionController, RateLimiter
+from telemetry_codec import SNAPSHOT_MIME, TELEMETRY_MIME, UnsupportedVersion, decode_fixes, encode_snapshot, gunzip
+
+bp = Blueprint('fleet', __name__)
+
+# Sessions must survive a restart and be valid on every worker, so set
+# FLASK_SECRET_KEY in production; a random key is only fine for one process
+FLASK_SECRET_KEY = os.getenv('FLASK_SECRET_KEY')
+
+# Fleet state (see state_server.py), bound by create_app: the live fleet
+# store with pending commands, position history, geofence index, broadcast
+# tracker, command metrics, vehicle stack logs and simulator. With FLEET_STATE_SOCKET set
+# these are proxies to a shared state server, so any number of worker
+# processes see one fleet.
+STATE = None
+FLEET = None
+TRACKS = None
+BROADCASTS = None
+METRICS = None
+LOGS = None
+GEO = None
+SIMULATOR = None
+VEHICLE_GROUPS = {}
+TRACK_MAX_POINTS = 5000  # Upper bound for ?max_points on the track API
+LOG_MAX_LINES = 1000     # Upper bound for ?limit / ?tail on the log API
+LOG_UPLOAD_MAX_LINES = 1000  # Lines accepted per vehicle upload
+GEO_MAX_RADIUS_M = 10000     # Upper bound for ?radius_m on the nearby API
+GEO_MAX_EVENTS = 1000        # Upper bound for ?limit on the geofence events API
+
+LONG_POLL_TIMEOUT = 25  # Max seconds a command request is parked
+
+# Vehicle telemetry arrives as JSON or in the binary format of
+# telemetry_codec.py (Content-Type: application/x-fleet-telemetry), either
+# optionally gzipped (Content-Encoding: gzip). /api/data answers in the
+# binary snapshot format for "Accept: application/x-fleet-snapshot"; for
+# clients that accept gzip, snapshots over GZIP_MIN_BYTES and the
+# /api/stream feed are gzipped.
+TELEMETRY_MAX_BYTES = 1 << 20  # Largest telemetry body accepted, after gunzip
+GZIP_MIN_BYTES = 1024
+GZIP_LEVEL = 5
+# Fix times come from the vehicle's clock. Times more than FIX_MAX_FUTURE
+# seconds ahead of the server are clamped to that bound; fixes older than
+# the track retention, or with a non-finite time or coordinate, are dropped
+# (a 400 would leave them at the head of the vehicle's replay buffer).
+FIX_MAX_FUTURE = float(os.getenv('FIX_MAX_FUTURE', '60'))
+FIELD_MAX_CHARS = 64   # Longest acs_id, status or path accepted from a vehicle
+FIELD_ERROR = f"acs_id, status and path must be strings of at most {FIELD_MAX_CHARS} characters"
+
+# Request counts/latency and JSON serialization time of this worker process,
+# recorded without locks or IPC (see metrics.py). With a shared state server
+# every worker publishes them there each METRICS_PUBLISH_INTERVAL seconds,
+# and /metrics reports the sum over all workers plus the shared state's own
+# metrics (command delivery, simulator ticks).
+HTTP_METRICS = MetricsRegistry()
+METRICS_PUBLISH_INTERVAL = 5.0
+# If set, /metrics requires "Authorization: Bearer <METRICS_TOKEN>"
+METRICS_TOKEN = os.getenv('METRICS_TOKEN')
+METRICS_HELP = {
+    "http_requests_total": "HTTP requests by route, method and status",
+    "http_request_duration_ms": "Time to produce the response (first byte for streams)",
+    "json_serialize_ms": "Time spent encoding JSON response bodies",
+    "sim_tick_ms": "Duration of one simulation tick",
+    "fleet_pending_commands": "Commands queued for a vehicle, not yet fetched",
+    "fleet_vehicle_update_age_seconds": "Seconds since the vehicle last reported",
+    "fleet_vehicles_by_liveness": "Vehicles online, stale (reports late) or offline",
+    "liveness_sweep_ms": "Duration of one liveness sweep",
+    "geofence_events_total": "Geofence enter/exit events raised",
+    "telemetry_fixes_total": "Vehicle fixes received, by wire format",
+    "http_throttled_total": "Requests refused with 429 by a rate limit",
+    "http_shed_total": "Requests refused with 503 by admission control",
+    "admission_wait_ms": "Time requests waited for an admission slot",
 }
 
-# Store pending commands for vehicles to fetch
-# Key: acs_id, Value: list of encrypted command strings
-PENDING_COMMANDS = {}
+# Rate limits (token buckets, per worker process; 0 disables one). Each
+# vehicle may make VEHICLE_RATE_LIMIT requests/s (bursts of
+# VEHICLE_RATE_BURST) to its telemetry and log endpoints, and as many again
+# to its command channel. A logged-in session gets SESSION_RATE_LIMIT and any
+# other client CLIENT_RATE_LIMIT per address (clients behind one NAT share
+# it). Stop commands count against no session or address budget. Requests
+# over a limit get 429 with Retry-After.
+VEHICLE_RATE_LIMIT = float(os.getenv('VEHICLE_RATE_LIMIT', '20'))
+VEHICLE_RATE_BURST = float(os.getenv('VEHICLE_RATE_BURST', '40'))
+SESSION_RATE_LIMIT = float(os.getenv('SESSION_RATE_LIMIT', '20'))
+SESSION_RATE_BURST = float(os.getenv('SESSION_RATE_BURST', '40'))
+CLIENT_RATE_LIMIT = float(os.getenv('CLIENT_RATE_LIMIT', '100'))
+CLIENT_RATE_BURST = float(os.getenv('CLIENT_RATE_BURST', '200'))
+VEHICLE_LIMITER = RateLimiter(VEHICLE_RATE_LIMIT, VEHICLE_RATE_BURST) if VEHICLE_RATE_LIMIT > 0 else None
+SESSION_LIMITER = RateLimiter(SESSION_RATE_LIMIT, SESSION_RATE_BURST) if SESSION_RATE_LIMIT > 0 else None
+CLIENT_LIMITER = RateLimiter(CLIENT_RATE_LIMIT, CLIENT_RATE_BURST) if CLIENT_RATE_LIMIT > 0 else None
+
+# Admission control (see admission.py): each worker process works on at most
+# ADMISSION_MAX_ACTIVE requests at once, on at most ADMISSION_LOW_MAX_ACTIVE
+# low-priority ones (telemetry, dashboard polling; one /api/data of a large
+# fleet holds the interpreter for tens of ms), so the rest stay free for
+# commands and admin requests. Requests that get no
+# slot within ADMISSION_MAX_WAIT seconds (ADMISSION_LOW_MAX_WAIT for low
+# priority) get 503. Stop commands and the vehicles' command channel are
+# always admitted. 0 disables admission control.
+ADMISSION_MAX_ACTIVE = int(os.getenv('ADMISSION_MAX_ACTIVE', '4'))
+ADMISSION_LOW_MAX_ACTIVE = int(os.getenv('ADMISSION_LOW_MAX_ACTIVE', '2'))
+ADMISSION_MAX_WAIT = float(os.getenv('ADMISSION_MAX_WAIT', '0.5'))
+ADMISSION_LOW_MAX_WAIT = float(os.getenv('ADMISSION_LOW_MAX_WAIT', '0.05'))
+ADMISSION = (AdmissionController(ADMISSION_MAX_ACTIVE, ADMISSION_LOW_MAX_ACTIVE, ADMISSION_MAX_WAIT, ADMISSION_LOW_MAX_WAIT)
+             if ADMISSION_MAX_ACTIVE > 0 else None)
+# Routes by priority; the rest are NORMAL. /api/control and its broadcast
+# are CRITICAL for "stop". Parked routes (long-polls, streams) pass
+# admission but do not hold a slot while parked.
+CRITICAL_ROUTES = {'/api/vehicle/command/<acs_id>', '/api/vehicle/command/<acs_id>/wait',
+                   '/api/vehicle/command/<acs_id>/ack'}
+LOW_ROUTES = {'/api/data', '/api/stream', '/api/vehicle/update', '/api/vehicle/update/batch',
+              '/api/vehicle/<acs_id>/logs', '/api/vehicle/<acs_id>/track', '/api/tracks/within',
+              '/api/geo/nearby', '/api/geo/within'}
+PARKED_ROUTES = {'/api/stream', '/api/vehicle/command/<acs_id>/wait'}
+# Routes used by vehicles, limited per vehicle instead of per session or
+# address (the update routes name the vehicle in the body and check inside)
+VEHICLE_ROUTES = CRITICAL_ROUTES | {'/api/vehicle/update', '/api/vehicle/update/batch'}
+
+# Sampling profiler of this worker process, off until started via /api/profiler
+PROFILER = SamplingProfiler()
+PROFILER_MAX_SECONDS = 300
+
+# Command encryption: "v2" = authenticated per-vehicle envelope (see crypto.py),
+# "legacy" = shared-key CBC for vehicles not yet upgraded
+COMMAND_ENVELOPE = os.getenv('COMMAND_ENVELOPE', 'v2')
+
+# Fleet versions restart with the fleet state; the epoch lets a reconnecting
+# dashboard stream detect that and fall back to a full snapshot.
+STREAM_EPOCH = None
+STREAM_KEEPALIVE = 15      # Seconds between keepalive comments when idle
+STREAM_MIN_INTERVAL = 0.1  # Coalesce bursts into at most 10 frames/s
+
+def bind_state(state):
+    """
+    Points the module-level handles used by the routes at `state`.
+    """
+    global STATE, FLEET, TRACKS, BROADCASTS, METRICS, LOGS, GEO, SIMULATOR, VEHICLE_GROUPS, STREAM_EPOCH
+    STATE = state
+    FLEET = state.fleet
+    TRACKS = state.tracks
+    BROADCASTS = state.broadcasts
+    METRICS = state.metrics
+    LOGS = state.logs
+    GEO = state.geo
+    SIMULATOR = state.simulator
+    VEHICLE_GROUPS = state.groups
+    STREAM_EPOCH = state.epoch
+
+def create_app(state=None):
+    """
+    Application factory. Uses `state`, else the state server at
+    FLEET_STATE_SOCKET, else a new in-process FleetState (single worker
+    only). Background tasks are not started; see start_background_tasks.
+    """
+    if state is None and FLEET_STATE_SOCKET:
+        state = connect(FLEET_STATE_SOCKET)
+    elif state is None:
+        state = FleetState()
+        atexit.register(state.close)
+    bind_state(state)
+    app = Flask(__name__)
+    app.secret_key = FLASK_SECRET_KEY or os.urandom(24)
+    app.register_blueprint(bp)
+    return app
+
+def close_state():
+    """
+    Closes in-process state now instead of at exit (flushing the SQLite
+    backend's pending batch and the track store), for processes that leave
+    through os._exit. A shared state server closes its own.
+    """
+    if isinstance(STATE, FleetState):
+        atexit.unregister(STATE.close)
+        STATE.close()
 
-# Simulation Thread to move cars
-def simulate_movement():
+def start_background_tasks():
+    """
+    Starts the simulator of in-process state (a shared state server runs
+    its own). With a shared state server, starts publishing this worker's
+    request metrics to it.
+    """
+    STATE.start_background_tasks()
+    if isinstance(STATE, RemoteState):
+        threading.Thread(target=publish_metrics, name="metrics-publisher", daemon=True).start()
+
+def publish_metrics():
+    worker = str(os.getpid())
     while True:
-        for car_id, data in CARS.items():
-            if data["status"] == "Running":
-                # Add random small movement
-                data["lat"] += random.uniform(-0.00005, 0.00005)
-                data["lon"] += random.uniform(-0.00005, 0.00005)
-        time.sleep(1)
+        time.sleep(METRICS_PUBLISH_INTERVAL)
+        try:
+            STATE.publish_worker_metrics(worker, HTTP_METRICS.raw())
+        except (OSError, EOFError) as e:
+            print(f"[METRICS] Could not publish to the state server: {e}")
+
+# Request instrumentation. Series names are cached per (route, method, status).
+_request_series = {}
+
+@bp.before_app_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@bp.after_app_request
+def record_request(response):
+    started = g.get('request_started')
+    if started is not None:
+        rule = request.url_rule.rule if request.url_rule else "[unmatched]"
+        key = (rule, request.method, response.status_code)
+        names = _request_series.get(key)
+        if names is None:
+            names = _request_series.setdefault(key, (
+                series("http_requests_total", route=rule, method=request.method, status=response.status_code),
+                series("http_request_duration_ms", route=rule, method=request.method),
+            ))
+        HTTP_METRICS.inc(names[0])
+        HTTP_METRICS.observe(names[1], (time.perf_counter() - started) * 1000, FAST_BUCKETS_MS)
+    return response
+
+def request_priority(rule):
+    if rule in CRITICAL_ROUTES:
+        return CRITICAL
+    if rule in ('/api/control', '/api/control/broadcast') and request.method == 'POST':
+        data = request.get_json(silent=True)
+        return CRITICAL if isinstance(data, dict) and data.get('action') == 'stop' else NORMAL
+    return LOW if rule in LOW_ROUTES else NORMAL
+
+_admission_series = {}
+
+def count_refused(name, route, **labels):
+    key = (name, route) + tuple(labels.values())
+    metric = _admission_series.get(key) or _admission_series.setdefault(key, series(name, route=route, **labels))
+    HTTP_METRICS.inc(metric)
+
+def throttled(limiter, key, kind, route):
+    """
+    Takes a token for `key`. Returns a 429 response if it has none left,
+    else None.
+    """
+    if limiter is None:
+        return None
+    retry_after = limiter.acquire(key)
+    if not retry_after:
+        return None
+    count_refused("http_throttled_total", route, limit=kind)
+    response = jsonify({"status": "error", "message": f"Rate limit exceeded ({kind})"})
+    response.status_code = 429
+    response.headers['Retry-After'] = str(math.ceil(retry_after))
+    return response
+
+@bp.before_app_request
+def admit_request():
+    """
+    Applies the rate limits and admission control before a route runs.
+    """
+    if request.endpoint == 'static' or request.url_rule is None:
+        return None
+    rule = request.url_rule.rule
+    priority = request_priority(rule)
+    acs_id = (request.view_args or {}).get('acs_id')
+    if rule in VEHICLE_ROUTES or (rule == '/api/vehicle/<acs_id>/logs' and request.method == 'POST'):
+        if acs_id is not None:
+            kind = "vehicle-commands" if rule in CRITICAL_ROUTES else "vehicle"
+            limited = throttled(VEHICLE_LIMITER, (kind, acs_id), kind, rule)
+            if limited:
+                return limited
+    elif priority != CRITICAL:
+        sid = session.get('sid') if session.get('logged_in') else None
+        limited = (throttled(SESSION_LIMITER, sid, "session", rule) if sid
+                   else throttled(CLIENT_LIMITER, request.remote_addr, "client", rule))
+        if limited:
+            return limited
 
-simulation_thread = threading.Thread(target=simulate_movement, daemon=True)
-simulation_thread.start()
+    if ADMISSION is None:
+        return None
+    started = time.perf_counter()
+    if not ADMISSION.admit(priority):
+        count_refused("http_shed_total", rule, priority=PRIORITY_NAMES[priority])
+        response = jsonify({"status": "error", "message": "Server busy, retry shortly"})
+        response.status_code = 503
+        response.headers['Retry-After'] = '1'
+        return response
+    waited = (time.perf_counter() - started) * 1000
+    if waited >= 0.1:
+        HTTP_METRICS.observe(series("admission_wait_ms", priority=PRIORITY_NAMES[priority]), waited, FAST_BUCKETS_MS)
+    if rule in PARKED_ROUTES:
+        ADMISSION.release(priority)
+    else:
+        g.admission_priority = priority
+    return None
+
+@bp.teardown_app_request
+def release_admission(exc):
+    priority = g.pop('admission_priority', None)
+    if priority is not None:
+        ADMISSION.release(priority)
+
+def vehicle_throttled(acs_id):
+    # For routes that name the vehicle in the body
+    return throttled(VEHICLE_LIMITER, ("vehicle", acs_id), "vehicle", request.url_rule.rule)
+
+_json_series = {}
+
+def dumps_timed(payload, route):
+    """
+    json.dumps with the time recorded in json_serialize_ms{route=...}.
+    """
+    started = time.perf_counter()
+    body = json.dumps(payload, separators=(',', ':'))
+    name = _json_series.get(route) or _json_series.setdefault(route, series("json_serialize_ms", route=route))
+    HTTP_METRICS.observe(name, (time.perf_counter() - started) * 1000, FAST_BUCKETS_MS)
+    return body
+
+def json_response(payload, route):
+    return Response(dumps_timed(payload, route) + "\n", mimetype='application/json')
+
+def accepts_gzip():
+    return 'gzip' in request.headers.get('Accept-Encoding', '')
+
+def gzip_response(response):
+    """
+    Compresses a buffered response for clients that accept gzip, if it is
+    large enough to be worth it.
+    """
+    if not accepts_gzip() or response.content_length is None or response.content_length < GZIP_MIN_BYTES:
+        return response
+    response.set_data(gzip.compress(response.get_data(), GZIP_LEVEL))
+    response.headers['Content-Encoding'] = 'gzip'
+    response.vary.add('Accept-Encoding')
+    return response
+
+def gzip_stream(chunks):
+    """
+    Compresses a streamed response as one gzip stream, flushed after every
+    chunk so each event still reaches the client at once. Repeated keys
+    compress against earlier events.
+    """
+    compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        yield compressor.compress(chunk.encode()) + compressor.flush(zlib.Z_SYNC_FLUSH)
+
+def request_body():
+    """
+    The raw request body, gunzipped if sent with Content-Encoding: gzip.
+    Raises ValueError for a corrupt or oversized gzip body.
+    """
+    body = request.get_data(cache=False)
+    if request.content_encoding == 'gzip':
+        body = gunzip(body, TELEMETRY_MAX_BYTES)
+    return body
+
+def wire_format():
+    if request.mimetype == TELEMETRY_MIME:
+        return "binary"
+    return "json-gzip" if request.content_encoding == 'gzip' else "json"
+
+_telemetry_series = {}
+
+def count_fixes(count):
+    fmt = wire_format()
+    name = _telemetry_series.get(fmt) or _telemetry_series.setdefault(
+        fmt, series("telemetry_fixes_total", format=fmt))
+    HTTP_METRICS.inc(name, count)
 
 # Routes
-@app.route('/')
+@bp.route('/')
 def index():
     return render_template('index.html')
 
-@app.route('/login', methods=['GET', 'POST'])
+@bp.route('/login', methods=['GET', 'POST'])
 def login():
     if request.method == 'POST':
         username = request.form.get('username')
@@ -50,91 +385,677 @@ def login():
         # Hardcoded admin credentials for demo
         if username == "admin" and password == "admin123":
             session['logged_in'] = True
-            return redirect(url_for('admin'))
+            session['sid'] = os.urandom(8).hex()   # Key of this session's rate limit
+            return redirect(url_for('.admin'))
         else:
             return render_template('login.html', error="Invalid Credentials")
     return render_template('login.html')
 
-@app.route('/logout')
+@bp.route('/logout')
 def logout():
     session.pop('logged_in', None)
-    return redirect(url_for('index'))
+    return redirect(url_for('.index'))
 
-@app.route('/admin')
+@bp.route('/admin')
 def admin():
     if not session.get('logged_in'):
-        return redirect(url_for('login'))
+        return redirect(url_for('.login'))
     return render_template('admin.html')
 
 # API Endpoints for UI
-@app.route('/api/data')
+@bp.route('/api/data')
 def get_data():
-    return jsonify(CARS)
+    """
+    Every vehicle: {"ACS01": {"lat", "lon", "status", "path", "liveness",
+    "last_seen"}, ...}. Clients sending "Accept: application/x-fleet-snapshot"
+    get the same in the binary format of telemetry_codec.py.
+    """
+    version, cars = FLEET.snapshot()
+    response = None
+    if request.accept_mimetypes.best_match(['application/json', SNAPSHOT_MIME]) == SNAPSHOT_MIME:
+        try:
+            response = Response(encode_snapshot(version, cars, time.time()), mimetype=SNAPSHOT_MIME)
+        except Exception as e:
+            # Does not fit the binary format (e.g. too many distinct strings);
+            # one odd vehicle must not break the snapshot for every dashboard
+            print(f"[WIRE] Snapshot sent as JSON: {type(e).__name__}: {e}")
+    if response is None:
+        response = json_response(cars, '/api/data')
+    response.vary.add('Accept')
+    return gzip_response(response)
+
+def parse_stream_cursor(cursor):
+    """
+    Parses an "<epoch>:<version>" stream event id.
+    Returns the version, or None if the cursor is missing or from an
+    earlier server process (the client then needs a full snapshot).
+    """
+    if not cursor:
+        return None
+    epoch, _, version = cursor.partition(':')
+    if epoch != STREAM_EPOCH or not version.isdigit():
+        return None
+    version = int(version)
+    return version if version <= FLEET.version else None
+
+def stream_event(event, version, payload):
+    return f"id: {STREAM_EPOCH}:{version}\nevent: {event}\ndata: {dumps_timed(payload, '/api/stream')}\n\n"
+
+@bp.route('/api/stream')
+def stream_data():
+    """
+    Server-Sent Events feed of fleet state for the dashboards.
+    Sends a "snapshot" event with every car, then "delta" events holding only
+    the cars that changed. Each event id carries the fleet version, so a
+    reconnecting EventSource (Last-Event-ID header) or ?since=<id> resumes
+    with a delta instead of a new snapshot.
+    """
+    cursor = request.headers.get('Last-Event-ID') or request.args.get('since')
+    since = parse_stream_cursor(cursor)
+
+    def generate(version):
+        if version is None:
+            version, snapshot = FLEET.snapshot()
+            yield stream_event('snapshot', version, snapshot)
+
+        while True:
+            FLEET.wait_for_change(version, timeout=STREAM_KEEPALIVE)
+            current, changed = FLEET.changes_since(version)
+            if changed:
+                yield stream_event('delta', current, changed)
+            else:
+                yield ": keepalive\n\n"
+            version = current
+            time.sleep(STREAM_MIN_INTERVAL)
+
+    headers = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    if accepts_gzip():
+        headers.update({'Content-Encoding': 'gzip', 'Vary': 'Accept-Encoding'})
+        return Response(gzip_stream(generate(since)), mimetype='text/event-stream', headers=headers)
+    return Response(generate(since), mimetype='text/event-stream', headers=headers)
+
+@bp.route('/api/vehicle/<acs_id>/track')
+def get_vehicle_track(acs_id):
+    """
+    Position history of one vehicle.
+    Query: ?t0=<unix seconds>&t1=<unix seconds>&max_points=<n>
+    (defaults: the last hour, 1000 points)
+    Returns: {"acs_id": ..., "t0": ..., "t1": ..., "total": n, "points": [[t, lat, lon], ...]}
+    """
+    now = time.time()
+    t0 = request.args.get('t0', now - 3600, type=float)
+    t1 = request.args.get('t1', now, type=float)
+    max_points = request.args.get('max_points', 1000, type=int)
+    max_points = max(2, min(max_points, TRACK_MAX_POINTS))
+
+    points, total = TRACKS.track(acs_id, t0, t1, max_points)
+    return json_response({"acs_id": acs_id, "t0": t0, "t1": t1, "total": total, "points": points},
+                         '/api/vehicle/<acs_id>/track')
+
+@bp.route('/api/tracks/within')
+def get_vehicles_within():
+    """
+    Vehicles that had at least one fix inside a bounding box during a time window.
+    Query: ?min_lat=&min_lon=&max_lat=&max_lon=&t0=&t1= (t0/t1 default to the last hour)
+    Returns: {"vehicles": {"ACS01": <first time seen>, ...}}
+    """
+    now = time.time()
+    try:
+        box = [float(request.args[name]) for name in ('min_lat', 'min_lon', 'max_lat', 'max_lon')]
+    except (KeyError, ValueError):
+        return jsonify({"status": "error", "message": "min_lat, min_lon, max_lat and max_lon are required"}), 400
+    t0 = request.args.get('t0', now - 3600, type=float)
+    t1 = request.args.get('t1', now, type=float)
+    if not all(math.isfinite(value) for value in (*box, t0, t1)):
+        return jsonify({"status": "error", "message": "Coordinates and times must be finite numbers"}), 400
+    # Nothing is kept outside the retention window
+    oldest, newest = now - TRACK_RETENTION_HOURS * 3600, now + FIX_MAX_FUTURE
+    t0, t1 = max(t0, oldest), min(t1, newest)
+
+    return jsonify({"vehicles": TRACKS.vehicles_in_box(*box, t0, t1)})
+
+@bp.route('/api/geo/nearby')
+def get_vehicles_nearby():
+    """
+    Vehicles whose current position is within a radius of a point.
+    Query: ?lat=&lon=&radius_m=<metres, default 50>&limit=<n>
+    Returns: {"vehicles": [["ACS01", <distance in metres>], ...]} nearest first
+    """
+    try:
+        lat, lon = float(request.args['lat']), float(request.args['lon'])
+        radius = float(request.args.get('radius_m', 50))
+    except (KeyError, ValueError):
+        return jsonify({"status": "error", "message": "lat and lon are required"}), 400
+    if not (math.isfinite(lat) and math.isfinite(lon)):
+        return jsonify({"status": "error", "message": "lat and lon must be finite numbers"}), 400
+    if not 0 < radius <= GEO_MAX_RADIUS_M:
+        return jsonify({"status": "error", "message": f"radius_m must be in (0, {GEO_MAX_RADIUS_M}]"}), 400
+    limit = request.args.get('limit', type=int)
+    return jsonify({"vehicles": GEO.within_radius(lat, lon, radius, limit)})
+
+@bp.route('/api/geo/within')
+def get_vehicles_in_box():
+    """
+    Vehicles whose current position is inside a bounding box (for past
+    positions see /api/tracks/within).
+    Query: ?min_lat=&min_lon=&max_lat=&max_lon=
+    Returns: {"vehicles": ["ACS01", ...]}
+    """
+    try:
+        box = [float(request.args[name]) for name in ('min_lat', 'min_lon', 'max_lat', 'max_lon')]
+    except (KeyError, ValueError):
+        return jsonify({"status": "error", "message": "min_lat, min_lon, max_lat and max_lon are required"}), 400
+    if not all(math.isfinite(value) for value in box):
+        return jsonify({"status": "error", "message": "Coordinates must be finite numbers"}), 400
+    return jsonify({"vehicles": GEO.within_box(*box)})
+
+@bp.route('/api/geofences', methods=['GET', 'POST'])
+def geofences():
+    """
+    GET: the geofences. POST: adds one (or replaces the one with the same
+    "id"); see GeoIndex.add_fence for the JSON, e.g.
+    {"kind": "circle", "center": [17.6018, 78.1268], "radius_m": 50, "on": "enter"}
+    """
+    if not session.get('logged_in'):
+        return jsonify({"status": "error", "message": "Unauthorized"}), 403
+    if request.method == 'GET':
+        return jsonify({"fences": GEO.fences()})
+    try:
+        fence = GEO.add_fence(request.json or {})
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    print(f"[GEOFENCE] Added {fence['kind']} fence {fence['id']}")
+    return jsonify({"status": "success", "fence": fence})
 
-@app.route('/api/control', methods=['POST'])
+@bp.route('/api/geofences/<path:fence_id>', methods=['DELETE'])
+def delete_geofence(fence_id):
+    if not session.get('logged_in'):
+        return jsonify({"status": "error", "message": "Unauthorized"}), 403
+    if not GEO.remove_fence(fence_id):
+        return jsonify({"status": "error", "message": "Unknown geofence"}), 404
+    print(f"[GEOFENCE] Removed fence {fence_id}")
+    return jsonify({"status": "success"})
+
+@bp.route('/api/geofences/events')
+def geofence_events():
+    """
+    Geofence breaches, oldest first.
+    Query: ?since=<cursor> for the events after a previous response's
+    "next" (default 0: all that are kept); ?limit=<n> caps the events returned.
+    Returns: {"events": [{"seq", "t", "acs_id", "type": "enter" | "exit",
+              "fence", "name", "lat", "lon"}, ...], "next": cursor, "dropped": n}
+    """
+    if not session.get('logged_in'):
+        return jsonify({"status": "error", "message": "Unauthorized"}), 403
+    limit = max(1, min(request.args.get('limit', GEO_MAX_EVENTS, type=int), GEO_MAX_EVENTS))
+    since = max(0, request.args.get('since', 0, type=int))
+    events, next_cursor, dropped = GEO.events_since(since, limit)
+    return jsonify({"events": events, "next": next_cursor, "dropped": dropped})
+
+def command_error(action, path):
+    """
+    Checks the action and path of a control request. Returns an error
+    message, or None if they can be sealed into a command.
+    """
+    if action not in ACTIONS:
+        return f"action must be one of {', '.join(ACTIONS)}"
+    # The legacy payload is '|'-delimited
+    if not text_field(path) or not path or (COMMAND_ENVELOPE == 'legacy' and '|' in path):
+        return f"path must be a non-empty string of at most {FIELD_MAX_CHARS} characters"
+    return None
+
+@bp.route('/api/control', methods=['POST'])
 def control_car():
     if not session.get('logged_in'):
         return jsonify({"status": "error", "message": "Unauthorized"}), 403
     
-    data = request.json
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({"status": "error", "message": "Invalid JSON body"}), 400
     acs_id = data.get('acs_id')
     action = data.get('action') # 'start' or 'stop'
     path = data.get('path', 'default_path')
+    error = command_error(action, path)
+    if error:
+        return jsonify({"status": "error", "message": error}), 400
 
-    if acs_id in CARS:
+    if isinstance(acs_id, str) and acs_id in FLEET:
         # 1. Encrypt Command
-        encrypted_command = encrypt_command(acs_id, path, action)
+        if COMMAND_ENVELOPE == 'legacy':
+            encrypted_command = encrypt_command(acs_id, path, action)
+        else:
+            encrypted_command = seal_command(acs_id, path, action)
         
-        # 2. Store for Vehicle to Fetch
-        if acs_id not in PENDING_COMMANDS:
-            PENDING_COMMANDS[acs_id] = []
-        PENDING_COMMANDS[acs_id].append(encrypted_command)
+        # 2. Store for Vehicle to Fetch (wakes any parked long-poll). A stop
+        # cancels whatever is still pending rather than waiting behind it.
+        command_id = FLEET.enqueue_command(acs_id, encrypted_command, supersede=action == "stop")
         
         # 3. Optimistic UI Update (Simulation)
         if action == "start":
-            CARS[acs_id]["status"] = "Running"
+            FLEET.set_status(acs_id, "Running")
+            if SIMULATOR.set_path(acs_id, path):
+                FLEET.update(acs_id, path=path)
+            SIMULATOR.set_running(acs_id, True)
         elif action == "stop":
-            CARS[acs_id]["status"] = "Stopped"
+            FLEET.set_status(acs_id, "Stopped")
+            SIMULATOR.set_running(acs_id, False)
             
+        car = FLEET.get(acs_id)
         return jsonify({
             "status": "success", 
-            "car_status": CARS[acs_id]["status"],
+            "car_status": car["status"],
+            "liveness": car["liveness"],
+            "command_id": command_id,
             "encrypted_payload": encrypted_command,
             "decrypted_log": {"raw_command": "Command Queued for Vehicle Fetch"} 
         })
             
     return jsonify({"status": "error", "message": "Car not found"}), 404
 
+def resolve_targets(target):
+    """
+    Expands a broadcast target into (vehicle ids, unknown ids).
+    target: "all", "group:<name>", "path:<path>" or a list of acs_ids.
+    Returns None for a malformed target.
+    """
+    if isinstance(target, list):
+        ids = [acs_id for acs_id in dict.fromkeys(target) if isinstance(acs_id, str)]
+    elif target == "all":
+        return FLEET.ids(), []
+    elif isinstance(target, str) and target.startswith("group:"):
+        if target[6:] not in VEHICLE_GROUPS:
+            return None
+        ids = list(dict.fromkeys(VEHICLE_GROUPS[target[6:]]))
+    elif isinstance(target, str) and target.startswith("path:"):
+        _, cars = FLEET.snapshot()
+        return [acs_id for acs_id, car in cars.items() if car["path"] == target[5:]], []
+    else:
+        return None
+    known = [acs_id for acs_id in ids if acs_id in FLEET]
+    return known, [acs_id for acs_id in ids if acs_id not in FLEET]
+
+@bp.route('/api/control/broadcast', methods=['POST'])
+def control_broadcast():
+    """
+    Sends one action to many vehicles in a single request.
+    Expected JSON: {"target": "all" | "group:<name>" | "path:<path>" | ["ACS01", ...],
+                    "action": "stop", "path": "Path-A"}
+    Commands are encrypted (one AES-GCM operation per vehicle in the v2
+    envelope, a batch in the legacy format) and queued atomically; parked
+    long-polls are woken at once. Track delivery with the returned
+    broadcast_id at /api/control/broadcast/<broadcast_id>.
+    """
+    if not session.get('logged_in'):
+        return jsonify({"status": "error", "message": "Unauthorized"}), 403
+
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({"status": "error", "message": "Invalid JSON body"}), 400
+    action = data.get('action')
+    path = data.get('path', 'default_path')
+    if not action:
+        return jsonify({"status": "error", "message": "Missing action"}), 400
+    error = command_error(action, path)
+    if error:
+        return jsonify({"status": "error", "message": error}), 400
+    resolved = resolve_targets(data.get('target'))
+    if resolved is None:
+        return jsonify({"status": "error", "message": "Invalid target"}), 400
+    ids, unknown = resolved
+    if not ids:
+        return jsonify({"status": "error", "message": "No vehicles matched", "unknown": unknown}), 404
+
+    triples = [(acs_id, path, action) for acs_id in ids]
+    if COMMAND_ENVELOPE == 'legacy':
+        encrypted = CODEC.encrypt_many(triples)
+    else:
+        encrypted = ENVELOPE.seal_many(triples)
+    broadcast_id = STATE.queue_broadcast(action, path, dict(zip(ids, encrypted)))
+
+    # Optimistic UI Update (Simulation), as in control_car
+    status = {"start": "Running", "stop": "Stopped"}.get(action)
+    if status:
+        updates = []
+        for acs_id in ids:
+            moved = action == "start" and SIMULATOR.set_path(acs_id, path)
+            SIMULATOR.set_running(acs_id, action == "start")
+            updates.append((acs_id, None, None, status, path if moved else None))
+        FLEET.update_many(updates)
+
+    print(f"[BROADCAST] {broadcast_id}: {action} queued for {len(ids)} vehicles")
+    return jsonify({
+        "status": "success",
+        "broadcast_id": broadcast_id,
+        "queued": len(ids),
+        "unknown": unknown,
+    })
+
+@bp.route('/api/control/broadcast/<broadcast_id>')
+def broadcast_status(broadcast_id):
+    """
+    Per-vehicle delivery status of a broadcast: queued -> delivered (the
+    vehicle fetched the command) -> acknowledged (the vehicle executed it)
+    -> confirmed (its telemetry reports the resulting status), or failed
+    (the vehicle reported an error, or never acked).
+    """
+    if not session.get('logged_in'):
+        return jsonify({"status": "error", "message": "Unauthorized"}), 403
+    broadcast = BROADCASTS.get(broadcast_id)
+    if broadcast is None:
+        return jsonify({"status": "error", "message": "Unknown broadcast"}), 404
+    return jsonify(broadcast)
+
 # API Endpoints for VEHICLES
-@app.route('/api/vehicle/update', methods=['POST'])
+@bp.route('/api/vehicle/update', methods=['POST'])
 def vehicle_update():
     """
     Endpoint for Vehicle Client to push GPS data.
     Expected JSON: {"acs_id": "ACS01", "lat": 17.5, "lon": 78.1, "status": "Running", "path": "Path-A"}
+    A binary telemetry body is handled as a batch (see vehicle_update_batch).
     """
-    data = request.json
-    acs_id = data.get('acs_id')
+    if request.mimetype == TELEMETRY_MIME:
+        return vehicle_update_batch()
+    if not request.is_json:
+        return unsupported_telemetry()
+    try:
+        data = json.loads(request_body())
+        acs_id = data.get('acs_id')
+    except (AttributeError, ValueError):
+        return jsonify({"status": "error", "message": "Invalid JSON body"}), 400
     
     if acs_id:
-        CARS[acs_id] = {
-            "lat": float(data.get('lat', 0)),
-            "lon": float(data.get('lon', 0)),
-            "status": data.get('status', 'Unknown'),
-            "path": data.get('path', 'Unknown')
-        }
+        status = data.get('status', 'Unknown')
+        path = data.get('path', 'Unknown')
+        if not (text_field(acs_id) and text_field(status) and text_field(path)):
+            return jsonify({"status": "error", "message": FIELD_ERROR}), 400
+        limited = vehicle_throttled(acs_id)
+        if limited:
+            return limited
+        try:
+            lat = float(data.get('lat', 0))
+            lon = float(data.get('lon', 0))
+        except (TypeError, ValueError):
+            return jsonify({"status": "error", "message": "lat and lon must be numbers"}), 400
+        if not (math.isfinite(lat) and math.isfinite(lon)):
+            return jsonify({"status": "error", "message": "Invalid fix"}), 400
+        # A real vehicle takes over from the simulation (before the update,
+        # so a concurrent tick cannot overwrite it)
+        SIMULATOR.release(acs_id)
+        FLEET.update(
+            acs_id,
+            lat=lat,
+            lon=lon,
+            status=status,
+            path=path
+        )
+        TRACKS.append(acs_id, time.time(), lat, lon)
+        GEO.update(acs_id, lat, lon, path)
+        BROADCASTS.reported(acs_id, status)
+        count_fixes(1)
         return jsonify({"status": "success"})
     return jsonify({"status": "error", "message": "Missing acs_id"}), 400
 
-@app.route('/api/vehicle/command/<acs_id>', methods=['GET'])
+def text_field(value):
+    # Vehicle ids, statuses and paths are stored and sent to dashboards as
+    # short strings (the binary snapshot holds at most 255 bytes each)
+    return isinstance(value, str) and len(value) <= FIELD_MAX_CHARS
+
+def checked_fixes(fixes, now):
+    """
+    Bounds the (t, lat, lon, ...) fix times of a batch to the window the
+    track store keeps and drops unusable fixes (see FIX_MAX_FUTURE).
+    """
+    oldest, newest = now - TRACK_RETENTION_HOURS * 3600, now + FIX_MAX_FUTURE
+    kept = []
+    for fix in fixes:
+        t, lat, lon = fix[:3]
+        if not (math.isfinite(t) and math.isfinite(lat) and math.isfinite(lon)) or t < oldest:
+            continue
+        kept.append((newest,) + tuple(fix[1:]) if t > newest else fix)
+    return kept
+
+def unsupported_telemetry():
+    # 415 tells a client to fall back to another format; any 400 is about
+    # the data and is not retried in another format
+    return jsonify({"status": "error", "message": f"Send application/json or {TELEMETRY_MIME}"}), 415
+
+@bp.route('/api/vehicle/update/batch', methods=['POST'])
+def vehicle_update_batch():
+    """
+    Endpoint for Vehicle Client to push several buffered GPS fixes at once.
+    Expected JSON: {"acs_id": "ACS01", "fixes": [{"t": 1760600000.2, "lat": 17.5, "lon": 78.1,
+                    "status": "Running", "path": "Path-A"}, ...]}
+    or the same batch in the binary format of telemetry_codec.py
+    (Content-Type: application/x-fleet-telemetry); either may be gzipped.
+    The newest fix (by timestamp) becomes the vehicle's current position.
+    """
+    binary = request.mimetype == TELEMETRY_MIME
+    if not binary and not request.is_json:
+        return unsupported_telemetry()
+    now = time.time()
+    try:
+        if binary:
+            acs_id, fixes = decode_fixes(request_body())
+        else:
+            data = json.loads(request_body())
+            acs_id, fixes = data.get('acs_id'), data.get('fixes')
+            if acs_id and isinstance(fixes, list):
+                fixes = [(float(fix.get('t', now)), float(fix.get('lat', 0)), float(fix.get('lon', 0)),
+                          fix.get('status', 'Unknown'), fix.get('path', 'Unknown')) for fix in fixes]
+    except UnsupportedVersion:
+        return unsupported_telemetry()
+    except (AttributeError, TypeError, ValueError):
+        return jsonify({"status": "error", "message": "Invalid fix"}), 400
+
+    if not acs_id:
+        return jsonify({"status": "error", "message": "Missing acs_id"}), 400
+    if not isinstance(fixes, list) or not fixes:
+        return jsonify({"status": "error", "message": "Missing fixes"}), 400
+    if not (text_field(acs_id) and all(text_field(fix[3]) and text_field(fix[4]) for fix in fixes)):
+        return jsonify({"status": "error", "message": FIELD_ERROR}), 400
+    fixes = checked_fixes(fixes, now)
+    if not fixes:
+        # Nothing worth recording; accepted so the vehicle drops them
+        return jsonify({"status": "success", "accepted": 0})
+    limited = vehicle_throttled(acs_id)
+    if limited:
+        return limited
+
+    # Fixes are (t, lat, lon, status, path, ...) tuples in either format
+    history = sorted(fix[:3] for fix in fixes)
+    _, lat, lon, status, path = max(fixes, key=lambda fix: fix[0])[:5]
+
+    SIMULATOR.release(acs_id)
+    TRACKS.extend(acs_id, history)
+    FLEET.update(
+        acs_id,
+        lat=lat,
+        lon=lon,
+        status=status,
+        path=path
+    )
+    # Every fix, oldest first, so a breach between uploads is not missed
+    GEO.update_many([(acs_id, fix_lat, fix_lon, path) for _, fix_lat, fix_lon in history])
+    BROADCASTS.reported(acs_id, status)
+    count_fixes(len(fixes))
+    return jsonify({"status": "success", "accepted": len(fixes)})
+
+def command_response(acs_id, entry):
+    # Shared by the poll and long-poll endpoints
+    if entry is None:
+        return jsonify({"command": None, "command_id": None})
+    if entry["attempts"] == 1:
+        METRICS.observe("command_enqueue_to_fetch_ms", (entry["delivered_at"] - entry["enqueued_at"]) * 1000)
+    else:
+        METRICS.inc("command_redeliveries")
+    BROADCASTS.delivered(acs_id, entry["id"])
+    return jsonify({"command": entry["command"], "command_id": entry["id"]})
+
+@bp.route('/api/vehicle/command/<acs_id>', methods=['GET'])
 def get_vehicle_command(acs_id):
     """
     Endpoint for Vehicle Client to poll for commands.
-    Returns: {"command": "encrypted_string"} or {"command": null}
+    Kept as a fallback for clients that cannot use the long-poll endpoint.
+    Query: ?ack=1 to keep the command until it is acked (see command_ack)
+    Returns: {"command": "encrypted_string", "command_id": "..."} or {"command": null}
+    """
+    ack = request.args.get('ack', 0, type=int) == 1
+    return command_response(acs_id, FLEET.lease_command(acs_id, 0.0, ack=ack))
+
+@bp.route('/api/vehicle/command/<acs_id>/wait', methods=['GET'])
+def wait_vehicle_command(acs_id):
+    """
+    Long-poll endpoint for Vehicle Client command delivery.
+    Parks the request until a command is queued for acs_id or the timeout expires.
+    Query: ?timeout=<seconds> (capped at LONG_POLL_TIMEOUT), ?ack=1 as above
+    Returns: {"command": "encrypted_string", "command_id": "..."} or {"command": null}
+    """
+    timeout = request.args.get('timeout', LONG_POLL_TIMEOUT, type=float)
+    timeout = max(0.0, min(timeout, LONG_POLL_TIMEOUT))
+    ack = request.args.get('ack', 0, type=int) == 1
+    return command_response(acs_id, FLEET.lease_command(acs_id, timeout, ack=ack))
+
+@bp.route('/api/vehicle/command/<acs_id>/ack', methods=['POST'])
+def command_ack(acs_id):
+    """
+    Endpoint for Vehicle Client to confirm it executed a command fetched
+    with ?ack=1. Unacked commands are delivered again after COMMAND_ACK_TIMEOUT.
+    Expected JSON: {"command_id": "...", "status": "ok" | "error", "message": "..."}
+    """
+    data = request.json or {}
+    command_id = data.get('command_id')
+    if not command_id:
+        return jsonify({"status": "error", "message": "Missing command_id"}), 400
+
+    entry = FLEET.ack_command(acs_id, command_id)
+    if entry is None:
+        # Already acked, or given up after too many deliveries
+        return jsonify({"status": "error", "message": "Unknown command"}), 404
+
+    now = time.time()
+    METRICS.observe("command_fetch_to_ack_ms", (now - entry["delivered_at"]) * 1000)
+    METRICS.observe("command_enqueue_to_ack_ms", (now - entry["enqueued_at"]) * 1000)
+    ok = data.get('status', 'ok') == 'ok'
+    METRICS.inc("commands_acked" if ok else "commands_failed")
+    if not ok:
+        print(f"[COMMAND] {command_id} failed on {acs_id}: {data.get('message')}")
+    BROADCASTS.acknowledged(acs_id, command_id, ok, data.get('message'))
+    return jsonify({"status": "success"})
+
+@bp.route('/api/vehicle/<acs_id>/logs', methods=['POST'])
+def vehicle_logs_upload(acs_id):
+    """
+    Endpoint for Vehicle Client to upload new stack stdout/stderr lines.
+    Expected JSON: {"source": "<client instance>", "dropped": 0,
+                    "lines": [[seq, t, "stdout" | "stderr" | "client", "text"], ...]}
+    Lines already received from the same source are ignored, so a retried
+    upload is harmless.
     """
-    if acs_id in PENDING_COMMANDS and PENDING_COMMANDS[acs_id]:
-        cmd = PENDING_COMMANDS[acs_id].pop(0)
-        return jsonify({"command": cmd})
-    return jsonify({"command": None})
+    data = request.json or {}
+    lines = data.get('lines')
+    if not isinstance(lines, list) or len(lines) > LOG_UPLOAD_MAX_LINES:
+        return jsonify({"status": "error", "message": f"lines must be a list of at most {LOG_UPLOAD_MAX_LINES}"}), 400
+    try:
+        lines = [(int(seq), float(t), str(stream), str(text)) for seq, t, stream, text in lines]
+        dropped = int(data.get('dropped', 0))
+    except (TypeError, ValueError):
+        return jsonify({"status": "error", "message": "Invalid line"}), 400
+    added = LOGS.append_lines(acs_id, lines, str(data.get('source')), dropped)
+    return jsonify({"status": "success", "accepted": added})
+
+@bp.route('/api/vehicle/<acs_id>/logs')
+def vehicle_logs(acs_id):
+    """
+    Recent stack log lines of one vehicle.
+    Query: ?tail=<n> for the last n lines (default 100), or ?since=<cursor>
+    for the lines after a previous response's "next" (to follow the log,
+    pass it back each time); ?limit=<n> caps the lines returned.
+    Returns: {"acs_id": ..., "lines": [[seq, t, stream, text], ...], "next": cursor, "dropped": n}
+    ("dropped": lines after `since` that no longer fit in the buffer)
+    """
+    if not session.get('logged_in'):
+        return jsonify({"status": "error", "message": "Unauthorized"}), 403
+    limit = max(1, min(request.args.get('limit', LOG_MAX_LINES, type=int), LOG_MAX_LINES))
+    since = request.args.get('since', type=int)
+    if since is None:
+        tail = max(1, min(request.args.get('tail', 100, type=int), limit))
+        lines = LOGS.tail(acs_id, tail)
+        next_cursor, dropped = (lines[-1][0] if lines else 0), 0
+    else:
+        lines, next_cursor, dropped = LOGS.lines_since(acs_id, max(0, since), limit)
+    return jsonify({"acs_id": acs_id, "lines": lines, "next": next_cursor, "dropped": dropped})
+
+@bp.route('/api/metrics/commands')
+def command_metrics():
+    """
+    Command delivery counters and enqueue -> fetch -> ack latency
+    histograms (milliseconds), plus current queue depth.
+    """
+    if not session.get('logged_in'):
+        return jsonify({"status": "error", "message": "Unauthorized"}), 403
+    result = METRICS.snapshot("command")
+    result["queued"] = sum(FLEET.command_depths().values())
+    return jsonify(result)
+
+@bp.route('/metrics')
+def prometheus_metrics():
+    """
+    Prometheus text exposition: per-route request counts and latency,
+    JSON serialization time, command delivery metrics, simulation tick
+    duration, vehicles per liveness state, and per-vehicle pending command
+    depth and update age.
+    """
+    if METRICS_TOKEN and request.headers.get('Authorization') != f"Bearer {METRICS_TOKEN}":
+        return Response("Unauthorized\n", status=401, mimetype='text/plain')
+    worker = str(os.getpid())
+    raw = merge_raw([HTTP_METRICS.raw(), METRICS.raw()] + STATE.worker_metrics(worker))
+
+    now = time.time()
+    depths = FLEET.command_depths()
+    gauges = [(series("fleet_pending_commands", acs_id=acs_id), depth) for acs_id, depth in depths.items()]
+    gauges.append(("fleet_pending_commands_total", sum(depths.values())))
+    update_times = FLEET.update_times()
+    gauges.append(("fleet_vehicles", len(update_times)))
+    gauges += [(series("fleet_vehicles_by_liveness", state=state), count)
+               for state, count in FLEET.liveness_counts().items()]
+    gauges += [(series("fleet_vehicle_update_age_seconds", acs_id=acs_id), now - updated_at)
+               for acs_id, updated_at in update_times.items() if updated_at is not None]
+    gauges.append(("profiler_running", int(PROFILER.running)))
+    return Response(render_prometheus(raw, gauges, METRICS_HELP), mimetype='text/plain; version=0.0.4')
+
+@bp.route('/api/profiler', methods=['GET', 'POST'])
+def profiler():
+    """
+    Sampling profiler of the worker process serving the request.
+    POST {"action": "start", "interval_ms": 10, "seconds": 60} or {"action": "stop"}.
+    GET returns its status; GET ?format=collapsed&limit=<n> returns the
+    sampled stacks as "frame;frame;frame count" lines (flame graph input).
+    """
+    if not session.get('logged_in'):
+        return jsonify({"status": "error", "message": "Unauthorized"}), 403
+    if request.method == 'GET':
+        if request.args.get('format') == 'collapsed':
+            return Response(PROFILER.report(request.args.get('limit', type=int)), mimetype='text/plain')
+        return jsonify(dict(PROFILER.status(), pid=os.getpid()))
+
+    data = request.json or {}
+    action = data.get('action')
+    if action == 'start':
+        try:
+            interval = max(1.0, float(data.get('interval_ms', 10))) / 1000
+            seconds = min(float(data.get('seconds', 60)), PROFILER_MAX_SECONDS)
+        except (TypeError, ValueError):
+            return jsonify({"status": "error", "message": "Invalid interval_ms or seconds"}), 400
+        if not PROFILER.start(interval, seconds):
+            return jsonify({"status": "error", "message": "Profiler already running"}), 409
+    elif action == 'stop':
+        PROFILER.stop()
+    else:
+        return jsonify({"status": "error", "message": "action must be start or stop"}), 400
+    return jsonify(dict(PROFILER.status(), status="success", pid=os.getpid()))
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5000, debug=True)
+    # Development server; see wsgi.py for production serving
+    app = create_app()
+    start_background_tasks()
+    app.run(host='0.0.0.0', port=5000, debug=True, threaded=True, use_reloader=False)
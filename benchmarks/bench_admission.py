@@ -0,0 +1,180 @@
+"""
+Stop-command latency under overload, with and without admission control.
+
+    python benchmarks/bench_admission.py
+    python benchmarks/bench_admission.py --flood 128 --fleet 20000 --duration 20
+
+Starts wsgi.py (one worker, in-memory state, --fleet simulated vehicles so
+that /api/data is expensive) three times:
+
+    unprotected   ADMISSION_MAX_ACTIVE=0 and no rate limits
+    admission     the default ADMISSION_* settings, no rate limits
+    full          the defaults: admission control and rate limits
+
+and floods it from --flood threads (split over --processes load
+processes) that alternate telemetry uploads from --vehicles vehicle ids
+with /api/data polls, far more than one worker can serve. Meanwhile a
+logged-in dashboard session sends a stop command every --interval
+seconds. Reports the stop latency (p50/p99/max) and failures, and how
+many flood requests were served, shed (503) or throttled (429).
+"""
+import argparse
+import http.client
+import json
+import multiprocessing
+import os
+import random
+import sys
+import threading
+import time
+import urllib.parse
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from load_test import spawn_server
+
+MODES = {
+    "unprotected": {"ADMISSION_MAX_ACTIVE": "0", "VEHICLE_RATE_LIMIT": "0", "CLIENT_RATE_LIMIT": "0"},
+    "admission": {"VEHICLE_RATE_LIMIT": "0", "CLIENT_RATE_LIMIT": "0"},
+    "full": {},
+}
+ADMISSION_VARS = ("ADMISSION_MAX_ACTIVE", "ADMISSION_LOW_MAX_ACTIVE", "ADMISSION_MAX_WAIT", "ADMISSION_LOW_MAX_WAIT",
+                  "VEHICLE_RATE_LIMIT", "VEHICLE_RATE_BURST", "SESSION_RATE_LIMIT", "SESSION_RATE_BURST",
+                  "CLIENT_RATE_LIMIT", "CLIENT_RATE_BURST")
+
+def request(conn, method, path, body=None, headers=None):
+    conn.request(method, path, body, headers or {})
+    response = conn.getresponse()
+    return response.status, response.read(), response
+
+def flood_thread(host, port, vehicles, stop_at, counts, seed):
+    rng = random.Random(seed)
+    conn = http.client.HTTPConnection(host, port, timeout=10)
+    n = 0
+    while time.time() < stop_at:
+        n += 1
+        try:
+            if n % 2:
+                fix = {"acs_id": f"SIM{rng.randrange(vehicles):05d}", "lat": 17.6 + rng.random() * 0.01,
+                       "lon": 78.12 + rng.random() * 0.01, "status": "Running", "path": "Path-A"}
+                status, _, _ = request(conn, "POST", "/api/vehicle/update", json.dumps(fix),
+                                       {"Content-Type": "application/json"})
+            else:
+                status, _, _ = request(conn, "GET", "/api/data")
+        except (OSError, http.client.HTTPException):
+            status = "error"
+            conn.close()
+            conn = http.client.HTTPConnection(host, port, timeout=10)
+        counts[status] = counts.get(status, 0) + 1
+
+def flood_process(host, port, threads, vehicles, stop_at, seed, results):
+    counts = [{} for _ in range(threads)]
+    workers = [threading.Thread(target=flood_thread, args=(host, port, vehicles, stop_at, counts[n], seed * 1000 + n))
+               for n in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    total = {}
+    for thread_counts in counts:
+        for status, count in thread_counts.items():
+            total[status] = total.get(status, 0) + count
+    results.put(total)
+
+def login(host, port):
+    conn = http.client.HTTPConnection(host, port, timeout=10)
+    _, _, response = request(conn, "POST", "/login", "username=admin&password=admin123",
+                             {"Content-Type": "application/x-www-form-urlencoded"})
+    cookie = response.getheader("Set-Cookie").split(";", 1)[0]
+    request(conn, "POST", "/api/vehicle/update", json.dumps({"acs_id": "PROBE", "lat": 17.6, "lon": 78.12}),
+            {"Content-Type": "application/json"})
+    return conn, cookie
+
+def run(mode, args):
+    saved = {name: os.environ.pop(name, None) for name in ADMISSION_VARS + ("SIM_VEHICLES",)}
+    os.environ.update(MODES[mode], SIM_VEHICLES=str(args.fleet))
+    if mode != "unprotected" and args.max_active is not None:
+        os.environ["ADMISSION_MAX_ACTIVE"] = str(args.max_active)
+    try:
+        server, url = spawn_server(1)
+    finally:
+        for name, value in saved.items():
+            os.environ.pop(name, None)
+            if value is not None:
+                os.environ[name] = value
+    try:
+        host, port = urllib.parse.urlsplit(url).hostname, urllib.parse.urlsplit(url).port
+        conn, cookie = login(host, port)
+        body = json.dumps({"acs_id": "PROBE", "action": "stop", "path": "Path-A"})
+        headers = {"Content-Type": "application/json", "Cookie": cookie}
+
+        stop_at = time.time() + args.warmup + args.duration
+        results = multiprocessing.Queue()
+        per_process = max(1, args.flood // args.processes)
+        floods = [multiprocessing.Process(target=flood_process,
+                                          args=(host, port, per_process, args.vehicles, stop_at, n, results))
+                  for n in range(args.processes)]
+        for flood in floods:
+            flood.start()
+        time.sleep(args.warmup)
+
+        latencies, failures = [], {}
+        while time.time() < stop_at:
+            started = time.perf_counter()
+            try:
+                status, _, _ = request(conn, "POST", "/api/control", body, headers)
+            except (OSError, http.client.HTTPException):
+                status = "error"
+                conn.close()
+                conn = http.client.HTTPConnection(host, port, timeout=10)
+            elapsed = time.perf_counter() - started
+            if status == 200:
+                latencies.append(elapsed)
+            else:
+                failures[status] = failures.get(status, 0) + 1
+            time.sleep(max(0.0, args.interval - elapsed))
+
+        counts = {}
+        for _ in floods:
+            for status, count in results.get().items():
+                counts[status] = counts.get(status, 0) + count
+        for flood in floods:
+            flood.join()
+        return latencies, failures, counts
+    finally:
+        server.terminate()
+        server.wait()
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))] if values else float('nan')
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--flood', type=int, default=64, help="Flooding connections")
+    parser.add_argument('--processes', type=int, default=min(4, os.cpu_count() or 1), help="Load processes")
+    parser.add_argument('--vehicles', type=int, default=3000, help="Vehicle ids the flood uploads as")
+    parser.add_argument('--fleet', type=int, default=10000, help="Simulated vehicles on the server")
+    parser.add_argument('--duration', type=float, default=10.0, help="Measured seconds per run")
+    parser.add_argument('--warmup', type=float, default=2.0)
+    parser.add_argument('--interval', type=float, default=0.05, help="Seconds between stop commands")
+    parser.add_argument('--max-active', type=int, help="ADMISSION_MAX_ACTIVE (default: the server's)")
+    parser.add_argument('--modes', nargs='+', choices=list(MODES), default=list(MODES))
+    args = parser.parse_args()
+
+    print(f"{args.flood} flooding connections, {args.fleet} vehicles on the server, "
+          f"a stop command every {args.interval:g} s")
+    print(f"{'mode':12s} {'stops':>6s} {'failed':>7s} {'p50 ms':>8s} {'p99 ms':>8s} {'max ms':>8s}   "
+          f"{'flood ok/s':>10s} {'503/s':>8s} {'429/s':>8s}")
+    for mode in args.modes:
+        latencies, failures, counts = run(mode, args)
+        seconds = args.warmup + args.duration
+        print(f"{mode:12s} {len(latencies):6d} {sum(failures.values()):7d} {percentile(latencies, 0.5) * 1000:8.1f} "
+              f"{percentile(latencies, 0.99) * 1000:8.1f} {max(latencies, default=float('nan')) * 1000:8.1f}   "
+              f"{counts.get(200, 0) / seconds:10.0f} {counts.get(503, 0) / seconds:8.0f} "
+              f"{counts.get(429, 0) / seconds:8.0f}")
+        if failures or counts.get("error"):
+            print(f"{'':12s} stop failures: {failures}, flood errors: {counts.get('error', 0)}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+"""
+Capacity check: can the geofence index keep up with N vehicles at R Hz on one core?
+
+    python benchmarks/bench_geofence.py                    # 5000 vehicles @ 5 Hz
+    python benchmarks/bench_geofence.py --vehicles 20000 --fences 200 --queries 50
+
+Drives --vehicles simulated vehicles along the demo paths and feeds every
+tick into a GeoIndex with the path corridor fences plus --fences random
+circles and polygons, as the state server does. A --stray fraction of the
+vehicles drifts off its path and back, so corridor exits happen. Each tick
+also runs --queries "vehicles within 50 m" lookups. Reports the CPU the
+index needs at the requested rate (exits non-zero if over 100% of one
+core) and, for comparison, what testing every fence on every update and
+scanning every vehicle per lookup costs.
+"""
+import argparse
+import math
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fleet_store import FleetStore
+from geofence import GeoIndex, _corridor_test, _point_in_polygon
+from simulator import PATHS, FleetSimulator
+
+def random_fences(count, rng, lat0, lon0):
+    fences = []
+    for n in range(count):
+        lat, lon = lat0 + rng.uniform(-0.004, 0.004), lon0 + rng.uniform(-0.004, 0.004)
+        if n % 2:
+            fences.append({"kind": "circle", "center": [lat, lon], "radius_m": rng.uniform(10, 80), "on": "both"})
+        else:
+            size = rng.uniform(0.0002, 0.001)
+            fences.append({"kind": "polygon", "on": "both",
+                           "points": [[lat, lon], [lat + size, lon], [lat + size, lon + size], [lat, lon + size]]})
+    return fences
+
+def scan_cost(index, positions, queries, radius):
+    # What the fleet dict allows without an index: every fence on every
+    # update, every vehicle on every lookup
+    tests = []
+    for fence in index._fences.values():
+        points = [index._xy(lat, lon) for lat, lon in fence.points]
+        if fence.kind == 'circle':
+            (x0, y0), r2 = points[0], fence.radius ** 2
+            tests.append(lambda x, y, x0=x0, y0=y0, r2=r2: (x - x0) ** 2 + (y - y0) ** 2 <= r2)
+        elif fence.kind == 'polygon':
+            tests.append(lambda x, y, points=points: _point_in_polygon(x, y, points))
+        else:
+            pairs = zip(points, points[1:] + (points[:1] if fence.closed else []))
+            tests.append(_corridor_test([(ax, ay, bx, by) for (ax, ay), (bx, by) in pairs], fence.width))
+    vehicles = index._vehicles
+    started = time.perf_counter()
+    for _, lat, lon, _ in positions:
+        x, y = index._xy(lat, lon)
+        for test in tests:
+            test(x, y)
+    for lat, lon in queries:
+        x, y = index._xy(lat, lon)
+        [acs_id for acs_id, v in vehicles.items() if (v.x - x) ** 2 + (v.y - y) ** 2 <= radius * radius]
+    return time.perf_counter() - started
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--vehicles', type=int, default=5000)
+    parser.add_argument('--rate', type=float, default=5.0, help="Updates per vehicle per second")
+    parser.add_argument('--seconds', type=float, default=10.0, help="Simulated time")
+    parser.add_argument('--fences', type=int, default=50, help="Random circle/polygon fences besides the corridors")
+    parser.add_argument('--queries', type=int, default=10, help="Radius lookups per tick")
+    parser.add_argument('--stray', type=float, default=0.05, help="Fraction of vehicles that leave their path")
+    args = parser.parse_args()
+
+    rng = random.Random(1)
+    sim = FleetSimulator(FleetStore(), tick_rate=args.rate, seed=1)
+    ids = sim.add_synthetic(args.vehicles)
+    paths = {acs_id: sim.path_names[n % len(sim.path_names)] for n, acs_id in enumerate(ids)}
+    stray = set(rng.sample(ids, int(len(ids) * args.stray)))
+    lat0, lon0 = PATHS["Path-A"]["waypoints"][0]
+
+    index = GeoIndex(origin=(lat0, lon0))
+    for name, path in PATHS.items():
+        index.add_fence({"id": f"path:{name}", "kind": "corridor", "points": path["waypoints"], "closed": True,
+                         "width_m": 25, "on": "exit", "path": name})
+    for spec in random_fences(args.fences, rng, lat0, lon0):
+        index.add_fence(spec)
+
+    ticks = int(args.seconds * args.rate)
+    update_s = query_s = scan_s = 0.0
+    found = 0
+    for tick in range(ticks):
+        moved, lat, lon = sim.step(1.0 / args.rate)
+        # Strays swing up to ~60 m off the path and back every 20 s
+        offset = 0.00055 * math.sin(2 * math.pi * tick / (20 * args.rate))
+        positions = [(acs_id, a + offset if acs_id in stray else a, b, paths[acs_id])
+                     for acs_id, a, b in zip(moved, lat.tolist(), lon.tolist())]
+        queries = [(lat0 + rng.uniform(-0.004, 0.004), lon0 + rng.uniform(-0.004, 0.004))
+                   for _ in range(args.queries)]
+
+        started = time.perf_counter()
+        index.update_many(positions)
+        update_s += time.perf_counter() - started
+        started = time.perf_counter()
+        for q_lat, q_lon in queries:
+            found += len(index.within_radius(q_lat, q_lon, 50))
+        query_s += time.perf_counter() - started
+        if tick % max(1, int(args.rate)) == 0:
+            scan_s += scan_cost(index, positions, queries, 50) * max(1, int(args.rate))
+
+    stats = index.stats()
+    load = (update_s + query_s) / args.seconds
+    print(f"{args.vehicles} vehicles @ {args.rate:g} Hz, {stats['fences']} fences, {args.queries} lookups/tick: "
+          f"{update_s / ticks * 1000:.1f} ms of updates + {query_s / ticks * 1000:.2f} ms of lookups per tick")
+    print(f"{args.vehicles * args.rate * args.seconds / update_s:,.0f} updates/s per core; "
+          f"{stats['events']} geofence events, {found / max(1, ticks * args.queries):.1f} vehicles per lookup")
+    print(f"Index needs {load:.0%} of one core; testing every fence and scanning every vehicle "
+          f"would need {scan_s / args.seconds:.0%}")
+    if load > 1.0:
+        print("FAIL: geofencing cannot keep up on one core")
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
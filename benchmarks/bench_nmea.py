@@ -0,0 +1,115 @@
+"""
+Benchmark: legacy parse_nmea_sentence vs nmea.py on an NMEA trace.
+
+    python benchmarks/bench_nmea.py                  # synthetic 1 hour trace at 5 Hz
+    python benchmarks/bench_nmea.py field_log.nmea   # recorded trace
+    python benchmarks/bench_nmea.py --hours 4 --corrupt 0.01
+
+The legacy path mirrors the old get_gps_data loop: decode each line and
+parse it if it starts with $GNGGA (no checksum). nmea.py is measured twice
+on the whole buffer in one pass, both with checksums verified: GGA only
+(same work as legacy), and GGA/RMC/VTG/GSA merged by epoch.
+"""
+import argparse
+import functools
+import math
+import operator
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import nmea
+from gps_reader import parse_nmea_sentence
+
+def _sentence(body):
+    checksum = functools.reduce(operator.xor, body.encode('ascii'), 0)
+    return f"${body}*{checksum:02X}\r\n"
+
+def _ddmm(value, width):
+    value = abs(value)
+    degrees = int(value)
+    return f"{degrees:0{width}d}{(value - degrees) * 60:07.4f}"
+
+def synthetic_trace(hours=1.0, rate=5, corrupt=0.0, seed=1):
+    """
+    Builds a GGA/RMC/VTG/GSA trace driving a loop around TiHAN IITH.
+    A `corrupt` fraction of lines gets one character flipped.
+    """
+    rng = random.Random(seed)
+    lines = []
+    epochs = int(hours * 3600 * rate)
+    for i in range(epochs):
+        t = i / rate
+        angle = t / 120.0
+        lat = 17.6018 + 0.001 * math.sin(angle)
+        lon = 78.1268 + 0.001 * math.cos(angle)
+        utc = f"{int(t // 3600) % 24:02d}{int(t // 60) % 60:02d}{t % 60:05.2f}"
+        lat_s, lon_s = _ddmm(lat, 2), _ddmm(lon, 3)
+        course = (math.degrees(-angle) + 360) % 360
+        lines.append(_sentence(f"GNGGA,{utc},{lat_s},N,{lon_s},E,1,12,0.8,545.4,M,-77.1,M,,"))
+        lines.append(_sentence(f"GNRMC,{utc},A,{lat_s},N,{lon_s},E,4.2,{course:.1f},161026,,,A"))
+        lines.append(_sentence(f"GNVTG,{course:.1f},T,,M,4.2,N,7.8,K,A"))
+        lines.append(_sentence("GNGSA,A,3,02,05,12,15,18,24,25,29,,,,,1.4,0.8,1.1"))
+    if corrupt:
+        for i in range(len(lines)):
+            if rng.random() < corrupt:
+                line = lines[i]
+                pos = rng.randrange(1, len(line) - 5)
+                lines[i] = line[:pos] + rng.choice('0123456789') + line[pos + 1:]
+    return ''.join(lines).encode('ascii')
+
+def bench_legacy(data):
+    fixes = 0
+    start = time.perf_counter()
+    for raw in data.split(b'\n'):
+        line = raw.decode('ascii', errors='replace').strip()
+        if line.startswith("$GNGGA"):
+            lat, lon, _ = parse_nmea_sentence(line)
+            if lat is not None and lon is not None:
+                fixes += 1
+    return time.perf_counter() - start, fixes
+
+def bench_gga(data):
+    start = time.perf_counter()
+    fixes = nmea.parse_buffer(data, types=('GGA',))
+    return time.perf_counter() - start, len(fixes)
+
+def bench_all(data):
+    start = time.perf_counter()
+    fixes = nmea.parse_buffer(data)
+    return time.perf_counter() - start, len(fixes)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('trace', nargs='?', help="NMEA log file (default: synthetic trace)")
+    parser.add_argument('--hours', type=float, default=1.0, help="Synthetic trace length")
+    parser.add_argument('--corrupt', type=float, default=0.0, help="Fraction of corrupted lines in synthetic trace")
+    parser.add_argument('--repeat', type=int, default=3, help="Runs per parser (best is reported)")
+    args = parser.parse_args()
+
+    if args.trace:
+        with open(args.trace, 'rb') as f:
+            data = f.read()
+        source = args.trace
+    else:
+        data = synthetic_trace(args.hours, corrupt=args.corrupt)
+        source = f"synthetic {args.hours:g} h @ 5 Hz, {args.corrupt:.1%} corrupt"
+
+    lines = data.count(b'\n')
+    print(f"Trace: {source} ({lines} lines, {len(data) / 1e6:.1f} MB)")
+
+    benches = (
+        ("legacy parse_nmea_sentence", bench_legacy),
+        ("nmea.parse_buffer GGA only", bench_gga),
+        ("nmea.parse_buffer all types", bench_all),
+    )
+    for name, bench in benches:
+        runs = [bench(data) for _ in range(args.repeat)]
+        elapsed, fixes = min(runs)
+        print(f"{name:28s} {elapsed * 1000:9.1f} ms  {lines / elapsed / 1e6:6.2f} M lines/s  {fixes} fixes")
+
+if __name__ == '__main__':
+    main()
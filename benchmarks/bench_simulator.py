@@ -0,0 +1,72 @@
+"""
+Capacity check: can the simulator drive N vehicles at R Hz on one core?
+
+    python benchmarks/bench_simulator.py                         # 5000 vehicles @ 5 Hz
+    python benchmarks/bench_simulator.py --vehicles 20000 --rate 5 --tracks
+    python benchmarks/bench_simulator.py --realtime --seconds 30
+
+Ticks are timed back to back (or paced in real time with --realtime) into a
+fresh FleetStore, optionally recording history in a TrackStore as real
+updates do. Reports tick latency and the share of one core the simulation
+needs at the requested rate; exits non-zero if that is over 100%.
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fleet_store import FleetStore
+from simulator import FleetSimulator
+from track_store import TrackStore
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--vehicles', type=int, default=5000)
+    parser.add_argument('--rate', type=float, default=5.0, help="Ticks per second")
+    parser.add_argument('--seconds', type=float, default=10.0, help="Simulated time")
+    parser.add_argument('--tracks', action='store_true', help="Also record positions in a TrackStore")
+    parser.add_argument('--realtime', action='store_true', help="Run the simulator thread at the real tick rate")
+    args = parser.parse_args()
+
+    store = FleetStore()
+    tracks = TrackStore() if args.tracks else None
+    sim = FleetSimulator(store, tick_rate=args.rate, tracks=tracks, seed=1)
+    started = time.perf_counter()
+    sim.add_synthetic(args.vehicles)
+    print(f"Registered {args.vehicles} vehicles in {time.perf_counter() - started:.2f} s")
+
+    ticks = int(args.seconds * args.rate)
+    if args.realtime:
+        cpu = time.process_time()
+        sim.start()
+        time.sleep(args.seconds)
+        sim.stop()
+        sim.join()
+        cpu = time.process_time() - cpu
+        load = cpu / args.seconds
+        print(f"{sim.ticks} ticks in {args.seconds:g} s, {sim.overruns} overruns, "
+              f"last tick {sim.last_tick_seconds * 1000:.1f} ms, CPU {load:.0%} of one core")
+    else:
+        durations = []
+        for _ in range(ticks):
+            started = time.perf_counter()
+            sim.tick(1.0 / args.rate)
+            durations.append(time.perf_counter() - started)
+        durations.sort()
+        mean = statistics.fmean(durations)
+        p99 = durations[min(len(durations) - 1, int(len(durations) * 0.99))]
+        load = mean * args.rate
+        print(f"{ticks} ticks: mean {mean * 1000:.1f} ms, p99 {p99 * 1000:.1f} ms, "
+              f"{args.vehicles * args.rate / load:,.0f} vehicle updates/s per core")
+        print(f"{args.vehicles} vehicles @ {args.rate:g} Hz needs {load:.0%} of one core")
+
+    print(f"Fleet version {store.version}" + (f", {tracks.stats()}" if tracks else ""))
+    if load > 1.0:
+        print("FAIL: simulation cannot keep up on one core")
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
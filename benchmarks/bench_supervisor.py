@@ -0,0 +1,75 @@
+"""
+Stop latency of the vehicle-stack supervisor.
+
+    python benchmarks/bench_supervisor.py                 # 20 runs, 10 processes per stack
+    python benchmarks/bench_supervisor.py --runs 50 --children 40
+
+Each run starts a stand-in stack (bash with --children sleeping children
+in its process group, plus one stray process outside it that matches the
+stray pattern), then times stop_stack() until the job has finished. Also
+times one /proc scan against a single `ps aux`, which the old stop path
+ran before forking pgrep/ps/pkill per process.
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from supervisor import ProcessSupervisor, scan_processes
+
+STRAY_MARKER = "bench-supervisor-stray"
+
+def _ms(values):
+    ordered = sorted(values)
+    return (f"median {statistics.median(ordered) * 1000:.1f} ms, "
+            f"p95 {ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000:.1f} ms, "
+            f"max {ordered[-1] * 1000:.1f} ms")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=20)
+    parser.add_argument('--children', type=int, default=10, help="Processes in each stand-in stack")
+    args = parser.parse_args()
+
+    stack = " ".join(["sleep 300 &"] * args.children) + " wait"
+    supervisor = ProcessSupervisor(stack, stray_patterns=(STRAY_MARKER,), close_windows=False)
+    supervisor.start()
+
+    stops = []
+    for _ in range(args.runs):
+        job = supervisor.start_stack()
+        job.wait()
+        # A leftover the supervisor did not launch, found by the /proc scan
+        stray = subprocess.Popen(['bash', '-c', f'exec -a {STRAY_MARKER} sleep 300'])
+        time.sleep(0.05)
+        started = time.perf_counter()
+        supervisor.stop_stack().wait()
+        stops.append(time.perf_counter() - started)
+        try:
+            stray.wait(1)
+        except subprocess.TimeoutExpired:
+            stray.kill()
+            sys.exit("Stray process survived the stop")
+
+    scans = []
+    for _ in range(args.runs):
+        started = time.perf_counter()
+        table = scan_processes()
+        scans.append(time.perf_counter() - started)
+    ps = []
+    for _ in range(args.runs):
+        started = time.perf_counter()
+        subprocess.run(['ps', 'aux'], capture_output=True)
+        ps.append(time.perf_counter() - started)
+    supervisor.stop()
+
+    print(f"stop_stack ({args.children} + 1 processes): {_ms(stops)}")
+    print(f"/proc scan ({len(table)} processes):       {_ms(scans)}")
+    print(f"ps aux:                               {_ms(ps)}")
+
+if __name__ == '__main__':
+    main()
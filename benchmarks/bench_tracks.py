@@ -0,0 +1,95 @@
+"""
+Benchmark: TrackStore ingest and queries over a day of 5 Hz fleet history.
+
+    python benchmarks/bench_tracks.py                      # 50 vehicles, 24 h, in memory
+    python benchmarks/bench_tracks.py --vehicles 200 --dir /tmp/tracks
+    python benchmarks/bench_tracks.py --dir tmp           # memory-mapped, throwaway temp dir
+
+Vehicles drive random loops around TiHAN IITH. Reports ingest rate, then the
+latency of track-window queries (downsampled) and of "which vehicles were in
+this box between t0 and t1" queries of several sizes.
+"""
+import argparse
+import math
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from track_store import TrackStore, CHUNK_SECONDS
+
+BASE_LAT, BASE_LON = 17.6018, 78.1268
+
+def generate(store, clock, vehicles, hours, rate, start):
+    rng = random.Random(7)
+    params = [(rng.uniform(0.0005, 0.01), rng.uniform(0, 2 * math.pi), rng.uniform(60, 900),
+               rng.uniform(-0.02, 0.02), rng.uniform(-0.02, 0.02)) for _ in range(vehicles)]
+    step = 1.0 / rate
+    per_chunk = int(CHUNK_SECONDS * rate)
+    total = int(hours * 3600 * rate)
+    for first in range(0, total, per_chunk):
+        count = min(per_chunk, total - first)
+        clock[0] = start + first * step
+        for v, (radius, phase, period, dlat, dlon) in enumerate(params):
+            fixes = []
+            for i in range(first, first + count):
+                t = start + i * step
+                angle = phase + 2 * math.pi * t / period
+                fixes.append((t, BASE_LAT + dlat + radius * math.sin(angle), BASE_LON + dlon + radius * math.cos(angle)))
+            store.extend(f"SIM{v:04d}", fixes)
+    return total * vehicles
+
+def timed(fn, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - started)
+    return best, result
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--vehicles', type=int, default=50)
+    parser.add_argument('--hours', type=float, default=24.0)
+    parser.add_argument('--rate', type=float, default=5.0, help="Fixes per second per vehicle")
+    parser.add_argument('--dir', help="Track directory (memory-mapped chunks), 'tmp' for a temporary one; default in memory")
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    directory = args.dir
+    cleanup = None
+    if directory == 'tmp':
+        directory = cleanup = tempfile.mkdtemp(prefix='tracks-')
+    start = 1_760_000_000.0
+    # Simulated time, so retention is measured against the generated day
+    clock = [start]
+    store = TrackStore(directory, retention=args.hours * 3600 + CHUNK_SECONDS, clock=lambda: clock[0])
+
+    started = time.perf_counter()
+    points = generate(store, clock, args.vehicles, args.hours, args.rate, start)
+    store.close()
+    elapsed = time.perf_counter() - started
+    print(f"Ingest: {points:,} points ({args.vehicles} vehicles x {args.hours:g} h @ {args.rate:g} Hz) "
+          f"in {elapsed:.1f} s ({points / elapsed:,.0f} points/s), {store.stats()}")
+
+    end = start + args.hours * 3600
+    seconds, (track, total) = timed(lambda: store.track("SIM0000", start, end, 1000), args.repeat)
+    print(f"track(full window, 1000 pts): {seconds * 1000:8.1f} ms ({total:,} points in window)")
+    seconds, _ = timed(lambda: store.track("SIM0000", end - 600, end, 1000), args.repeat)
+    print(f"track(last 10 min, 1000 pts): {seconds * 1000:8.1f} ms")
+
+    for label, half in (("50 m box", 0.00025), ("500 m box", 0.0025), ("5 km box", 0.025)):
+        box = (BASE_LAT - half, BASE_LON - half, BASE_LAT + half, BASE_LON + half)
+        for window, t0 in (("1 h", end - 3600), ("full", start)):
+            seconds, found = timed(lambda: store.vehicles_in_box(*box, t0, end), args.repeat)
+            print(f"vehicles_in_box({label}, {window:>4s}): {seconds * 1000:8.1f} ms  {len(found)} vehicles")
+
+    if cleanup:
+        shutil.rmtree(cleanup, ignore_errors=True)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,120 @@
+"""
+Bytes on the wire and parse/encode CPU: binary formats vs JSON.
+
+    python benchmarks/bench_wire.py
+    python benchmarks/bench_wire.py --batch 200 --vehicles 20000 --http
+
+Uplink: encodes --batch fixes as vehicle_client.py can send them (JSON,
+gzipped JSON, binary, gzipped binary) and reports the bytes per fix and
+the server-side CPU to turn a body into fixes, i.e. what
+/api/vehicle/update/batch does before touching the fleet store. With
+--http the whole request is also timed through the Flask app, which adds
+routing and the fleet store, track store and geofence updates.
+
+Downlink: encodes a --vehicles fleet snapshot as /api/data does (JSON,
+gzipped JSON, binary, gzipped binary) and reports size and encode time.
+"""
+import argparse
+import gzip
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from telemetry_codec import TELEMETRY_MIME, decode_fixes, encode_fixes, encode_snapshot, gunzip
+
+def make_fixes(count, t0=1760600000.0):
+    # Same shape as vehicle_client.get_gps_data()
+    return [{"acs_id": "ACS01", "lat": 17.6018381 + n * 2e-6, "lon": 78.1268661 - n * 1e-6,
+             "status": "Running", "path": "Active-Path", "gps_quality": 4, "gps_age": 0.13,
+             "t": t0 + n * 0.2} for n in range(count)]
+
+def parse_json(body, now=0.0):
+    # What the batch endpoint does with a JSON body
+    data = json.loads(body)
+    return data["acs_id"], [(float(fix.get('t', now)), float(fix.get('lat', 0)), float(fix.get('lon', 0)),
+                             fix.get('status', 'Unknown'), fix.get('path', 'Unknown')) for fix in data["fixes"]]
+
+def per_call(func, *args, seconds=0.5):
+    # Mean seconds per call, timed for at least `seconds`
+    calls, started = 0, time.perf_counter()
+    while True:
+        for _ in range(10):
+            func(*args)
+        calls += 10
+        elapsed = time.perf_counter() - started
+        if elapsed >= seconds:
+            return elapsed / calls
+
+def uplink(batch):
+    fixes = make_fixes(batch)
+    payload = json.dumps({"acs_id": "ACS01", "fixes": fixes}, separators=(',', ':')).encode()
+    bodies = {
+        "json": (payload, lambda body: parse_json(body)),
+        "json-gzip": (gzip.compress(payload), lambda body: parse_json(gunzip(body, 1 << 20))),
+        "binary": (encode_fixes("ACS01", fixes), decode_fixes),
+        "bin-gzip": (gzip.compress(encode_fixes("ACS01", fixes)), lambda body: decode_fixes(gunzip(body, 1 << 20))),
+    }
+    print(f"Uplink, batches of {batch} fixes:")
+    baseline = None
+    for name, (body, parse) in bodies.items():
+        seconds = per_call(parse, body) / batch
+        baseline = baseline or (len(body), seconds)
+        print(f"  {name:<10} {len(body) / batch:7.1f} bytes/fix ({len(body) / baseline[0]:4.0%})   "
+              f"parse {seconds * 1e6:6.2f} us/fix ({seconds / baseline[1]:4.0%})")
+    single = json.dumps(fixes[0], separators=(',', ':')).encode()
+    print(f"  (one fix per request as JSON, the pre-batch client: {len(single)} bytes + HTTP headers)")
+    return bodies
+
+def uplink_http(bodies, batch):
+    from app import create_app
+    client = create_app().test_client()
+    print(f"Uplink through the Flask app (/api/vehicle/update/batch, {batch} fixes per request):")
+    headers = {
+        "json": {"Content-Type": "application/json"},
+        "json-gzip": {"Content-Type": "application/json", "Content-Encoding": "gzip"},
+        "binary": {"Content-Type": TELEMETRY_MIME},
+        "bin-gzip": {"Content-Type": TELEMETRY_MIME, "Content-Encoding": "gzip"},
+    }
+    for name, (body, _) in bodies.items():
+        post = lambda: client.post('/api/vehicle/update/batch', data=body, headers=headers[name])
+        assert post().status_code == 200
+        seconds = per_call(post, seconds=1.0)
+        print(f"  {name:<10} {seconds * 1e6:7.0f} us/request, {seconds / batch * 1e6:6.1f} us/fix")
+
+def downlink(vehicles):
+    now = time.time()
+    cars = {f"SIM{n:05d}": {"lat": 17.6 + n * 1e-6, "lon": 78.12 + n * 1e-6, "status": "Running",
+                             "path": f"Path-{'ABC'[n % 3]}", "liveness": "online", "last_seen": now - n % 7}
+            for n in range(vehicles)}
+    encoders = {
+        "json": lambda: json.dumps(cars, separators=(',', ':')).encode(),
+        "json-gzip": lambda: gzip.compress(json.dumps(cars, separators=(',', ':')).encode(), 5),
+        "binary": lambda: encode_snapshot(1, cars, now),
+        "bin-gzip": lambda: gzip.compress(encode_snapshot(1, cars, now), 5),
+    }
+    print(f"Downlink, /api/data snapshot of {vehicles} vehicles:")
+    baseline = None
+    for name, encode in encoders.items():
+        size = len(encode())
+        seconds = per_call(encode, seconds=1.0)
+        baseline = baseline or (size, seconds)
+        print(f"  {name:<10} {size / 1024:8.1f} KiB ({size / baseline[0]:4.0%})   "
+              f"encode {seconds * 1000:6.2f} ms ({seconds / baseline[1]:4.0%})")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--batch', type=int, default=5, help="Fixes per upload (the client sends 5)")
+    parser.add_argument('--vehicles', type=int, default=5000, help="Vehicles in the snapshot")
+    parser.add_argument('--http', action='store_true', help="Also time uploads through the Flask app")
+    args = parser.parse_args()
+
+    bodies = uplink(args.batch)
+    if args.http:
+        uplink_http(bodies, args.batch)
+    downlink(args.vehicles)
+
+if __name__ == '__main__':
+    main()
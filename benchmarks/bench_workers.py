@@ -0,0 +1,59 @@
+"""
+Throughput scaling with worker count on one host.
+
+    python benchmarks/bench_workers.py                      # 1, 2 and 4 workers
+    python benchmarks/bench_workers.py --server-workers 1 2 4 8 --vehicles 1000
+
+For each worker count, runs load_test.py --spawn against wsgi.py (workers
+sharing one state server from 2 workers up) with the same load and reports
+total successful requests/s, error rate and p95 latency of the vehicle
+update endpoint. Offer more load than one worker can serve (the defaults
+ask for ~10000 req/s) or every row will show the offered rate.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LOAD_TEST = os.path.join(ROOT, "benchmarks", "load_test.py")
+
+def run(workers, args):
+    with tempfile.TemporaryDirectory() as tmp:
+        out = os.path.join(tmp, "result.json")
+        subprocess.run([sys.executable, LOAD_TEST, "--spawn", "--server-workers", str(workers),
+                        "--vehicles", str(args.vehicles), "--dashboards", str(args.dashboards),
+                        "--duration", str(args.duration), "--warmup", str(args.warmup),
+                        "--workers", str(args.load_workers), "--json", out],
+                       check=True, stdout=subprocess.DEVNULL)
+        with open(out) as f:
+            return json.load(f)["endpoints"]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--server-workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--vehicles', type=int, default=1000)
+    parser.add_argument('--dashboards', type=int, default=10)
+    parser.add_argument('--duration', type=float, default=15.0, help="Measured seconds per run")
+    parser.add_argument('--warmup', type=float, default=3.0)
+    parser.add_argument('--load-workers', type=int, default=min(4, os.cpu_count() or 1),
+                        help="Load generator processes")
+    args = parser.parse_args()
+
+    print(f"{os.cpu_count()} CPUs, {args.vehicles} vehicles, {args.dashboards} dashboards, {args.duration:g} s per run")
+    print(f"{'workers':>7s} {'req/s':>9s} {'speedup':>8s} {'errors':>7s} {'update p95 ms':>14s}")
+    base = None
+    for workers in args.server_workers:
+        endpoints = run(workers, args)
+        rps = sum(row["throughput_rps"] for row in endpoints.values())
+        requests = sum(row["requests"] for row in endpoints.values())
+        failed = sum(sum(row["errors"].values()) for row in endpoints.values())
+        update = endpoints.get("POST /api/vehicle/update", {})
+        base = base or rps
+        print(f"{workers:7d} {rps:9.1f} {rps / base:7.2f}x {failed / max(1, requests):7.2%} "
+              f"{update.get('p95_ms') or 0:14.1f}")
+
+if __name__ == '__main__':
+    main()
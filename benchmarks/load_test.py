@@ -0,0 +1,363 @@
+"""
+Load test for the vehicle and dashboard APIs, localhost only.
+
+    python benchmarks/load_test.py --spawn                       # start wsgi.py on a free port
+    python benchmarks/load_test.py --spawn --server-workers 4    # ... with 4 worker processes
+    python benchmarks/load_test.py --url http://127.0.0.1:5000 --vehicles 500 --dashboards 20
+    python benchmarks/load_test.py --spawn --json results.json
+    python benchmarks/load_test.py --spawn --baseline results.json   # fail on regressions
+
+Each emulated vehicle runs the vehicle_client loop: POST its position at
+--update-rate Hz (or --batch fixes at a time to the batch endpoint) and poll
+its command queue at --poll-rate Hz. Each dashboard polls /api/data every
+--dashboard-interval seconds. Clients are asyncio tasks spread over
+--workers processes so the generator itself is not the bottleneck.
+
+Reports per-endpoint request count, throughput, error rate and p50/p95/p99
+latency. --json writes the same numbers (plus the git commit) for comparing
+runs; --baseline compares against such a file and exits non-zero if p95
+latency or throughput regressed by more than --tolerance.
+"""
+import argparse
+import asyncio
+import collections
+import json
+import multiprocessing
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+import urllib.parse
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LOCAL_HOSTS = ('localhost', '127.0.0.1', '::1')
+REQUEST_TIMEOUT = 10.0
+
+class HttpConnection:
+    """
+    Minimal asyncio HTTP/1.1 client connection with keep-alive. Reconnects
+    when the server closes the connection (e.g. an HTTP/1.0 dev server).
+    """
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self._reader = None
+        self._writer = None
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+        self._reader = self._writer = None
+
+    async def request(self, method, path, body=None):
+        reused = self._writer is not None
+        try:
+            return await self._request(method, path, body)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            self.close()
+            if not reused:
+                raise
+            # The server dropped an idle keep-alive connection: retry once
+            return await self._request(method, path, body)
+
+    async def _request(self, method, path, body):
+        if self._writer is None:
+            self._reader, self._writer = await asyncio.open_connection(self.host, self.port)
+        head = f"{method} {path} HTTP/1.1\r\nHost: {self.host}:{self.port}\r\nConnection: keep-alive\r\n"
+        data = b""
+        if body is not None:
+            data = json.dumps(body).encode('utf-8')
+            head += f"Content-Type: application/json\r\nContent-Length: {len(data)}\r\n"
+        self._writer.write(head.encode('latin-1') + b"\r\n" + data)
+
+        status_line = await self._reader.readline()
+        if not status_line:
+            raise ConnectionError("connection closed by server")
+        status = int(status_line.split()[1])
+        length = None
+        close = status_line.startswith(b"HTTP/1.0")
+        while True:
+            line = await self._reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            name = name.strip().lower()
+            if name == 'content-length':
+                length = int(value)
+            elif name == 'connection':
+                close = value.strip().lower() == 'close'
+        if length is None:
+            payload = await self._reader.read()
+            close = True
+        else:
+            payload = await self._reader.readexactly(length)
+        if close:
+            self.close()
+        return status, payload
+
+class Recorder:
+    """
+    Per-endpoint latencies (seconds) and error counts, ignoring requests
+    started before `measure_from`.
+    """
+
+    def __init__(self, measure_from):
+        self.measure_from = measure_from
+        self.latencies = collections.defaultdict(list)
+        self.errors = collections.defaultdict(collections.Counter)
+
+    async def call(self, conn, endpoint, method, path, body=None):
+        started = time.time()
+        try:
+            status, _ = await asyncio.wait_for(conn.request(method, path, body), REQUEST_TIMEOUT)
+            error = None if 200 <= status < 300 else f"HTTP {status}"
+        except asyncio.TimeoutError:
+            conn.close()
+            error = "timeout"
+        except (OSError, ValueError, IndexError, asyncio.IncompleteReadError) as e:
+            conn.close()
+            error = type(e).__name__
+        if started < self.measure_from:
+            return
+        if error is None:
+            self.latencies[endpoint].append(time.time() - started)
+        else:
+            self.errors[endpoint][error] += 1
+
+async def _every(interval, stop_at, action):
+    # Fixed-rate schedule with a random phase; no catch-up burst when late
+    await asyncio.sleep(random.random() * interval)
+    next_run = time.time()
+    while next_run < stop_at:
+        await action()
+        next_run += interval
+        delay = next_run - time.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        else:
+            next_run = time.time()
+
+async def _vehicle(rec, host, port, acs_id, args, stop_at):
+    updates = HttpConnection(host, port)
+    commands = HttpConnection(host, port)
+    lat, lon = 17.6018 + random.uniform(-0.01, 0.01), 78.1268 + random.uniform(-0.01, 0.01)
+    fixes = []
+
+    async def send_update():
+        nonlocal lat, lon
+        lat += random.uniform(-0.00005, 0.00005)
+        lon += random.uniform(-0.00005, 0.00005)
+        fix = {"acs_id": acs_id, "lat": lat, "lon": lon, "status": "Running", "path": "Path-A"}
+        if args.batch <= 1:
+            await rec.call(updates, "POST /api/vehicle/update", "POST", "/api/vehicle/update", fix)
+            return
+        fixes.append(dict(fix, t=time.time()))
+        if len(fixes) >= args.batch:
+            body = {"acs_id": acs_id, "fixes": fixes[:]}
+            fixes.clear()
+            await rec.call(updates, "POST /api/vehicle/update/batch", "POST", "/api/vehicle/update/batch", body)
+
+    async def poll_command():
+        await rec.call(commands, "GET /api/vehicle/command/<acs_id>", "GET", f"/api/vehicle/command/{acs_id}")
+
+    try:
+        await asyncio.gather(_every(1.0 / args.update_rate, stop_at, send_update),
+                             _every(1.0 / args.poll_rate, stop_at, poll_command))
+    finally:
+        updates.close()
+        commands.close()
+
+async def _dashboard(rec, host, port, args, stop_at):
+    conn = HttpConnection(host, port)
+
+    async def poll():
+        await rec.call(conn, "GET /api/data", "GET", "/api/data")
+
+    try:
+        await _every(args.dashboard_interval, stop_at, poll)
+    finally:
+        conn.close()
+
+async def _run_worker(host, port, vehicle_ids, dashboards, args, start_at):
+    rec = Recorder(start_at + args.warmup)
+    stop_at = start_at + args.warmup + args.duration
+    await asyncio.sleep(max(0.0, start_at - time.time()))
+    tasks = [_vehicle(rec, host, port, acs_id, args, stop_at) for acs_id in vehicle_ids]
+    tasks += [_dashboard(rec, host, port, args, stop_at) for _ in range(dashboards)]
+    await asyncio.gather(*tasks)
+    return dict(rec.latencies), {name: dict(counts) for name, counts in rec.errors.items()}
+
+def _worker(job):
+    host, port, vehicle_ids, dashboards, args, start_at = job
+    return asyncio.run(_run_worker(host, port, vehicle_ids, dashboards, args, start_at))
+
+def _percentile(ordered, q):
+    if not ordered:
+        return None
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q))]
+
+def summarize(results, duration):
+    latencies = collections.defaultdict(list)
+    errors = collections.defaultdict(collections.Counter)
+    for worker_latencies, worker_errors in results:
+        for endpoint, values in worker_latencies.items():
+            latencies[endpoint].extend(values)
+        for endpoint, counts in worker_errors.items():
+            errors[endpoint].update(counts)
+
+    endpoints = {}
+    for endpoint in sorted(set(latencies) | set(errors)):
+        ordered = sorted(latencies[endpoint])
+        failed = sum(errors[endpoint].values())
+        total = len(ordered) + failed
+        ms = lambda value: None if value is None else round(value * 1000, 2)
+        endpoints[endpoint] = {
+            "requests": total,
+            "throughput_rps": round(len(ordered) / duration, 1),
+            "error_rate": round(failed / total, 4) if total else 0.0,
+            "errors": dict(errors[endpoint]),
+            "p50_ms": ms(_percentile(ordered, 0.50)),
+            "p95_ms": ms(_percentile(ordered, 0.95)),
+            "p99_ms": ms(_percentile(ordered, 0.99)),
+            "max_ms": ms(ordered[-1] if ordered else None),
+        }
+    return endpoints
+
+def compare(endpoints, baseline, tolerance):
+    """
+    Returns a list of regressions against a previous --json result.
+    """
+    problems = []
+    for endpoint, old in baseline.get("endpoints", {}).items():
+        new = endpoints.get(endpoint)
+        if new is None:
+            problems.append(f"{endpoint}: missing from this run")
+            continue
+        if old["p95_ms"] and new["p95_ms"] and new["p95_ms"] > old["p95_ms"] * (1 + tolerance):
+            problems.append(f"{endpoint}: p95 {old['p95_ms']} ms -> {new['p95_ms']} ms")
+        if new["throughput_rps"] < old["throughput_rps"] * (1 - tolerance):
+            problems.append(f"{endpoint}: throughput {old['throughput_rps']} -> {new['throughput_rps']} req/s")
+        if new["error_rate"] > old["error_rate"] + 0.01:
+            problems.append(f"{endpoint}: error rate {old['error_rate']:.2%} -> {new['error_rate']:.2%}")
+    return problems
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def spawn_server(workers=1):
+    """
+    Starts wsgi.py with `workers` processes on 127.0.0.1 on a free port,
+    with in-memory state. Returns (process, url).
+    """
+    port = _free_port()
+    env = dict(os.environ)
+    env.pop('FLEET_DB_PATH', None)
+    env.pop('FLEET_TRACK_DIR', None)
+    env.pop('FLEET_STATE_SOCKET', None)
+    process = subprocess.Popen([sys.executable, "wsgi.py", "--host", "127.0.0.1", "--port", str(port),
+                                "--workers", str(workers), "--quiet"], cwd=ROOT, env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        if process.poll() is not None:
+            sys.exit("Server exited during startup")
+        try:
+            urllib.request.urlopen(url + "/api/data", timeout=1).read()
+            return process, url
+        except OSError:
+            time.sleep(0.2)
+    process.terminate()
+    sys.exit("Server did not start within 30 s")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', default="http://127.0.0.1:5000", help="Server to test (must be localhost)")
+    parser.add_argument('--spawn', action='store_true', help="Start wsgi.py on a free localhost port")
+    parser.add_argument('--server-workers', type=int, default=1, help="Worker processes of the --spawn server")
+    parser.add_argument('--vehicles', type=int, default=100)
+    parser.add_argument('--dashboards', type=int, default=5)
+    parser.add_argument('--duration', type=float, default=30.0, help="Measured seconds")
+    parser.add_argument('--warmup', type=float, default=3.0, help="Unmeasured seconds before measuring")
+    parser.add_argument('--update-rate', type=float, default=5.0, help="Position updates per vehicle per second")
+    parser.add_argument('--batch', type=int, default=1, help="Fixes per request (>1 uses the batch endpoint)")
+    parser.add_argument('--poll-rate', type=float, default=5.0, help="Command polls per vehicle per second")
+    parser.add_argument('--dashboard-interval', type=float, default=0.3, help="Seconds between /api/data polls")
+    parser.add_argument('--workers', type=int, default=min(4, os.cpu_count() or 1), help="Load generator processes")
+    parser.add_argument('--json', help="Write results to this file")
+    parser.add_argument('--baseline', help="Previous --json result to compare against")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="Allowed regression vs baseline (0.2 = 20%%)")
+    args = parser.parse_args()
+
+    server = None
+    if args.spawn:
+        server, args.url = spawn_server(args.server_workers)
+    url = urllib.parse.urlsplit(args.url)
+    if url.hostname not in LOCAL_HOSTS:
+        sys.exit(f"Refusing to load-test {url.hostname}: only localhost targets are allowed")
+    host, port = url.hostname, url.port or 80
+
+    workers = max(1, min(args.workers, args.vehicles + args.dashboards))
+    ids = [f"LOAD{i:05d}" for i in range(args.vehicles)]
+    start_at = time.time() + 1.0
+    jobs = [(host, port, ids[w::workers], args.dashboards // workers + (w < args.dashboards % workers),
+             args, start_at) for w in range(workers)]
+    print(f"Load test {args.url}: {args.vehicles} vehicles ({args.update_rate:g} Hz updates, batch {args.batch}, "
+          f"{args.poll_rate:g} Hz command polls), {args.dashboards} dashboards, {workers} workers, "
+          f"{args.warmup:g} s warmup + {args.duration:g} s")
+    try:
+        with multiprocessing.Pool(workers) as pool:
+            results = pool.map(_worker, jobs)
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    endpoints = summarize(results, args.duration)
+    print(f"{'endpoint':36s} {'requests':>9s} {'req/s':>8s} {'errors':>7s} {'p50 ms':>8s} {'p95 ms':>8s} {'p99 ms':>8s}")
+    for endpoint, row in endpoints.items():
+        print(f"{endpoint:36s} {row['requests']:9d} {row['throughput_rps']:8.1f} {row['error_rate']:7.2%} "
+              f"{row['p50_ms'] or 0:8.1f} {row['p95_ms'] or 0:8.1f} {row['p99_ms'] or 0:8.1f}")
+        if row['errors']:
+            print(f"{'':36s} errors: {row['errors']}")
+
+    report = {
+        "commit": _git_commit(),
+        "timestamp": time.time(),
+        "config": {name: getattr(args, name) for name in (
+            'vehicles', 'dashboards', 'duration', 'warmup', 'update_rate', 'batch', 'poll_rate',
+            'dashboard_interval', 'workers', 'server_workers')},
+        "endpoints": endpoints,
+    }
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Results written to {args.json}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get("config") != report["config"]:
+            print(f"WARNING: {args.baseline} was run with a different configuration: {baseline.get('config')}")
+        problems = compare(endpoints, baseline, args.tolerance)
+        for problem in problems:
+            print(f"REGRESSION: {problem}")
+        if problems:
+            sys.exit(1)
+        print(f"No regressions vs {args.baseline} (commit {baseline.get('commit')})")
+
+if __name__ == '__main__':
+    main()
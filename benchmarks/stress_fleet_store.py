@@ -0,0 +1,234 @@
+"""
+Concurrency stress check for fleet_store.FleetStore.
+
+    python benchmarks/stress_fleet_store.py
+    python benchmarks/stress_fleet_store.py --vehicles 200 --threads 32 --commands 2000
+    python benchmarks/stress_fleet_store.py --ack-loss 0.1    # drop 10% of acks
+
+Many threads hammer update, control (enqueue) and poll (pop/wait/lease+ack)
+at once, the way threaded Flask drives the store. Afterwards every enqueued
+command must have been fetched exactly once, in per-vehicle FIFO order (as
+seen by each poller), and a delta-following reader must end with the same state as a fresh snapshot.
+With --ack-loss, leased commands whose ack is dropped must be redelivered
+and still be handled exactly once (order is not checked then).
+
+Then every vehicle gets a leased, never acked start plus more queued
+behind it, and a long-poll parked waiting for them, while --threads
+threads queue an emergency stop (supersede=True) per vehicle. Each parked
+poll must get its stop within --stop-deadline seconds instead of waiting
+for the ack timeout; every cancelled command must reach on_expired exactly
+once, and late acks of the cancelled starts must find nothing.
+Exits non-zero if any check fails.
+"""
+import argparse
+import collections
+import os
+import random
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fleet_store import FleetStore
+
+def stop_scenario(ids, threads, deadline):
+    """
+    Returns (errors, worst stop latency in seconds).
+    """
+    errors = []
+    cancelled = collections.Counter()
+    cancelled_lock = threading.Lock()
+
+    def on_expired(acs_id, entry):
+        with cancelled_lock:
+            cancelled[entry["id"]] += 1
+
+    # The ack timeout is far beyond the deadline: only superseding can pass
+    store = FleetStore(ack_timeout=60.0, on_expired=on_expired)
+    pending = set()
+    leased = {}
+    for acs_id in ids:
+        store.update(acs_id, lat=0.0, lon=0.0, status="Running", path="Path-A")
+        store.enqueue_command(acs_id, "start")
+        leased[acs_id] = store.lease_command(acs_id)["id"]
+        pending.add(leased[acs_id])
+        pending.update(store.enqueue_command(acs_id, f"start-{n}") for n in range(3))
+
+    sent = {}
+    got = {}
+
+    def parked(acs_id):
+        entry = store.lease_command(acs_id, timeout=deadline + 5)
+        got[acs_id] = (entry, time.perf_counter())
+
+    def stopper(part):
+        for acs_id in part:
+            sent[acs_id] = time.perf_counter()
+            store.enqueue_command(acs_id, "stop", supersede=True)
+
+    polls = [threading.Thread(target=parked, args=(acs_id,)) for acs_id in ids]
+    for poll in polls:
+        poll.start()
+    time.sleep(0.1)   # let the polls park behind the unacked starts
+    stoppers = [threading.Thread(target=stopper, args=(ids[n::threads],)) for n in range(threads)]
+    for thread in stoppers:
+        thread.start()
+    for thread in stoppers + polls:
+        thread.join()
+
+    worst = 0.0
+    for acs_id in ids:
+        entry, received = got[acs_id]
+        if entry is None or entry["command"] != "stop":
+            errors.append(f"{acs_id}: parked poll got {entry and entry['command']!r} instead of the stop")
+            continue
+        worst = max(worst, received - sent[acs_id])
+        store.ack_command(acs_id, entry["id"])
+    if worst > deadline:
+        errors.append(f"slowest stop took {worst * 1000:.0f} ms (deadline {deadline * 1000:.0f} ms)")
+    if set(cancelled) != pending or any(count != 1 for count in cancelled.values()):
+        errors.append(f"{len(pending - set(cancelled))} superseded commands not reported, "
+                      f"{sum(1 for count in cancelled.values() if count != 1)} reported more than once")
+    late = sum(1 for acs_id in ids if store.ack_command(acs_id, leased[acs_id]) is not None)
+    if late:
+        errors.append(f"{late} late acks of superseded starts were accepted")
+    leftover = sum(store.command_depths().values()) + sum(1 for acs_id in ids if store.lease_command(acs_id))
+    if leftover:
+        errors.append(f"{leftover} commands still pending after the stops")
+    return errors, worst
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--vehicles', type=int, default=100)
+    parser.add_argument('--threads', type=int, default=16, help="Threads per role (update, control, poll)")
+    parser.add_argument('--commands', type=int, default=1000, help="Commands enqueued per control thread")
+    parser.add_argument('--updates', type=int, default=5000, help="Updates per update thread")
+    parser.add_argument('--ack-loss', type=float, default=0.0, help="Fraction of acks dropped by leasing pollers")
+    parser.add_argument('--stop-deadline', type=float, default=0.5,
+                        help="Seconds a superseding stop may take to reach a parked poll")
+    args = parser.parse_args()
+
+    store = FleetStore(ack_timeout=0.05, max_attempts=1000)
+    ids = [f"ACS{i:04d}" for i in range(args.vehicles)]
+    for acs_id in ids:
+        store.update(acs_id, lat=0.0, lon=0.0, status="Stopped", path="Path-A")
+
+    total_commands = args.threads * args.commands
+    received = collections.defaultdict(list)
+    received_lock = threading.Lock()
+    received_count = [0]
+    done = threading.Event()
+    writers_done = threading.Event()
+    fetch_order = collections.defaultdict(list)   # (poller, acs_id) -> commands
+    errors = []
+
+    def updater(seed):
+        rng = random.Random(seed)
+        for i in range(args.updates):
+            acs_id = rng.choice(ids)
+            store.update(acs_id, lat=rng.random(), lon=rng.random(), status="Running", path="Path-B")
+            if i % 7 == 0:
+                store.set_status(acs_id, "Stopped")
+
+    def controller(thread_no):
+        rng = random.Random(1000 + thread_no)
+        for seq in range(args.commands):
+            store.enqueue_command(rng.choice(ids), (thread_no, seq))
+
+    def poller(thread_no):
+        rng = random.Random(2000 + thread_no)
+        while not done.is_set():
+            acs_id = rng.choice(ids)
+            if thread_no % 3 == 2:
+                entry = store.lease_command(acs_id, timeout=0.001)
+                if entry is None or rng.random() < args.ack_loss:
+                    continue
+                if store.ack_command(acs_id, entry["id"]) is None:
+                    continue
+                command = entry["command"]
+            elif thread_no % 3 == 1:
+                command = store.wait_command(acs_id, timeout=0.001)
+            else:
+                command = store.pop_command(acs_id)
+            if command is None:
+                continue
+            fetch_order[thread_no, acs_id].append(command)
+            with received_lock:
+                received[acs_id].append(command)
+                received_count[0] += 1
+                if received_count[0] >= total_commands:
+                    done.set()
+
+    def stream_reader():
+        version, cars = store.snapshot()
+        last = version
+        while not writers_done.is_set():
+            current = store.wait_for_change(version, timeout=0.05)
+            if current < last:
+                errors.append(f"fleet version went backwards: {last} -> {current}")
+            current, changed = store.changes_since(version)
+            cars.update(changed)
+            version = last = current
+        current, changed = store.changes_since(version)
+        cars.update(changed)
+        stream_state.update(cars)
+
+    stream_state = {}
+    threads = [threading.Thread(target=updater, args=(i,)) for i in range(args.threads)]
+    threads += [threading.Thread(target=controller, args=(i,)) for i in range(args.threads)]
+    pollers = [threading.Thread(target=poller, args=(i,)) for i in range(args.threads)]
+    reader = threading.Thread(target=stream_reader)
+
+    start = time.perf_counter()
+    for thread in threads + pollers + [reader]:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    writers_done.set()
+    if not done.wait(timeout=120):
+        errors.append("timed out waiting for pollers to drain the queues")
+        done.set()
+    for thread in pollers + [reader]:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    # Every command fetched exactly once, FIFO per (vehicle, producer). Order
+    # is checked per poller: fetches by different pollers race to be recorded.
+    flat = [command for commands in received.values() for command in commands]
+    if len(flat) != total_commands:
+        errors.append(f"fetched {len(flat)} commands, expected {total_commands}")
+    if len(set(flat)) != len(flat):
+        errors.append(f"{len(flat) - len(set(flat))} commands were delivered more than once")
+    for (_, acs_id), commands in fetch_order.items() if not args.ack_loss else ():
+        last_seq = {}
+        for producer, seq in commands:
+            if seq <= last_seq.get(producer, -1):
+                errors.append(f"{acs_id}: commands from producer {producer} out of order")
+                break
+            last_seq[producer] = seq
+    leftover = sum(store.command_depths().values())
+    if leftover:
+        errors.append(f"{leftover} commands left in queues")
+
+    # Delta-following reader converged on the real state
+    _, final = store.snapshot()
+    if stream_state != final:
+        diff = sum(1 for acs_id in final if stream_state.get(acs_id) != final[acs_id])
+        errors.append(f"delta reader diverged from snapshot for {diff} vehicles")
+
+    ops = args.threads * (args.updates + args.commands) + total_commands
+    print(f"{args.vehicles} vehicles, {args.threads} threads/role: {ops} operations in {elapsed:.2f} s "
+          f"({ops / elapsed:,.0f} ops/s), fleet version {store.version}")
+
+    stop_errors, worst = stop_scenario(ids, args.threads, args.stop_deadline)
+    errors += stop_errors
+    print(f"Emergency stops past unacked starts: slowest reached its poll in {worst * 1000:.1f} ms")
+    if errors:
+        for error in errors:
+            print(f"FAIL: {error}")
+        sys.exit(1)
+    print("PASS: no lost, duplicated or reordered commands; delta reader consistent; stops not held back")
+
+if __name__ == '__main__':
+    main()
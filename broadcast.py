@@ -0,0 +1,150 @@
+"""
+Delivery tracking for commands fanned out to many vehicles at once.
+
+A broadcast records, per vehicle, when its command was queued, when the
+vehicle fetched it (delivered), when the vehicle acknowledged executing it
+(acknowledged, or failed if it reported an error or never acked) and when
+the vehicle's own telemetry first reported the status the command asked for
+(confirmed, e.g. "Stopped" after a stop).
+"""
+import collections
+import itertools
+import threading
+import time
+
+MAX_BROADCASTS = 100   # Finished broadcasts kept for status queries
+
+# Status a vehicle reports once it has carried out an action
+EXPECTED_STATUS = {"start": "Running", "stop": "Stopped"}
+
+class BroadcastTracker:
+    """
+    Thread-safe registry of recent broadcasts and their per-vehicle state.
+    """
+
+    def __init__(self, max_broadcasts=MAX_BROADCASTS):
+        self._lock = threading.Lock()
+        self._broadcasts = collections.OrderedDict()
+        self._max = max_broadcasts
+        self._counter = itertools.count(1)
+        self._in_flight = {}   # acs_id -> {command id: broadcast_id}, not acked yet
+        self._awaiting = {}    # acs_id -> broadcast_id, delivered but not confirmed
+
+    def create(self, action, path, command_ids):
+        """
+        Registers a broadcast of `action` whose commands ({acs_id: command
+        id}) are being queued. Returns the broadcast id.
+        """
+        now = time.time()
+        with self._lock:
+            broadcast_id = f"b{int(now)}-{next(self._counter)}"
+            self._broadcasts[broadcast_id] = {
+                "id": broadcast_id,
+                "action": action,
+                "path": path,
+                "created": now,
+                "vehicles": {acs_id: {"status": "queued", "queued_at": now} for acs_id in command_ids},
+            }
+            for acs_id, command_id in command_ids.items():
+                self._in_flight.setdefault(acs_id, {})[command_id] = broadcast_id
+            while len(self._broadcasts) > self._max:
+                _, old = self._broadcasts.popitem(last=False)
+                self._forget(old)
+        return broadcast_id
+
+    def _forget(self, broadcast):
+        # Caller holds self._lock
+        broadcast_id = broadcast["id"]
+        for acs_id in broadcast["vehicles"]:
+            in_flight = self._in_flight.get(acs_id)
+            if in_flight:
+                for command_id in [c for c, b in in_flight.items() if b == broadcast_id]:
+                    del in_flight[command_id]
+                if not in_flight:
+                    del self._in_flight[acs_id]
+            if self._awaiting.get(acs_id) == broadcast_id:
+                del self._awaiting[acs_id]
+
+    def _state(self, acs_id, command_id, done):
+        # Caller holds self._lock. Returns (broadcast, vehicle state) for a
+        # tracked command, forgetting the command if `done`.
+        in_flight = self._in_flight.get(acs_id)
+        if not in_flight or command_id not in in_flight:
+            return None, None
+        broadcast_id = in_flight.pop(command_id) if done else in_flight[command_id]
+        if not in_flight:
+            del self._in_flight[acs_id]
+        broadcast = self._broadcasts.get(broadcast_id)
+        if broadcast is None:
+            return None, None
+        return broadcast, broadcast["vehicles"][acs_id]
+
+    def delivered(self, acs_id, command_id):
+        """
+        Called when `acs_id` fetched a command (again, on redelivery).
+        """
+        if acs_id not in self._in_flight:
+            return
+        with self._lock:
+            broadcast, state = self._state(acs_id, command_id, done=False)
+            if state is None:
+                return
+            if state["status"] == "queued":
+                state["status"] = "delivered"
+                state["delivered_at"] = time.time()
+            state["attempts"] = state.get("attempts", 0) + 1
+            self._awaiting[acs_id] = broadcast["id"]
+
+    def acknowledged(self, acs_id, command_id, ok=True, message=None):
+        """
+        Called when the vehicle acked a command, or with ok=False when it
+        reported a failure or the command was given up.
+        """
+        if acs_id not in self._in_flight:
+            return
+        with self._lock:
+            broadcast, state = self._state(acs_id, command_id, done=True)
+            if state is None:
+                return
+            if ok:
+                if state["status"] != "confirmed":
+                    state["status"] = "acknowledged"
+                state["acknowledged_at"] = time.time()
+            else:
+                state["status"] = "failed"
+                state["failed_at"] = time.time()
+                state["message"] = message
+                if self._awaiting.get(acs_id) == broadcast["id"]:
+                    del self._awaiting[acs_id]
+
+    def reported(self, acs_id, status):
+        """
+        Called with the status from a vehicle's own telemetry; confirms the
+        vehicle's last delivered broadcast if the status matches its action.
+        """
+        if acs_id not in self._awaiting:
+            return
+        with self._lock:
+            broadcast = self._broadcasts.get(self._awaiting.get(acs_id))
+            if broadcast is None or EXPECTED_STATUS.get(broadcast["action"]) != status:
+                return
+            del self._awaiting[acs_id]
+            state = broadcast["vehicles"][acs_id]
+            state["status"] = "confirmed"
+            state["confirmed_at"] = time.time()
+
+    def get(self, broadcast_id):
+        """
+        Returns a copy of one broadcast with per-status counts, or None.
+        """
+        with self._lock:
+            broadcast = self._broadcasts.get(broadcast_id)
+            if broadcast is None:
+                return None
+            vehicles = {acs_id: dict(state) for acs_id, state in broadcast["vehicles"].items()}
+            result = dict(broadcast, vehicles=vehicles)
+        counts = collections.Counter(state["status"] for state in vehicles.values())
+        result["counts"] = {name: counts.get(name, 0)
+                            for name in ("queued", "delivered", "acknowledged", "confirmed", "failed")}
+        result["total"] = len(vehicles)
+        return result
@@ -1,64 +1,416 @@
 import base64
+import binascii
+import heapq
 import json
 import os
+import struct
+import threading
+import time
 from Crypto.Cipher import AES
+from Crypto.Hash import SHA256
+from Crypto.Protocol.KDF import HKDF
+from Crypto.Random import get_random_bytes
 from Crypto.Util.Padding import pad, unpad
 
 # Hardcoded key for demonstration (In production, use secure key management)
 # 32 bytes for AES-256
-SECRET_KEY = b'0123456789ABCDEF0123456789ABCDEF' 
+SECRET_KEY = b'0123456789ABCDEF0123456789ABCDEF'
 IV = b'0000000000000000' # 16 bytes IV
 
+# Master key for the authenticated (v2) envelope; every vehicle gets its own
+# key derived from it. Set FLEET_MASTER_KEY (base64, 32 bytes) in production,
+# on the server only: vehicles are given just their own derived key
+# (`python crypto.py vehicle-key <acs_id>` prints it as VEHICLE_KEY=...).
+MASTER_KEY = base64.b64decode(os.getenv('FLEET_MASTER_KEY', '')) or b'MASTER-KEY-FOR-DEMO-ONLY-32BYTES'
+
+BLOCK = AES.block_size
+
+# v2 envelope: version | nonce || AES-GCM(seq | action | path) || tag
+# seq is the send time in microseconds (bumped if needed to stay increasing),
+# so it doubles as the command timestamp
+ENVELOPE_VERSION = 0x02
+NONCE_SIZE = 12
+TAG_SIZE = 16
+_HEADER = struct.Struct('>B12s')       # version, nonce (authenticated, not encrypted)
+_BODY = struct.Struct('>QB')           # seq, action code
+ACTIONS = ('start', 'stop')            # action code n + 1; code 0 = action string follows
+KEY_SALT = b'fleet-command-v2'
+
+MAX_COMMAND_AGE = 120    # Seconds a command stays valid (also bounds clock skew)
+
+def _xor(a, b):
+    # XOR of two equal-length byte strings in one big-integer operation
+    return (int.from_bytes(a, 'big') ^ int.from_bytes(b, 'big')).to_bytes(len(a), 'big')
+
+def _parse_payload(decrypted_str):
+    # Payload structure: acsno|path|action|excuter.py
+    parts = decrypted_str.split('|')
+    if len(parts) != 4:
+        return {"status": "error", "message": "Invalid payload structure"}
+    return _command_result(*parts)
+
+def _command_result(acs_id, path, action, script='excuter.py'):
+    return {
+        "status": "success",
+        "acs_id": acs_id,
+        "path": path,
+        "action": action,
+        "script": script,
+        "raw_command": f"bashrc run {script} on {acs_id} for {path} with action {action}"
+    }
+
+class CommandCodec:
+    """
+    Encrypts and decrypts command payloads (AES-256-CBC, PKCS7, base64),
+    producing exactly the same ciphertext as AES.new(key, AES.MODE_CBC, iv).
+
+    One AES-ECB context is cached per key, so the key schedule is computed
+    once instead of on every call, and CBC chaining is done on top of it.
+    The *_many methods process a whole batch with a few ECB calls: decryption
+    runs every block of every message through one call, and encryption runs
+    block 1 of all messages in one call, then block 2, and so on.
+
+    `vehicle_keys` optionally maps acs_id -> key; other vehicles use `key`.
+    """
+
+    def __init__(self, key=SECRET_KEY, iv=IV, vehicle_keys=None):
+        self.key = key
+        self.iv = iv
+        self.vehicle_keys = dict(vehicle_keys or {})
+        self._lock = threading.Lock()
+        self._ciphers = {}
+
+    def key_for(self, acs_id):
+        return self.vehicle_keys.get(acs_id, self.key)
+
+    def _ecb(self, key):
+        # ECB contexts keep no state between calls, so they can be shared
+        # by threads once created
+        cipher = self._ciphers.get(key)
+        if cipher is None:
+            with self._lock:
+                cipher = self._ciphers.get(key)
+                if cipher is None:
+                    cipher = self._ciphers[key] = AES.new(key, AES.MODE_ECB)
+        return cipher
+
+    def _cbc_encrypt(self, key, plaintexts):
+        # plaintexts are padded; all blocks with the same index go through
+        # one ECB call. Longest messages first, so the messages that still
+        # have a block j are always a prefix of the list.
+        ecb = self._ecb(key)
+        order = sorted(range(len(plaintexts)), key=lambda i: -len(plaintexts[i]))
+        texts = [plaintexts[i] for i in order]
+        chained = [self.iv] * len(texts)
+        blocks = [[] for _ in texts]
+        offset = 0
+        while texts and len(texts[0]) > offset:
+            count = len(texts)
+            while len(texts[count - 1]) <= offset:
+                count -= 1
+            mixed = _xor(b''.join(text[offset:offset + BLOCK] for text in texts[:count]),
+                         b''.join(chained[:count]))
+            encrypted = ecb.encrypt(mixed)
+            for n in range(count):
+                block = encrypted[n * BLOCK:(n + 1) * BLOCK]
+                chained[n] = block
+                blocks[n].append(block)
+            offset += BLOCK
+        result = [None] * len(plaintexts)
+        for n, i in enumerate(order):
+            result[i] = b''.join(blocks[n])
+        return result
+
+    def _cbc_decrypt(self, key, ciphertexts):
+        # Every plaintext block is D(C[j]) ^ C[j-1], so the whole batch is one
+        # ECB call and one XOR
+        ecb = self._ecb(key)
+        iv = self.iv
+        decrypted = _xor(ecb.decrypt(b''.join(ciphertexts)),
+                         b''.join(iv + text[:-BLOCK] for text in ciphertexts))
+        result = []
+        offset = 0
+        for text in ciphertexts:
+            result.append(decrypted[offset:offset + len(text)])
+            offset += len(text)
+        return result
+
+    def encrypt_many(self, commands):
+        """
+        Encrypts (acs_id, path, action) tuples. Returns base64 strings in
+        the same order.
+        """
+        commands = list(commands)
+        by_key = {}
+        for i, (acs_id, path, action) in enumerate(commands):
+            payload = f"{acs_id}|{path}|{action}|excuter.py"
+            by_key.setdefault(self.key_for(acs_id), []).append((i, pad(payload.encode('utf-8'), BLOCK)))
+
+        result = [None] * len(commands)
+        for key, items in by_key.items():
+            encrypted = self._cbc_encrypt(key, [plaintext for _, plaintext in items])
+            for (i, _), data in zip(items, encrypted):
+                result[i] = base64.b64encode(data).decode('utf-8')
+        return result
+
+    def decrypt_many(self, encrypted_data, acs_id=None):
+        """
+        Decrypts base64 commands with the key of `acs_id` (default key if
+        None). Returns one decrypt_execute-style dict per command; a bad
+        command gives an error dict without affecting the others.
+        """
+        results = [None] * len(encrypted_data)
+        pending = []
+        for i, data in enumerate(encrypted_data):
+            try:
+                raw = base64.b64decode(data)
+            except (binascii.Error, TypeError, ValueError) as e:
+                results[i] = {"status": "error", "message": str(e)}
+                continue
+            if not raw or len(raw) % BLOCK:
+                results[i] = {"status": "error", "message": "Data must be padded to 16 byte boundary in CBC mode"}
+                continue
+            pending.append((i, raw))
+
+        if pending:
+            decrypted = self._cbc_decrypt(self.key_for(acs_id), [raw for _, raw in pending])
+            for (i, _), padded in zip(pending, decrypted):
+                try:
+                    results[i] = _parse_payload(unpad(padded, BLOCK).decode('utf-8'))
+                except (ValueError, UnicodeDecodeError) as e:
+                    results[i] = {"status": "error", "message": str(e)}
+        return results
+
+    def encrypt(self, acs_id, path, action):
+        """
+        Encrypts one command. Returns a base64 string.
+        """
+        ecb = self._ecb(self.key_for(acs_id))
+        data = pad(f"{acs_id}|{path}|{action}|excuter.py".encode('utf-8'), BLOCK)
+        chained = self.iv
+        blocks = []
+        for offset in range(0, len(data), BLOCK):
+            chained = ecb.encrypt(_xor(data[offset:offset + BLOCK], chained))
+            blocks.append(chained)
+        return base64.b64encode(b''.join(blocks)).decode('utf-8')
+
+    def decrypt(self, encrypted_data, acs_id=None):
+        return self.decrypt_many([encrypted_data], acs_id)[0]
+
+def derive_vehicle_key(acs_id, master_key=MASTER_KEY):
+    """
+    Per-vehicle 256-bit key: HKDF-SHA256(master_key, info=acs_id).
+    """
+    return HKDF(master_key, 32, KEY_SALT, SHA256, context=acs_id.encode('utf-8'))
+
+class EnvelopeCodec:
+    """
+    Authenticated command envelope (v2): AES-256-GCM under a per-vehicle
+    derived key with a random nonce, so identical commands never produce the
+    same bytes. The plaintext is a compact binary record (sequence number,
+    action code, path) used for replay protection; the vehicle id is not
+    sent but bound in as associated data, so a command cannot be redirected
+    to another vehicle.
+
+    Sequence numbers are the send time in microseconds, bumped by one when
+    needed so they strictly increase per vehicle. They keep increasing across
+    server restarts without persisted state, and give the vehicle the command
+    timestamp without spending extra bytes on it.
+
+    `vehicle_keys` optionally maps acs_id -> derived key. A vehicle builds
+    its codec with master_key=None and only its own key, so it never holds
+    the master key; other vehicles' commands then fail to open.
+    """
+
+    def __init__(self, master_key=MASTER_KEY, vehicle_keys=None):
+        self.master_key = master_key
+        self._lock = threading.Lock()
+        self._keys = dict(vehicle_keys or {})
+        self._seq = {}
+
+    def key_for(self, acs_id):
+        """
+        Returns the key of `acs_id`, or None if it is not provisioned and
+        there is no master key to derive it from.
+        """
+        key = self._keys.get(acs_id)
+        if key is None and self.master_key is not None:
+            key = derive_vehicle_key(acs_id, self.master_key)
+            with self._lock:
+                self._keys[acs_id] = key
+        return key
+
+    def next_seq(self, acs_id, now=None):
+        now_us = time.time_ns() // 1000 if now is None else int(now * 1e6)
+        with self._lock:
+            seq = max(self._seq.get(acs_id, 0) + 1, now_us)
+            self._seq[acs_id] = seq
+            return seq
+
+    def seal(self, acs_id, path, action, timestamp=None):
+        """
+        Encrypts one command for `acs_id`. Returns a base64 string.
+        """
+        key = self.key_for(acs_id)
+        if key is None:
+            raise ValueError(f"No key for {acs_id}")
+        seq = self.next_seq(acs_id, timestamp)
+        if action in ACTIONS:
+            body = _BODY.pack(seq, ACTIONS.index(action) + 1)
+        else:
+            encoded = action.encode('utf-8')
+            body = _BODY.pack(seq, 0) + bytes((len(encoded),)) + encoded
+        header = _HEADER.pack(ENVELOPE_VERSION, get_random_bytes(NONCE_SIZE))
+        cipher = AES.new(key, AES.MODE_GCM, nonce=header[1:], mac_len=TAG_SIZE)
+        cipher.update(header + acs_id.encode('utf-8'))
+        ciphertext, tag = cipher.encrypt_and_digest(body + path.encode('utf-8'))
+        return base64.b64encode(header + ciphertext + tag).decode('utf-8')
+
+    def seal_many(self, commands):
+        """
+        Encrypts (acs_id, path, action) tuples. Returns base64 strings in
+        the same order, all stamped with one send time.
+
+        Not batched: every vehicle has its own key and every command a fresh
+        nonce, and pycryptodome builds a new GCM object (key schedule and
+        GHASH table) for each, about 0.1 ms per command against a few us
+        for CommandCodec.encrypt_many. A broadcast to 1,000 vehicles costs
+        about 0.1 s of CPU.
+        """
+        timestamp = time.time()
+        return [self.seal(acs_id, path, action, timestamp) for acs_id, path, action in commands]
+
+    def open(self, encrypted_data, acs_id):
+        """
+        Verifies and decrypts a v2 command addressed to `acs_id`. Returns a
+        decrypt_execute-style dict with "seq" and "timestamp" added, or None
+        if the data is not a valid v2 envelope for this vehicle.
+        """
+        try:
+            raw = base64.b64decode(encrypted_data)
+        except (binascii.Error, TypeError, ValueError):
+            return None
+        key = self.key_for(acs_id)
+        if key is None or len(raw) < _HEADER.size + _BODY.size + TAG_SIZE or raw[0] != ENVELOPE_VERSION:
+            return None
+        header = raw[:_HEADER.size]
+        cipher = AES.new(key, AES.MODE_GCM, nonce=header[1:], mac_len=TAG_SIZE)
+        cipher.update(header + acs_id.encode('utf-8'))
+        try:
+            plaintext = cipher.decrypt_and_verify(raw[_HEADER.size:-TAG_SIZE], raw[-TAG_SIZE:])
+            seq, code = _BODY.unpack_from(plaintext)
+            offset = _BODY.size
+            if code == 0:
+                length = plaintext[offset]
+                action = plaintext[offset + 1:offset + 1 + length].decode('utf-8')
+                offset += 1 + length
+            else:
+                action = ACTIONS[code - 1]
+            path = plaintext[offset:].decode('utf-8')
+        except (ValueError, IndexError, struct.error):
+            return None
+        result = _command_result(acs_id, path, action)
+        result.update(seq=seq, timestamp=seq / 1e6)
+        return result
+
+class ReplayWindow:
+    """
+    Vehicle-side replay cache over a window of time: a command is accepted
+    once, and only if its timestamp is within `max_age` seconds of the local
+    clock. Sequence numbers of accepted commands are remembered until their
+    timestamp leaves the window, so commands may arrive in any order (e.g.
+    an older one redelivered after a newer one ran) as long as they are
+    fresh. Memory is bounded by the commands sent in `max_age` seconds.
+    """
+
+    def __init__(self, max_age=MAX_COMMAND_AGE):
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._seen = set()
+        self._expiry = []     # heap of (timestamp, seq) of the seqs in _seen
+        self._horizon = 0.0   # Older timestamps are rejected, even if the clock steps back
+
+    def check(self, seq, timestamp, now=None):
+        """
+        Returns True and records `seq` if the command is fresh.
+        """
+        now = time.time() if now is None else now
+        if abs(now - timestamp) > self.max_age:
+            return False
+        with self._lock:
+            self._horizon = max(self._horizon, now - self.max_age)
+            while self._expiry and self._expiry[0][0] < self._horizon:
+                self._seen.discard(heapq.heappop(self._expiry)[1])
+            if timestamp < self._horizon or seq in self._seen:
+                return False
+            self._seen.add(seq)
+            heapq.heappush(self._expiry, (timestamp, seq))
+            return True
+
+# Shared codecs behind the module-level functions
+CODEC = CommandCodec()
+ENVELOPE = EnvelopeCodec()
+
 def encrypt_command(acs_id, path, action):
     """
     Encrypts a command structure: acsno + testbed(path) + excuter.py + action
     Returns base64 encoded string.
     """
-    # Construct the command payload as requested
     # Structure: acsno|path|action|excuter.py
     # Using pipe | as separator for simplicity in parsing
-    payload = f"{acs_id}|{path}|{action}|excuter.py"
-    
-    cipher = AES.new(SECRET_KEY, AES.MODE_CBC, IV)
-    encrypted_bytes = cipher.encrypt(pad(payload.encode('utf-8'), AES.block_size))
-    
-    return base64.b64encode(encrypted_bytes).decode('utf-8')
+    return CODEC.encrypt(acs_id, path, action)
 
 def decrypt_execute(encrypted_data):
     """
     Decrypts the command and returns the components.
     Simulates the "execution" by printing/logging.
     """
-    try:
-        encrypted_bytes = base64.b64decode(encrypted_data)
-        cipher = AES.new(SECRET_KEY, AES.MODE_CBC, IV)
-        decrypted_bytes = unpad(cipher.decrypt(encrypted_bytes), AES.block_size)
-        decrypted_str = decrypted_bytes.decode('utf-8')
-        
-        # Parse the payload
-        parts = decrypted_str.split('|')
-        if len(parts) != 4:
-            return {"status": "error", "message": "Invalid payload structure"}
-            
-        acs_id = parts[0]
-        path = parts[1]
-        action = parts[2]
-        script = parts[3]
-        
-        return {
-            "status": "success",
-            "acs_id": acs_id,
-            "path": path,
-            "action": action,
-            "script": script,
-            "raw_command": f"bashrc run {script} on {acs_id} for {path} with action {action}"
-        }
-    except Exception as e:
-        return {"status": "error", "message": str(e)}
+    return CODEC.decrypt(encrypted_data)
+
+def seal_command(acs_id, path, action):
+    """
+    Encrypts a command in the authenticated v2 envelope for one vehicle.
+    Returns base64 encoded string.
+    """
+    return ENVELOPE.seal(acs_id, path, action)
+
+def open_command(encrypted_data, acs_id, replay=None, accept_legacy=True, envelope=None):
+    """
+    Decrypts a command received by vehicle `acs_id`. v2 envelopes are
+    opened with `envelope` (the vehicle's EnvelopeCodec holding only its own
+    key; the shared master-key codec if None) and, if `replay` (a
+    ReplayWindow) is given, checked for replay.
+    Legacy CBC commands for this vehicle are accepted while `accept_legacy`
+    is set (migration window); they carry no replay protection.
+    Returns a decrypt_execute-style dict with "format" set to "v2"/"legacy".
+    """
+    result = (envelope or ENVELOPE).open(encrypted_data, acs_id)
+    if result is not None:
+        if replay is not None and not replay.check(result["seq"], result["timestamp"]):
+            return {"status": "error", "message": "Replayed or expired command", "format": "v2"}
+        result["format"] = "v2"
+        return result
+    if not accept_legacy:
+        return {"status": "error", "message": "Command failed authentication"}
+    result = decrypt_execute(encrypted_data)
+    if result["status"] != "success":
+        return {"status": "error", "message": "Command failed authentication"}
+    if result["acs_id"] != acs_id:
+        return {"status": "error", "message": f"Command addressed to {result['acs_id']}"}
+    result["format"] = "legacy"
+    return result
 
 if __name__ == "__main__":
+    import sys
+    if len(sys.argv) == 3 and sys.argv[1] == "vehicle-key":
+        # Provisioning: the only key a vehicle needs (run where FLEET_MASTER_KEY is set)
+        print(f"VEHICLE_KEY={base64.b64encode(derive_vehicle_key(sys.argv[2])).decode()}")
+        sys.exit()
     # Test
     enc = encrypt_command("ACS01", "/path/to/waypoint", "start")
     print(f"Encrypted: {enc}")
     dec = decrypt_execute(enc)
     print(f"Decrypted: {dec}")
+    sealed = seal_command("ACS01", "/path/to/waypoint", "start")
+    print(f"Sealed (v2): {sealed}")
+    print(f"Opened: {open_command(sealed, 'ACS01', ReplayWindow())}")
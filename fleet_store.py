@@ -0,0 +1,705 @@
+"""
+Thread-safe fleet state shared by the Flask endpoints and background threads.
+
+Vehicles are spread over shards by acs_id. Each shard has its own lock,
+which guards the vehicle records and command queues in that shard, so
+updates for different vehicles rarely contend. Every state change gets a
+fleet-wide version number; the change log lets dashboard streams fetch only
+what changed since the version they last saw.
+
+Every vehicle has a liveness state: "online" while it reports, "stale"
+after `stale_after` seconds of silence and "offline" after `offline_after`.
+A timer wheel (see timer_wheel.py) holds one timer per online or stale
+vehicle, so sweep_liveness() looks only at the vehicles whose timer is due
+instead of scanning the fleet. Updates never touch the wheel unless they
+bring a vehicle back online: a due timer re-checks the last report time and
+simply re-arms if the vehicle reported meanwhile. Commands queued for an
+offline vehicle are capped at `offline_queue_limit` and dropped after
+`offline_command_ttl` seconds.
+
+An optional storage backend (see storage.py) is told about every change
+and is used to warm the store on startup.
+"""
+import collections
+import contextlib
+import threading
+import time
+import uuid
+import zlib
+
+from storage import MemoryBackend
+from timer_wheel import TimerWheel
+
+DEFAULT_SHARDS = 16
+CHANGE_LOG_SIZE = 65536  # Changes kept for delta queries before a full scan is needed
+DEFAULT_ACK_TIMEOUT = 20.0  # Seconds a leased command waits for its ack before redelivery
+DEFAULT_MAX_ATTEMPTS = 5    # Deliveries before an unacknowledged command is given up
+DEFAULT_STALE_AFTER = 10.0         # Seconds without a report before a vehicle is stale
+DEFAULT_OFFLINE_AFTER = 60.0       # ... and before it is offline
+DEFAULT_OFFLINE_QUEUE_LIMIT = 20   # Commands kept for an offline vehicle; older ones are dropped
+DEFAULT_OFFLINE_COMMAND_TTL = 3600.0  # Seconds a command waits for an offline vehicle
+
+ONLINE, STALE, OFFLINE = "online", "stale", "offline"
+VEHICLE_FIELDS = ('lat', 'lon', 'status', 'path')
+
+def _command_entry(command, now):
+    return {"id": uuid.uuid4().hex, "command": command, "enqueued_at": now, "attempts": 0}
+
+class VehicleRecord:
+    """
+    Current state of one vehicle. `version` is the fleet version of its
+    latest change; `updated_at` is when it last reported (update,
+    update_many or touch_many), None if not since startup. Vehicles that
+    have not reported are offline.
+    """
+    __slots__ = ('acs_id', 'lat', 'lon', 'status', 'path', 'version', 'updated_at', 'liveness')
+
+    def __init__(self, acs_id, lat=0.0, lon=0.0, status='Unknown', path='Unknown', version=0):
+        self.acs_id = acs_id
+        self.lat = lat
+        self.lon = lon
+        self.status = status
+        self.path = path
+        self.version = version
+        self.updated_at = None
+        self.liveness = OFFLINE
+
+    def as_dict(self):
+        return {"lat": self.lat, "lon": self.lon, "status": self.status, "path": self.path,
+                "liveness": self.liveness, "last_seen": self.updated_at}
+
+class _Shard:
+    __slots__ = ('lock', 'vehicles', 'commands', 'inflight', 'conditions')
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.vehicles = {}
+        self.commands = {}    # acs_id -> deque of queued command entries
+        self.inflight = {}    # acs_id -> {command id: entry} leased, awaiting ack
+        self.conditions = {}
+
+    def condition(self, acs_id):
+        # Caller holds self.lock
+        condition = self.conditions.get(acs_id)
+        if condition is None:
+            condition = threading.Condition(self.lock)
+            self.conditions[acs_id] = condition
+        return condition
+
+class FleetStore:
+    """
+    Vehicle positions/status and per-vehicle encrypted command queues.
+
+    Every queued command is an entry {"id", "command", "enqueued_at",
+    "attempts"}. lease_command hands out the oldest entry and keeps it in
+    flight until ack_command; if no ack arrives within `ack_timeout` seconds
+    it is put back at the front of the queue and delivered again, up to
+    `max_attempts` times, after which `on_expired(acs_id, entry)` is called.
+    Each vehicle's queue is strictly FIFO: nothing is leased while an
+    earlier command is in flight. A command queued with supersede=True (an
+    emergency stop) cancels the vehicle's queued and in-flight commands
+    instead of waiting behind them, so it is handed out at once. With `max_age` set, queued commands older
+    than that (e.g. past the envelope's validity, which the vehicle would
+    reject anyway) are expired instead of delivered. Commands dropped from
+    an offline vehicle's queue, for age or superseded are passed to
+    `on_expired` too, with entry["reason"] saying why.
+
+    Lock order is always shard lock -> change lock (or wheel lock), never
+    the reverse.
+    Code holding several shard locks takes them in shard index order.
+    """
+
+    def __init__(self, cars=None, shards=DEFAULT_SHARDS, backend=None,
+                 ack_timeout=DEFAULT_ACK_TIMEOUT, max_attempts=DEFAULT_MAX_ATTEMPTS, max_age=None, on_expired=None,
+                 stale_after=DEFAULT_STALE_AFTER, offline_after=DEFAULT_OFFLINE_AFTER,
+                 offline_queue_limit=DEFAULT_OFFLINE_QUEUE_LIMIT, offline_command_ttl=DEFAULT_OFFLINE_COMMAND_TTL):
+        self._shards = [_Shard() for _ in range(shards)]
+        self._change_lock = threading.Lock()
+        self._changed = threading.Condition(self._change_lock)
+        self._version = 0
+        self._change_log = collections.deque(maxlen=CHANGE_LOG_SIZE)
+        self.backend = backend or MemoryBackend()
+        self.ack_timeout = ack_timeout
+        self.max_attempts = max_attempts
+        self.max_age = max_age
+        self.on_expired = on_expired
+        self.stale_after = stale_after
+        self.offline_after = offline_after
+        self.offline_queue_limit = offline_queue_limit
+        self.offline_command_ttl = offline_command_ttl
+        # Liveness timers are keyed by VehicleRecord, offline command expiry
+        # by ('ttl', acs_id). The wheel lock is only ever taken last, so it
+        # can be taken under a shard lock.
+        self._wheel_lock = threading.Lock()
+        self._wheel = TimerWheel(time.time())
+        self._sweep_lock = threading.Lock()
+
+        # Persisted state wins over the defaults in `cars`. Neither is a
+        # report from the vehicle, so every vehicle starts offline.
+        saved_vehicles, saved_commands = self.backend.load()
+        for acs_id, car in (cars or {}).items():
+            if acs_id not in saved_vehicles:
+                self._restore(acs_id, car)
+        for acs_id, car in saved_vehicles.items():
+            self._restore(acs_id, car)
+        # Commands in flight at shutdown are queued again; older databases
+        # stored bare command strings
+        now = time.time()
+        expired = []
+        for acs_id, commands in saved_commands.items():
+            entries = collections.deque()
+            for saved in commands:
+                if isinstance(saved, dict) and "id" in saved and "command" in saved:
+                    saved.pop("ack_deadline", None)
+                    entries.append(saved)
+                else:
+                    entries.append(_command_entry(saved, now))
+            shard = self._shard(acs_id)
+            with shard.lock:
+                shard.commands[acs_id] = entries
+                dropped = []
+                self._limit_offline_queue(acs_id, shard, now, dropped)
+            expired.extend((acs_id, entry) for entry in dropped)
+        if on_expired:
+            for acs_id, entry in expired:
+                on_expired(acs_id, entry)
+
+    def _restore(self, acs_id, car):
+        shard = self._shard(acs_id)
+        with shard.lock:
+            record = shard.vehicles.get(acs_id)
+            if record is None:
+                record = shard.vehicles[acs_id] = VehicleRecord(acs_id)
+            self._apply(record, *(car.get(field) for field in VEHICLE_FIELDS))
+            self._record_change(acs_id, record)
+
+    @staticmethod
+    def _apply(record, lat, lon, status, path):
+        if lat is not None:
+            record.lat = lat
+        if lon is not None:
+            record.lon = lon
+        if status is not None:
+            record.status = status
+        if path is not None:
+            record.path = path
+
+    def _arm(self, key, when):
+        with self._wheel_lock:
+            self._wheel.schedule(key, when)
+
+    def _seen(self, acs_id, record, now):
+        # Caller holds the shard lock of acs_id. Returns True if the vehicle
+        # came back online (its timer is armed again).
+        record.updated_at = now
+        if record.liveness == ONLINE:
+            return False
+        record.liveness = ONLINE
+        self._arm(record, now + self.stale_after)
+        return True
+
+    def _shard_index(self, acs_id):
+        return zlib.crc32(acs_id.encode('utf-8')) % len(self._shards)
+
+    def _shard(self, acs_id):
+        return self._shards[self._shard_index(acs_id)]
+
+    def _record_change(self, acs_id, record):
+        # Caller holds the shard lock of acs_id
+        with self._change_lock:
+            self._version += 1
+            record.version = self._version
+            self._change_log.append((self._version, acs_id))
+            self._changed.notify_all()
+        self.backend.save_vehicle(acs_id, record.as_dict())
+
+    def _record_changes(self, changes):
+        # Caller holds the shard lock of every acs_id in `changes`
+        with self._change_lock:
+            version = self._version
+            log = self._change_log
+            for acs_id, record in changes:
+                version += 1
+                record.version = version
+                log.append((version, acs_id))
+            self._version = version
+            self._changed.notify_all()
+        save = self.backend.save_vehicle
+        for acs_id, record in changes:
+            save(acs_id, record.as_dict())
+
+    # ------------------------------------------------------------------
+    # Vehicle state
+    # ------------------------------------------------------------------
+    @property
+    def version(self):
+        return self._version
+
+    def __contains__(self, acs_id):
+        shard = self._shard(acs_id)
+        with shard.lock:
+            return acs_id in shard.vehicles
+
+    def __len__(self):
+        return sum(len(shard.vehicles) for shard in self._shards)
+
+    def ids(self):
+        ids = []
+        for shard in self._shards:
+            with shard.lock:
+                ids.extend(shard.vehicles)
+        return ids
+
+    def get(self, acs_id):
+        """
+        Returns a dict copy of one vehicle, or None if it is unknown.
+        """
+        shard = self._shard(acs_id)
+        with shard.lock:
+            record = shard.vehicles.get(acs_id)
+            return record.as_dict() if record else None
+
+    def update(self, acs_id, lat=None, lon=None, status=None, path=None):
+        """
+        Creates or updates a vehicle. Fields left as None keep their value.
+        """
+        shard = self._shard(acs_id)
+        with shard.lock:
+            record = shard.vehicles.get(acs_id)
+            if record is None:
+                record = shard.vehicles[acs_id] = VehicleRecord(acs_id)
+            self._apply(record, lat, lon, status, path)
+            self._seen(acs_id, record, time.time())
+            self._record_change(acs_id, record)
+
+    def update_many(self, updates):
+        """
+        Applies (acs_id, lat, lon, status, path) tuples with one lock
+        round-trip per shard instead of per vehicle. None keeps a field.
+        Used by the simulator to move thousands of vehicles per tick.
+        """
+        by_shard = collections.defaultdict(list)
+        for update in updates:
+            by_shard[self._shard(update[0])].append(update)
+        now = time.time()
+        for shard, batch in by_shard.items():
+            changes = []
+            with shard.lock:
+                vehicles = shard.vehicles
+                for acs_id, lat, lon, status, path in batch:
+                    record = vehicles.get(acs_id)
+                    if record is None:
+                        record = vehicles[acs_id] = VehicleRecord(acs_id)
+                    if lat is not None:
+                        record.lat = lat
+                    if lon is not None:
+                        record.lon = lon
+                    if status is not None:
+                        record.status = status
+                    if path is not None:
+                        record.path = path
+                    record.updated_at = now
+                    if record.liveness != ONLINE:
+                        self._seen(acs_id, record, now)
+                    changes.append((acs_id, record))
+                self._record_changes(changes)
+
+    def touch_many(self, ids):
+        """
+        Marks vehicles as having reported now without changing their state,
+        e.g. simulated vehicles standing still. Unknown ids are ignored.
+        """
+        by_shard = collections.defaultdict(list)
+        for acs_id in ids:
+            by_shard[self._shard(acs_id)].append(acs_id)
+        now = time.time()
+        for shard, batch in by_shard.items():
+            changes = []
+            with shard.lock:
+                for acs_id in batch:
+                    record = shard.vehicles.get(acs_id)
+                    if record is not None and self._seen(acs_id, record, now):
+                        changes.append((acs_id, record))
+                if changes:
+                    self._record_changes(changes)
+
+    def set_status(self, acs_id, status):
+        """
+        Sets the status of an existing vehicle. Returns False if unknown.
+        """
+        shard = self._shard(acs_id)
+        with shard.lock:
+            record = shard.vehicles.get(acs_id)
+            if record is None:
+                return False
+            record.status = status
+            self._record_change(acs_id, record)
+            return True
+
+    def offset(self, acs_id, dlat, dlon):
+        """
+        Moves an existing vehicle by a small delta (used by the simulation).
+        """
+        shard = self._shard(acs_id)
+        with shard.lock:
+            record = shard.vehicles.get(acs_id)
+            if record is None:
+                return False
+            record.lat += dlat
+            record.lon += dlon
+            self._record_change(acs_id, record)
+            return True
+
+    def update_times(self):
+        """
+        Returns {acs_id: time of its last update, or None}.
+        """
+        times = {}
+        for shard in self._shards:
+            with shard.lock:
+                for acs_id, record in shard.vehicles.items():
+                    times[acs_id] = record.updated_at
+        return times
+
+    def liveness_counts(self):
+        """
+        Returns {"online": n, "stale": n, "offline": n}.
+        """
+        counts = dict.fromkeys((ONLINE, STALE, OFFLINE), 0)
+        for shard in self._shards:
+            with shard.lock:
+                for record in shard.vehicles.values():
+                    counts[record.liveness] += 1
+        return counts
+
+    def sweep_liveness(self, now=None):
+        """
+        Moves vehicles that stopped reporting to stale and then offline, and
+        drops commands that waited too long for an offline vehicle. Only
+        vehicles whose timer is due are looked at. Returns the number of
+        vehicles that went {"stale", "offline"} and of commands "expired".
+        """
+        now = time.time() if now is None else now
+        counts = {STALE: 0, OFFLINE: 0, "expired": 0}
+        expired = []
+        with self._sweep_lock:
+            with self._wheel_lock:
+                due = self._wheel.advance(now)
+            # Most due vehicles have reported since their timer was set and
+            # only need it re-armed. Only the sweeper demotes vehicles, so an
+            # online record with a recent report is safe to read unlocked.
+            rearm = []
+            changing = []
+            stale_after = self.stale_after
+            for key in due:
+                if key.__class__ is VehicleRecord and key.liveness == ONLINE and now - key.updated_at < stale_after:
+                    rearm.append((key, key.updated_at + stale_after))
+                else:
+                    changing.append(key)
+            if rearm:
+                with self._wheel_lock:
+                    self._wheel.schedule_many(rearm)
+
+            for key in changing:
+                ttl = key.__class__ is tuple
+                acs_id = key[1] if ttl else key.acs_id
+                shard = self._shard(acs_id)
+                dropped = []
+                with shard.lock:
+                    record = shard.vehicles.get(acs_id)
+                    offline = record is None or record.liveness == OFFLINE
+                    if ttl:
+                        if offline:
+                            self._limit_offline_queue(acs_id, shard, now, dropped)
+                    elif not offline:
+                        seen = record.updated_at
+                        if now - seen < stale_after:
+                            self._arm(record, seen + stale_after)
+                        elif now - seen < self.offline_after:
+                            if record.liveness == ONLINE:
+                                record.liveness = STALE
+                                self._record_change(acs_id, record)
+                                counts[STALE] += 1
+                            self._arm(record, seen + self.offline_after)
+                        else:
+                            record.liveness = OFFLINE
+                            self._record_change(acs_id, record)
+                            counts[OFFLINE] += 1
+                            self._limit_offline_queue(acs_id, shard, now, dropped)
+                expired.extend((acs_id, entry) for entry in dropped)
+        counts["expired"] = len(expired)
+        if self.on_expired:
+            for acs_id, entry in expired:
+                self.on_expired(acs_id, entry)
+        return counts
+
+    def snapshot(self):
+        """
+        Returns (version, {acs_id: car}). Every change up to `version` is
+        included; a record may already reflect a slightly newer change.
+        """
+        version = self._version
+        cars = {}
+        for shard in self._shards:
+            with shard.lock:
+                for acs_id, record in shard.vehicles.items():
+                    cars[acs_id] = record.as_dict()
+        return version, cars
+
+    def changes_since(self, version):
+        """
+        Returns (current_version, {acs_id: car}) for vehicles changed after
+        `version`.
+        """
+        with self._change_lock:
+            current = self._version
+            log = self._change_log
+            if log and log[0][0] <= version + 1:
+                changed_ids = set()
+                for entry_version, acs_id in reversed(log):
+                    if entry_version <= version:
+                        break
+                    changed_ids.add(acs_id)
+            else:
+                changed_ids = None
+
+        changed = {}
+        if changed_ids is None:
+            # Too far behind for the change log: scan every record
+            for shard in self._shards:
+                with shard.lock:
+                    for acs_id, record in shard.vehicles.items():
+                        if record.version > version:
+                            changed[acs_id] = record.as_dict()
+        else:
+            for acs_id in changed_ids:
+                car = self.get(acs_id)
+                if car is not None:
+                    changed[acs_id] = car
+        return current, changed
+
+    def wait_for_change(self, version, timeout=None):
+        """
+        Blocks until the fleet version passes `version` or the timeout
+        expires. Returns the current version.
+        """
+        with self._changed:
+            self._changed.wait_for(lambda: self._version > version, timeout=timeout)
+            return self._version
+
+    # ------------------------------------------------------------------
+    # Command queues
+    # ------------------------------------------------------------------
+    def _save_commands(self, acs_id, shard):
+        # Caller holds shard.lock. In-flight entries are saved too, so they
+        # are redelivered after a restart; copies, because entries change.
+        inflight = shard.inflight.get(acs_id, {})
+        queue = shard.commands.get(acs_id, ())
+        self.backend.save_commands(acs_id, [dict(e) for e in inflight.values()] + [dict(e) for e in queue])
+
+    def _limit_offline_queue(self, acs_id, shard, now, expired):
+        # Caller holds shard.lock; the vehicle is offline. Moves commands
+        # older than offline_command_ttl, and the oldest beyond
+        # offline_queue_limit, into `expired` and arms the timer for the
+        # next command to expire.
+        queue = shard.commands.get(acs_id)
+        if not queue:
+            return
+        cutoff = now - self.offline_command_ttl
+        dropped = 0
+        while queue and (len(queue) > self.offline_queue_limit or queue[0]["enqueued_at"] <= cutoff):
+            entry = queue.popleft()
+            entry["reason"] = "expired while offline" if entry["enqueued_at"] <= cutoff else "offline queue full"
+            expired.append(entry)
+            dropped += 1
+        if dropped:
+            self._save_commands(acs_id, shard)
+        if queue:
+            with self._wheel_lock:
+                if ('ttl', acs_id) not in self._wheel:
+                    self._wheel.schedule(('ttl', acs_id), queue[0]["enqueued_at"] + self.offline_command_ttl)
+
+    def _enqueue_locked(self, acs_id, shard, command, now, expired, supersede=False):
+        queue = shard.commands.get(acs_id)
+        if queue is None:
+            queue = shard.commands[acs_id] = collections.deque()
+        if supersede:
+            # A late ack of a cancelled in-flight command finds nothing to ack
+            inflight = shard.inflight.pop(acs_id, None)
+            cancelled = list(inflight.values()) if inflight else []
+            cancelled.extend(queue)
+            queue.clear()
+            for entry in cancelled:
+                entry.pop("ack_deadline", None)
+                entry["reason"] = "superseded by a stop"
+            expired.extend(cancelled)
+        entry = _command_entry(command, now)
+        queue.append(entry)
+        record = shard.vehicles.get(acs_id)
+        if record is None or record.liveness == OFFLINE:
+            self._limit_offline_queue(acs_id, shard, now, expired)
+        self._save_commands(acs_id, shard)
+        shard.condition(acs_id).notify_all()
+        return entry["id"]
+
+    def enqueue_command(self, acs_id, command, supersede=False):
+        """
+        Queues an encrypted command and wakes the vehicle's long-poll.
+        With supersede=True the vehicle's queued and in-flight commands are
+        cancelled first (see the class docstring). Returns the command id.
+        """
+        shard = self._shard(acs_id)
+        expired = []
+        with shard.lock:
+            command_id = self._enqueue_locked(acs_id, shard, command, time.time(), expired, supersede)
+        if self.on_expired:
+            for entry in expired:
+                self.on_expired(acs_id, entry)
+        return command_id
+
+    def enqueue_many(self, commands, on_queued=None, supersede=False):
+        """
+        Queues {acs_id: command} for many vehicles at once. All affected
+        shard locks are held together (taken in shard order), so pollers see
+        either none or all of the commands. `supersede` is as for
+        enqueue_command. Returns {acs_id: command id}.
+
+        `on_queued(ids)` runs before the locks are released, so whatever it
+        registers is in place before any vehicle can fetch a command.
+        """
+        by_shard = collections.defaultdict(list)
+        for acs_id, command in commands.items():
+            by_shard[self._shard_index(acs_id)].append((acs_id, command))
+        ids = {}
+        expired = []
+        now = time.time()
+        with contextlib.ExitStack() as stack:
+            for index in sorted(by_shard):
+                stack.enter_context(self._shards[index].lock)
+            for index, items in by_shard.items():
+                shard = self._shards[index]
+                for acs_id, command in items:
+                    dropped = []
+                    ids[acs_id] = self._enqueue_locked(acs_id, shard, command, now, dropped, supersede)
+                    expired.extend((acs_id, entry) for entry in dropped)
+            if on_queued is not None:
+                on_queued(ids)
+        if self.on_expired:
+            for acs_id, entry in expired:
+                self.on_expired(acs_id, entry)
+        return ids
+
+    def _requeue_expired(self, acs_id, shard, now, expired):
+        # Caller holds shard.lock. Moves in-flight entries past their ack
+        # deadline back to the front of the queue (or into `expired` after
+        # max_attempts), then expires queued entries older than max_age.
+        # Returns the next ack deadline, or None.
+        inflight = shard.inflight.get(acs_id)
+        queue = shard.commands.get(acs_id)
+        retry = []
+        next_deadline = None
+        expired_before = len(expired)
+        for entry in list(inflight.values()) if inflight else ():
+            if entry["ack_deadline"] <= now:
+                del inflight[entry["id"]]
+                del entry["ack_deadline"]
+                (expired if entry["attempts"] >= self.max_attempts else retry).append(entry)
+            elif next_deadline is None or entry["ack_deadline"] < next_deadline:
+                next_deadline = entry["ack_deadline"]
+        if retry:
+            if queue is None:
+                queue = shard.commands[acs_id] = collections.deque()
+            retry.sort(key=lambda entry: entry["enqueued_at"], reverse=True)
+            queue.extendleft(retry)
+        if self.max_age is not None and queue:
+            # The queue is in enqueue order, so the too-old entries are at the front
+            cutoff = now - self.max_age
+            while queue and queue[0]["enqueued_at"] <= cutoff:
+                entry = queue.popleft()
+                entry["reason"] = "too old to deliver"
+                expired.append(entry)
+        if retry or len(expired) > expired_before:
+            self._save_commands(acs_id, shard)
+        return next_deadline
+
+    def lease_command(self, acs_id, timeout=0.0, ack=True):
+        """
+        Waits up to `timeout` seconds for a command and hands out the oldest
+        one. Returns a copy of its entry (plus "delivered_at"), or None.
+        While an earlier command is in flight nothing is handed out: the
+        call waits for its ack or its redelivery, so commands never overtake
+        one another. With ack=True the entry stays in flight until ack_command and is
+        redelivered if the ack does not arrive in time; with ack=False it is
+        removed immediately (at-most-once, for clients without acks).
+        """
+        shard = self._shard(acs_id)
+        deadline = time.monotonic() + timeout
+        expired = []
+        result = None
+        with shard.lock:
+            condition = shard.condition(acs_id)
+            while True:
+                now = time.time()
+                next_retry = self._requeue_expired(acs_id, shard, now, expired)
+                queue = shard.commands.get(acs_id)
+                ready = queue and not shard.inflight.get(acs_id)
+                remaining = deadline - time.monotonic()
+                if ready or remaining <= 0:
+                    break
+                if next_retry is not None:
+                    remaining = min(remaining, max(next_retry - now, 0.01))
+                condition.wait(remaining)
+            if ready:
+                entry = queue.popleft()
+                entry["attempts"] += 1
+                entry["delivered_at"] = now
+                if ack:
+                    entry["ack_deadline"] = now + self.ack_timeout
+                    shard.inflight.setdefault(acs_id, {})[entry["id"]] = entry
+                self._save_commands(acs_id, shard)
+                result = dict(entry)
+        if self.on_expired:
+            for entry in expired:
+                self.on_expired(acs_id, entry)
+        return result
+
+    def ack_command(self, acs_id, command_id):
+        """
+        Marks a leased command as handled. Returns its entry, or None if it
+        is not in flight (unknown, already acked, or given up).
+        """
+        shard = self._shard(acs_id)
+        with shard.lock:
+            inflight = shard.inflight.get(acs_id)
+            entry = inflight.pop(command_id, None) if inflight else None
+            if entry is not None:
+                self._save_commands(acs_id, shard)
+                # A lease may be waiting for this ack to hand out the next command
+                shard.condition(acs_id).notify_all()
+            return entry
+
+    def pop_command(self, acs_id):
+        """
+        Removes and returns the oldest queued command, or None.
+        """
+        entry = self.lease_command(acs_id, 0.0, ack=False)
+        return entry["command"] if entry else None
+
+    def wait_command(self, acs_id, timeout):
+        """
+        Waits up to `timeout` seconds for a command, then pops it.
+        Returns the command or None.
+        """
+        entry = self.lease_command(acs_id, timeout, ack=False)
+        return entry["command"] if entry else None
+
+    def command_depths(self):
+        """
+        Returns {acs_id: number of queued commands} (not counting in-flight).
+        """
+        depths = {}
+        for shard in self._shards:
+            with shard.lock:
+                for acs_id, queue in shard.commands.items():
+                    depths[acs_id] = len(queue)
+        return depths
@@ -0,0 +1,448 @@
+"""
+Live spatial index of vehicle positions, with geofences.
+
+Positions are projected onto a local plane in metres (equirectangular
+around `origin`; the error stays well under a metre within a few
+kilometres of it) and bucketed into a uniform grid of `cell_m` cells.
+Moving a vehicle touches the grid only when it crosses into another cell,
+so keeping the index current costs a few dict operations per update, and
+radius and box queries look only at the cells they overlap.
+
+Geofences are circles, polygons and corridors (a polyline with a
+half-width, e.g. the loop of a path). Each fence is registered in the grid
+cells it reaches, together with a test for that cell: cells entirely
+inside the fence need no test at all, and a corridor cell only checks the
+segments near it. An update therefore evaluates only the fences of its own
+cell. When the set of fences a vehicle is inside changes, "enter" and
+"exit" events are appended to a numbered ring that the API tails with
+events_since(cursor), like the log rings.
+"""
+import collections
+import math
+import threading
+import time
+
+CELL_METERS = 50.0          # Grid cell size
+METERS_PER_DEGREE = 111320.0
+DEFAULT_MAX_EVENTS = 10000  # Breach events kept for the API
+MAX_QUERY_CELLS = 40000     # Larger queries scan the occupied cells instead
+DEFAULT_MAX_FENCE_CELLS = 100000  # Grid cells one fence may cover (about 250 km² at 50 m)
+FENCE_KINDS = ('circle', 'polygon', 'corridor')
+TRIGGERS = ('enter', 'exit', 'both')
+
+_EMPTY = frozenset()
+
+def _segment_dist2(x, y, ax, ay, bx, by):
+    # Squared distance from (x, y) to the segment a-b
+    dx, dy = bx - ax, by - ay
+    length2 = dx * dx + dy * dy
+    t = ((x - ax) * dx + (y - ay) * dy) / length2 if length2 else 0.0
+    t = 0.0 if t < 0.0 else 1.0 if t > 1.0 else t
+    px, py = ax + t * dx - x, ay + t * dy - y
+    return px * px + py * py
+
+def _point_in_polygon(x, y, points):
+    inside = False
+    jx, jy = points[-1]
+    for ix, iy in points:
+        if (iy > y) != (jy > y) and x < (jx - ix) * (y - iy) / (jy - iy) + ix:
+            inside = not inside
+        jx, jy = ix, iy
+    return inside
+
+def _corridor_test(segments, width):
+    w2 = width * width
+
+    def test(x, y):
+        for ax, ay, bx, by in segments:
+            if _segment_dist2(x, y, ax, ay, bx, by) <= w2:
+                return True
+        return False
+    return test
+
+class Fence:
+    """
+    One geofence. `vehicles` (a set of ids) and `path` restrict it to some
+    vehicles; `on` is which crossings raise events.
+    """
+    __slots__ = ('id', 'name', 'kind', 'points', 'radius', 'width', 'closed', 'on', 'vehicles', 'path')
+
+    def __init__(self, spec, fence_id):
+        if not isinstance(spec, dict):
+            raise ValueError("A fence must be a JSON object")
+        kind = spec.get('kind')
+        if kind not in FENCE_KINDS:
+            raise ValueError(f"kind must be one of {', '.join(FENCE_KINDS)}")
+        self.id = str(spec.get('id') or fence_id)
+        self.name = str(spec.get('name') or self.id)
+        self.kind = kind
+        self.on = spec.get('on', 'exit' if kind == 'corridor' else 'both')
+        if self.on not in TRIGGERS:
+            raise ValueError(f"on must be one of {', '.join(TRIGGERS)}")
+        vehicles = spec.get('vehicles')
+        self.vehicles = frozenset(map(str, vehicles)) if vehicles else None
+        self.path = spec.get('path')
+        self.radius = self.width = None
+        self.closed = False
+        try:
+            if kind == 'circle':
+                self.points = [tuple(map(float, spec['center']))]
+                self.radius = float(spec['radius_m'])
+                if self.radius <= 0:
+                    raise ValueError("radius_m must be positive")
+            else:
+                self.points = [tuple(map(float, point)) for point in spec['points']]
+                if kind == 'polygon' and len(self.points) < 3:
+                    raise ValueError("a polygon needs at least 3 points")
+                if kind == 'corridor':
+                    if len(self.points) < 2:
+                        raise ValueError("a corridor needs at least 2 points")
+                    self.width = float(spec['width_m'])
+                    self.closed = bool(spec.get('closed', False))
+                    if self.width <= 0:
+                        raise ValueError("width_m must be positive")
+        except (KeyError, TypeError) as e:
+            raise ValueError(f"Invalid {kind} fence: {e}") from None
+        if any(len(point) != 2 for point in self.points):
+            raise ValueError("points must be [lat, lon] pairs")
+        if not all(math.isfinite(v) for v in (*sum(self.points, ()), self.radius or 0.0, self.width or 0.0)):
+            raise ValueError("coordinates and sizes must be finite numbers")
+
+    def applies(self, acs_id, path):
+        return ((self.vehicles is None or acs_id in self.vehicles)
+                and (self.path is None or self.path == path))
+
+    def as_dict(self):
+        result = {"id": self.id, "name": self.name, "kind": self.kind, "on": self.on,
+                  "vehicles": sorted(self.vehicles) if self.vehicles else None, "path": self.path}
+        if self.kind == 'circle':
+            result.update(center=list(self.points[0]), radius_m=self.radius)
+        else:
+            result["points"] = [list(point) for point in self.points]
+        if self.kind == 'corridor':
+            result.update(width_m=self.width, closed=self.closed)
+        return result
+
+class _Vehicle:
+    __slots__ = ('lat', 'lon', 'x', 'y', 'cell', 'path', 'inside')
+
+class GeoIndex:
+    """
+    Thread-safe index of the latest position of every vehicle, plus the
+    geofences evaluated against each update. If `metrics` (a
+    MetricsRegistry) is given, events are counted in geofence_events_total.
+    A fence reaching more than `max_fence_cells` grid cells is rejected.
+    """
+
+    def __init__(self, origin=(0.0, 0.0), cell_m=CELL_METERS, max_events=DEFAULT_MAX_EVENTS, metrics=None,
+                 max_fence_cells=DEFAULT_MAX_FENCE_CELLS):
+        self.cell_m = cell_m
+        self.max_fence_cells = max_fence_cells
+        self.metrics = metrics
+        self._lat0, self._lon0 = origin
+        self._kx = METERS_PER_DEGREE * math.cos(math.radians(self._lat0))
+        self._lock = threading.Lock()
+        self._vehicles = {}            # acs_id -> _Vehicle
+        self._cells = {}               # cell -> set of acs_ids
+        self._fences = {}              # fence id -> Fence
+        self._fence_cells = {}         # cell -> [(Fence, test or None if always inside)]
+        self._events = collections.deque(maxlen=max_events)
+        self._next_seq = 1
+        self._fence_count = 0
+
+    def _xy(self, lat, lon):
+        return (lon - self._lon0) * self._kx, (lat - self._lat0) * METERS_PER_DEGREE
+
+    def _cell_range(self, min_x, min_y, max_x, max_y):
+        size = self.cell_m
+        return (range(math.floor(min_x / size), math.floor(max_x / size) + 1),
+                range(math.floor(min_y / size), math.floor(max_y / size) + 1))
+
+    # ------------------------------------------------------------------
+    # Vehicles
+    # ------------------------------------------------------------------
+    def update(self, acs_id, lat, lon, path=None, t=None):
+        """
+        Moves a vehicle (path None keeps its path) and evaluates the fences
+        at its new position.
+        """
+        with self._lock:
+            self._move(acs_id, lat, lon, path, time.time() if t is None else t)
+
+    def update_many(self, positions, t=None):
+        """
+        update() for (acs_id, lat, lon, path) tuples, under one lock.
+        """
+        t = time.time() if t is None else t
+        with self._lock:
+            for acs_id, lat, lon, path in positions:
+                self._move(acs_id, lat, lon, path, t)
+
+    def set_path(self, acs_id, path):
+        """
+        Changes the path of a known vehicle; fences are re-evaluated at once.
+        """
+        with self._lock:
+            vehicle = self._vehicles.get(acs_id)
+            if vehicle is not None:
+                self._move(acs_id, vehicle.lat, vehicle.lon, path, time.time())
+
+    def _move(self, acs_id, lat, lon, path, t):
+        # Caller holds self._lock
+        x = (lon - self._lon0) * self._kx
+        y = (lat - self._lat0) * METERS_PER_DEGREE
+        cell = (int(x // self.cell_m), int(y // self.cell_m))
+        vehicle = self._vehicles.get(acs_id)
+        if vehicle is None:
+            vehicle = self._vehicles[acs_id] = _Vehicle()
+            vehicle.path = path
+            vehicle.inside = _EMPTY
+            self._cells.setdefault(cell, set()).add(acs_id)
+        elif vehicle.cell != cell:
+            members = self._cells[vehicle.cell]
+            members.discard(acs_id)
+            if not members:
+                del self._cells[vehicle.cell]
+            self._cells.setdefault(cell, set()).add(acs_id)
+        vehicle.lat, vehicle.lon, vehicle.x, vehicle.y, vehicle.cell = lat, lon, x, y, cell
+        if path is not None:
+            vehicle.path = path
+
+        fences = self._fence_cells.get(cell)
+        if fences:
+            path = vehicle.path
+            inside = frozenset([fence.id for fence, test in fences
+                                if fence.applies(acs_id, path) and (test is None or test(x, y))])
+        else:
+            inside = _EMPTY
+        if inside != vehicle.inside:
+            self._crossed(acs_id, vehicle, inside, t)
+
+    def _crossed(self, acs_id, vehicle, inside, t):
+        # Caller holds self._lock
+        changes = [(fence_id, "enter") for fence_id in inside - vehicle.inside]
+        changes += [(fence_id, "exit") for fence_id in vehicle.inside - inside]
+        vehicle.inside = inside
+        for fence_id, kind in changes:
+            fence = self._fences.get(fence_id)
+            # No exit for a fence that was removed or no longer applies
+            # (the vehicle changed path)
+            if fence is None or fence.on not in (kind, 'both') or not fence.applies(acs_id, vehicle.path):
+                continue
+            self._events.append({"seq": self._next_seq, "t": t, "acs_id": acs_id, "type": kind,
+                                 "fence": fence.id, "name": fence.name, "lat": vehicle.lat, "lon": vehicle.lon})
+            self._next_seq += 1
+            if self.metrics is not None:
+                self.metrics.inc("geofence_events_total")
+
+    def within_radius(self, lat, lon, radius_m, limit=None):
+        """
+        Returns [[acs_id, distance in metres], ...] of the vehicles within
+        `radius_m` of (lat, lon), nearest first.
+        """
+        x, y = self._xy(lat, lon)
+        r2 = radius_m * radius_m
+        found = []
+        with self._lock:
+            for acs_id in self._candidates(x - radius_m, y - radius_m, x + radius_m, y + radius_m):
+                vehicle = self._vehicles[acs_id]
+                d2 = (vehicle.x - x) ** 2 + (vehicle.y - y) ** 2
+                if d2 <= r2:
+                    found.append([acs_id, math.sqrt(d2)])
+        found.sort(key=lambda item: item[1])
+        return found[:limit] if limit else found
+
+    def within_box(self, min_lat, min_lon, max_lat, max_lon):
+        """
+        Returns the ids of the vehicles whose latest position is inside the box.
+        """
+        min_x, min_y = self._xy(min_lat, min_lon)
+        max_x, max_y = self._xy(max_lat, max_lon)
+        with self._lock:
+            return [acs_id for acs_id in self._candidates(min_x, min_y, max_x, max_y)
+                    if min_lat <= self._vehicles[acs_id].lat <= max_lat
+                    and min_lon <= self._vehicles[acs_id].lon <= max_lon]
+
+    def _candidates(self, min_x, min_y, max_x, max_y):
+        # Caller holds self._lock. Ids in the cells overlapping the rectangle.
+        xs, ys = self._cell_range(min_x, min_y, max_x, max_y)
+        if len(xs) * len(ys) > min(MAX_QUERY_CELLS, len(self._cells)):
+            cells = [members for (cx, cy), members in self._cells.items() if cx in xs and cy in ys]
+        else:
+            cells = [self._cells[(cx, cy)] for cx in xs for cy in ys if (cx, cy) in self._cells]
+        return [acs_id for members in cells for acs_id in members]
+
+    def inside(self, acs_id):
+        """
+        Returns the ids of the fences a vehicle is currently inside.
+        """
+        with self._lock:
+            vehicle = self._vehicles.get(acs_id)
+            return sorted(vehicle.inside) if vehicle else []
+
+    # ------------------------------------------------------------------
+    # Fences
+    # ------------------------------------------------------------------
+    def add_fence(self, spec):
+        """
+        Adds (or, with an existing "id", replaces) a fence from a JSON spec:
+
+            {"kind": "circle", "center": [lat, lon], "radius_m": 50}
+            {"kind": "polygon", "points": [[lat, lon], ...]}
+            {"kind": "corridor", "points": [[lat, lon], ...], "width_m": 20, "closed": true}
+
+        plus optional "id", "name", "on" ("enter", "exit" or "both";
+        corridors default to "exit", the others to "both"), "vehicles" (ids)
+        and "path" (only vehicles on that path). Vehicles already inside do
+        not raise "enter". Raises ValueError for an invalid spec or a fence
+        reaching more than max_fence_cells cells. Returns the fence as a
+        dict.
+        """
+        with self._lock:
+            self._fence_count += 1
+            fence = Fence(spec, f"fence-{self._fence_count}")
+            cells = self._fence_tests(fence)
+            self._drop_fence(fence.id)
+            self._fences[fence.id] = fence
+            for cell, test in cells.items():
+                self._fence_cells.setdefault(cell, []).append((fence, test))
+            for acs_id, vehicle in self._vehicles.items():
+                entry = cells.get(vehicle.cell, False)
+                if entry is not False and fence.applies(acs_id, vehicle.path) and (entry is None or entry(vehicle.x, vehicle.y)):
+                    vehicle.inside = vehicle.inside | {fence.id}
+            return fence.as_dict()
+
+    def remove_fence(self, fence_id):
+        """
+        Removes a fence. Returns False if there is no such fence.
+        """
+        with self._lock:
+            return self._drop_fence(fence_id)
+
+    def _drop_fence(self, fence_id):
+        # Caller holds self._lock
+        fence = self._fences.pop(fence_id, None)
+        if fence is None:
+            return False
+        for cell in [cell for cell, entries in self._fence_cells.items() if any(f is fence for f, _ in entries)]:
+            entries = [entry for entry in self._fence_cells[cell] if entry[0] is not fence]
+            if entries:
+                self._fence_cells[cell] = entries
+            else:
+                del self._fence_cells[cell]
+        for vehicle in self._vehicles.values():
+            if fence_id in vehicle.inside:
+                vehicle.inside = vehicle.inside - {fence_id}
+        return True
+
+    def fences(self):
+        with self._lock:
+            return [fence.as_dict() for fence in self._fences.values()]
+
+    def _fence_tests(self, fence):
+        """
+        Returns {cell: test} for every cell the fence reaches: None if the
+        whole cell is inside the fence, else a test(x, y).
+        """
+        size = self.cell_m
+        points = [self._xy(lat, lon) for lat, lon in fence.points]
+        # Bound the work from the bounding boxes before enumerating any cell
+        reach = self._cell_estimate(fence, points)
+        if reach > self.max_fence_cells:
+            raise ValueError(f"fence reaches about {reach} grid cells, more than the {self.max_fence_cells} allowed")
+        cells = {}
+
+        def corners(cx, cy):
+            return ((cx * size, cy * size), ((cx + 1) * size, cy * size),
+                    (cx * size, (cy + 1) * size), ((cx + 1) * size, (cy + 1) * size))
+
+        if fence.kind == 'circle':
+            (x0, y0), r = points[0], fence.radius
+            test = lambda x, y: (x - x0) ** 2 + (y - y0) ** 2 <= r * r
+            xs, ys = self._cell_range(x0 - r, y0 - r, x0 + r, y0 + r)
+            for cx in xs:
+                for cy in ys:
+                    # Nearest point of the cell to the centre
+                    nx = min(max(x0, cx * size), (cx + 1) * size)
+                    ny = min(max(y0, cy * size), (cy + 1) * size)
+                    if not test(nx, ny):
+                        continue
+                    cells[(cx, cy)] = None if all(test(*c) for c in corners(cx, cy)) else test
+
+        elif fence.kind == 'polygon':
+            xs = [x for x, _ in points]
+            ys = [y for _, y in points]
+            edges = list(zip(points, points[1:] + points[:1]))
+            test = lambda x, y: _point_in_polygon(x, y, points)
+            cell_xs, cell_ys = self._cell_range(min(xs), min(ys), max(xs), max(ys))
+            boundary = set()
+            for (ax, ay), (bx, by) in edges:
+                exs, eys = self._cell_range(min(ax, bx), min(ay, by), max(ax, bx), max(ay, by))
+                boundary.update((cx, cy) for cx in exs for cy in eys)
+            for cx in cell_xs:
+                for cy in cell_ys:
+                    if (cx, cy) in boundary:
+                        cells[(cx, cy)] = test
+                    elif test((cx + 0.5) * size, (cy + 0.5) * size):
+                        cells[(cx, cy)] = None   # No edge crosses it: all inside
+
+        else:
+            w = fence.width
+            pairs = list(zip(points, points[1:] + (points[:1] if fence.closed else [])))
+            near = collections.defaultdict(list)
+            for (ax, ay), (bx, by) in pairs:
+                xs, ys = self._cell_range(min(ax, bx) - w, min(ay, by) - w, max(ax, bx) + w, max(ay, by) + w)
+                for cx in xs:
+                    for cy in ys:
+                        near[(cx, cy)].append((ax, ay, bx, by))
+            w2 = w * w
+            for cell, segments in near.items():
+                # Distance to a segment is convex, so a cell whose corners
+                # are all within `w` of one segment is entirely inside
+                full = any(all(_segment_dist2(x, y, *segment) <= w2 for x, y in corners(*cell))
+                           for segment in segments)
+                cells[cell] = None if full else _corridor_test(segments, w)
+        return cells
+
+    def _cell_estimate(self, fence, points):
+        # Upper bound on the cells _fence_tests visits: the bounding box, plus
+        # one box per edge (polygon boundaries) or per segment (corridors)
+        def box(min_x, min_y, max_x, max_y):
+            xs, ys = self._cell_range(min_x, min_y, max_x, max_y)
+            return len(xs) * len(ys)
+
+        if fence.kind == 'circle':
+            (x0, y0), r = points[0], fence.radius
+            return box(x0 - r, y0 - r, x0 + r, y0 + r)
+        w = fence.width or 0.0
+        closed = fence.kind == 'polygon' or fence.closed
+        total = box(min(x for x, _ in points), min(y for _, y in points),
+                    max(x for x, _ in points), max(y for _, y in points)) if fence.kind == 'polygon' else 0
+        for (ax, ay), (bx, by) in zip(points, points[1:] + (points[:1] if closed else [])):
+            total += box(min(ax, bx) - w, min(ay, by) - w, max(ax, bx) + w, max(ay, by) + w)
+            if total > self.max_fence_cells:
+                break
+        return total
+
+    # ------------------------------------------------------------------
+    # Events
+    # ------------------------------------------------------------------
+    def events_since(self, since=0, limit=None):
+        """
+        Returns (events, next_cursor, dropped): up to `limit` events with a
+        sequence number above `since`, the cursor to pass next time, and how
+        many events after `since` were already evicted.
+        """
+        with self._lock:
+            first = self._events[0]["seq"] if self._events else self._next_seq
+            dropped = max(0, first - since - 1)
+            events = [event for event in self._events if event["seq"] > since]
+        if limit is not None:
+            events = events[:limit]
+        next_cursor = events[-1]["seq"] if events else max(since, first - 1)
+        return events, next_cursor, dropped
+
+    def stats(self):
+        with self._lock:
+            return {"vehicles": len(self._vehicles), "cells": len(self._cells), "fences": len(self._fences),
+                    "fence_cells": len(self._fence_cells), "events": self._next_seq - 1}
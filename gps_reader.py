@@ -0,0 +1,161 @@
+"""
+Background GPS reading for the vehicle client.
+
+GpsReader drains the receiver on its own thread, parses sentences with
+nmea.py and keeps only the latest fix, so the telemetry loop reads a
+position without ever blocking on the serial port:
+
+    reader = GpsReader("/dev/ttyACM0")
+    reader.start()
+    fix = reader.latest()      # GpsFix or None
+"""
+import collections
+import threading
+import time
+import serial  # For GPS communication
+import nmea
+
+# How long to back off after an empty read (serial timeout or end of a file)
+EMPTY_READ_BACKOFF = 0.05
+
+# Latest position published by GpsReader.
+# quality is the GGA fix quality (0 = no fix, 1 = GPS, 2 = DGPS, 4/5 = RTK),
+# speed is m/s, course is degrees true, timestamp is time.monotonic() when
+# the sentence was read. Fields the receiver has not reported yet are None.
+GpsFix = collections.namedtuple('GpsFix', [
+    'lat', 'lon', 'alt', 'quality', 'speed', 'course', 'hdop', 'satellites', 'timestamp'
+])
+
+# Fields carried over from earlier sentences (e.g. VTG speed, GSA HDOP)
+# into the next published position
+AUX_FIELDS = ('alt', 'quality', 'speed', 'course', 'hdop', 'satellites')
+
+def parse_nmea_sentence(nmea_sentence):
+    """
+    Parse NMEA GNGGA sentence to extract GPS coordinates.
+    Extracted from gps.py for use without ROS dependency.
+    Legacy parser without checksum validation; GpsReader uses nmea.py.
+    """
+    data = nmea_sentence.split(',')
+
+    if data[0] == "$GNGGA":
+        try:
+            lat_deg = float(data[2][:2])
+            lat_min = float(data[2][2:])
+            latitude = lat_deg + (lat_min / 60.0)
+            if data[3] == 'S':
+                latitude = -latitude
+
+            lon_deg = float(data[4][:3])
+            lon_min = float(data[4][3:])
+            longitude = lon_deg + (lon_min / 60.0)
+            if data[5] == 'W':
+                longitude = -longitude
+
+            altitude = float(data[9]) if data[9] else 0.0
+
+            return latitude, longitude, altitude
+        except (ValueError, IndexError):
+            return None, None, None
+    return None, None, None
+
+class GpsReader(threading.Thread):
+    """
+    Background thread that continuously drains a GPS receiver and keeps
+    only the latest fix, so readers never block on the serial port.
+
+    `source` is either a serial port path, opened with pyserial (and reopened
+    after errors), or any already-open object whose readline() returns bytes,
+    such as a pty or a file of recorded NMEA sentences.
+    """
+
+    def __init__(self, source, baudrate=38400, timeout=1, reconnect_delay=2.0):
+        super().__init__(name="gps-reader", daemon=True)
+        self.source = source
+        self.baudrate = baudrate
+        self.timeout = timeout
+        self.reconnect_delay = reconnect_delay
+        self._stream = None if isinstance(source, str) else source
+        self._lock = threading.Lock()
+        self._fix = None
+        self._aux = dict.fromkeys(AUX_FIELDS)
+        self._stop_event = threading.Event()
+
+    def latest(self):
+        """
+        Returns the most recent GpsFix, or None if no fix has been read yet.
+        """
+        with self._lock:
+            return self._fix
+
+    def fix_age(self):
+        """
+        Seconds since the latest fix was read, or None if there is none.
+        """
+        fix = self.latest()
+        if fix is None:
+            return None
+        return time.monotonic() - fix.timestamp
+
+    def stop(self):
+        self._stop_event.set()
+
+    def _open(self):
+        if self._stream is not None:
+            return True
+        try:
+            print(f"[GPS] Connecting to GPS on {self.source} at {self.baudrate} baud...")
+            self._stream = serial.Serial(self.source, self.baudrate, timeout=self.timeout)
+            print("[GPS] Connected successfully!")
+            return True
+        except serial.SerialException as e:
+            print(f"[GPS] WARNING: Could not connect to GPS: {e}")
+            return False
+
+    def _close(self):
+        if isinstance(self.source, str) and self._stream is not None:
+            try:
+                self._stream.close()
+            except Exception:
+                pass
+            self._stream = None
+
+    def handle_line(self, line):
+        """
+        Parses one NMEA line, str or bytes (GGA/RMC/VTG/GSA from any talker,
+        checksum verified), and publishes a new fix if it carries a valid
+        position.
+        """
+        parsed = nmea.parse_sentence(line)
+        if parsed is None:
+            return
+        aux = self._aux
+        for name in AUX_FIELDS:
+            value = getattr(parsed, name)
+            if value is not None:
+                aux[name] = value
+        if not parsed.has_position or not parsed.valid:
+            return
+        fix = GpsFix(parsed.lat, parsed.lon, aux['alt'], aux['quality'], aux['speed'],
+                     aux['course'], aux['hdop'], aux['satellites'], time.monotonic())
+        with self._lock:
+            self._fix = fix
+
+    def run(self):
+        while not self._stop_event.is_set():
+            if not self._open():
+                self._stop_event.wait(self.reconnect_delay)
+                continue
+            try:
+                raw = self._stream.readline()
+            except (serial.SerialException, OSError) as e:
+                print(f"[GPS] Read error: {e}")
+                self._close()
+                self._stop_event.wait(self.reconnect_delay)
+                continue
+
+            if not raw:
+                self._stop_event.wait(EMPTY_READ_BACKOFF)
+                continue
+            self.handle_line(raw)
+        self._close()
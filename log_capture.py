@@ -0,0 +1,104 @@
+"""
+stdout/stderr capture for the vehicle stack.
+
+LogCapture drains the stack's pipes on one thread per pipe, so a chatty
+stack never blocks on a full pipe buffer. Lines go into a fixed-size
+LogRing (see log_store.py) for uploading to the server and, if a file is
+given, into a size-rotated log on disk. Memory stays bounded however long
+the stack runs: the ring holds a fixed number of lines and each read is
+capped at READ_LIMIT bytes.
+"""
+import os
+import threading
+import time
+
+from log_store import LogRing
+
+READ_LIMIT = 8192   # Bytes per read; longer lines arrive in pieces
+
+class RotatingLog:
+    """
+    Line-buffered log file rolled over to path.1 .. path.<backups> once it
+    passes max_bytes. Not thread-safe; LogCapture serializes writes.
+    """
+
+    def __init__(self, path, max_bytes, backups):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self._file = open(path, 'a', buffering=1, errors='replace')
+        self._size = self._file.tell()
+        self._second = None
+        self._stamp = ""
+
+    def write(self, t, stream, text):
+        second = int(t)
+        if second != self._second:
+            # Formatting the time is the costly part; do it once per second
+            self._second = second
+            self._stamp = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(second))
+        line = f"{self._stamp}.{int(t % 1 * 1000):03d} {stream} {text}\n"
+        self._file.write(line)
+        self._size += len(line)
+        if self._size >= self.max_bytes:
+            self._rotate()
+
+    def _rotate(self):
+        self._file.close()
+        for index in range(self.backups - 1, 0, -1):
+            if os.path.exists(f"{self.path}.{index}"):
+                os.replace(f"{self.path}.{index}", f"{self.path}.{index + 1}")
+        if self.backups:
+            os.replace(self.path, f"{self.path}.1")
+        self._file = open(self.path, 'w', buffering=1, errors='replace')
+        self._size = 0
+
+    def close(self):
+        self._file.close()
+
+class LogCapture:
+    """
+    Collects the output of successive stack processes into one ring.
+    """
+
+    def __init__(self, max_lines=2000, path=None, max_bytes=10 * 1024 * 1024, backups=3):
+        self.ring = LogRing(max_lines)
+        self._file = RotatingLog(path, max_bytes, backups) if path else None
+        self._file_lock = threading.Lock()
+
+    def note(self, text):
+        """
+        Records a line of our own (e.g. "stack started") between stack output.
+        """
+        self._add("client", text)
+
+    def attach(self, process):
+        """
+        Starts draining process.stdout and process.stderr (pipes opened in
+        binary mode). The readers exit at end of file, i.e. once every
+        process holding the pipe has exited.
+        """
+        for stream, pipe in (("stdout", process.stdout), ("stderr", process.stderr)):
+            if pipe is not None:
+                threading.Thread(target=self._drain, args=(stream, pipe), daemon=True,
+                                 name=f"log-{stream}-{process.pid}").start()
+
+    def _drain(self, stream, pipe):
+        try:
+            for raw in iter(lambda: pipe.readline(READ_LIMIT), b''):
+                self._add(stream, raw.decode(errors='replace'))
+        except (OSError, ValueError):
+            pass   # Pipe closed under us
+        finally:
+            pipe.close()
+
+    def _add(self, stream, text):
+        t = time.time()
+        self.ring.append(t, stream, text)
+        if self._file is not None:
+            with self._file_lock:
+                self._file.write(t, stream, text.rstrip('\r\n'))
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
@@ -0,0 +1,138 @@
+"""
+Bounded buffers of log lines from the vehicle stacks.
+
+LogRing keeps the most recent lines of one stream, each numbered with a
+sequence number that keeps counting across evictions, so a reader can
+tail it with lines_since(cursor) and tell how many lines it missed. The
+vehicle client fills one from the stack's stdout/stderr (log_capture.py)
+and uploads new lines; the server keeps one LogRing per vehicle in a
+VehicleLogStore for the log API.
+
+Memory is bounded by the line count and by MAX_LINE_CHARS per line.
+"""
+import collections
+import threading
+import time
+
+MAX_LINE_CHARS = 2000        # Longer lines are cut (with a marker)
+DEFAULT_RING_LINES = 2000    # Lines kept per ring
+
+def clip_line(text, limit=MAX_LINE_CHARS):
+    text = text.rstrip('\r\n')
+    if len(text) > limit:
+        return text[:limit] + f" ...[{len(text) - limit} chars cut]"
+    return text
+
+class LogRing:
+    """
+    Thread-safe ring of (seq, t, stream, text) lines, oldest first.
+    """
+
+    def __init__(self, max_lines=DEFAULT_RING_LINES):
+        self._lines = collections.deque(maxlen=max_lines)
+        self._lock = threading.Lock()
+        self._next_seq = 1
+        self._source = None      # Upload source of extend(), and the last
+        self._source_seq = 0     # sequence number taken from it
+
+    @property
+    def next_seq(self):
+        return self._next_seq
+
+    def append(self, t, stream, text):
+        """
+        Adds one line. Returns its sequence number.
+        """
+        with self._lock:
+            seq = self._next_seq
+            self._next_seq += 1
+            self._lines.append((seq, t, stream, clip_line(text)))
+            return seq
+
+    def extend(self, lines, source=None):
+        """
+        Adds lines read from another ring ([seq, t, stream, text], oldest
+        first) and numbers them in this ring. Lines at or below the last
+        sequence number taken from the same `source` are skipped, so a
+        re-sent batch is harmless; a new source (e.g. a restarted client
+        numbering from 1 again) starts over. Returns the number of lines added.
+        """
+        added = 0
+        with self._lock:
+            if source != self._source:
+                self._source, self._source_seq = source, 0
+            for seq, t, stream, text in lines:
+                seq = int(seq)
+                if seq <= self._source_seq:
+                    continue
+                self._lines.append((self._next_seq, float(t), str(stream), clip_line(str(text))))
+                self._next_seq += 1
+                self._source_seq = seq
+                added += 1
+        return added
+
+    def lines_since(self, since=0, limit=None):
+        """
+        Returns (lines, next_cursor, dropped): up to `limit` lines with a
+        sequence number above `since`, the cursor to pass next time, and how
+        many lines after `since` were already evicted.
+        """
+        with self._lock:
+            first = self._lines[0][0] if self._lines else self._next_seq
+            dropped = max(0, first - since - 1)
+            lines = [line for line in self._lines if line[0] > since]
+        if limit is not None:
+            lines = lines[:limit]
+        next_cursor = lines[-1][0] if lines else max(since, first - 1)
+        return lines, next_cursor, dropped
+
+    def tail(self, count):
+        """
+        Returns the last `count` lines.
+        """
+        with self._lock:
+            return list(self._lines)[-count:] if count > 0 else []
+
+class VehicleLogStore:
+    """
+    Recent stack log lines of every vehicle, one LogRing each.
+    """
+
+    def __init__(self, max_lines=DEFAULT_RING_LINES):
+        self._max_lines = max_lines
+        self._rings = {}
+        self._lock = threading.Lock()
+
+    def _ring(self, acs_id):
+        with self._lock:
+            ring = self._rings.get(acs_id)
+            if ring is None:
+                ring = self._rings[acs_id] = LogRing(self._max_lines)
+            return ring
+
+    def append_lines(self, acs_id, lines, source=None, dropped=0, now=None):
+        """
+        Stores lines uploaded by a vehicle (see LogRing.extend). `dropped`
+        lines the vehicle could not keep are marked with a line of their own.
+        Returns the number of lines added.
+        """
+        ring = self._ring(acs_id)
+        if dropped:
+            ring.append(now or time.time(), "server", f"--- {dropped} lines lost on the vehicle ---")
+        return ring.extend(lines, source)
+
+    def lines_since(self, acs_id, since=0, limit=None):
+        """
+        As LogRing.lines_since, for one vehicle; a vehicle that never sent
+        lines has none.
+        """
+        with self._lock:
+            ring = self._rings.get(acs_id)
+        if ring is None:
+            return [], since, 0
+        return ring.lines_since(since, limit)
+
+    def tail(self, acs_id, count):
+        with self._lock:
+            ring = self._rings.get(acs_id)
+        return ring.tail(count) if ring is not None else []
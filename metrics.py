@@ -0,0 +1,264 @@
+"""
+Lightweight in-process metrics.
+
+Histograms use bucket bounds fixed up front, so a value costs one bisect
+and one increment, and percentiles are read from the bucket counts
+(linear interpolation inside the bucket) instead of keeping every sample.
+
+Recording never takes a lock: inc() and observe() append to a deque
+(atomic under the GIL) and the pending values are folded into the totals
+by whichever caller first finds FOLD_AT of them queued, or by the reader.
+That keeps instrumentation on the request hot path cheap enough to leave on.
+
+Series names may carry Prometheus labels, built with series():
+'http_requests_total{method="GET",route="/api/data"}'. raw() snapshots can
+be merged across processes and rendered with render_prometheus().
+"""
+import bisect
+import collections
+import threading
+
+# Upper bounds in milliseconds, roughly 1-2-5 steps from 1 ms to 2 minutes
+DEFAULT_BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000,
+                      10000, 20000, 30000, 60000, 120000)
+
+# Finer bounds for request latency and serialization time, 50 us to 30 s
+FAST_BUCKETS_MS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500,
+                   1000, 2500, 5000, 10000, 30000)
+
+FOLD_AT = 1024  # Pending values that trigger folding on the recording thread
+
+def series(name, **labels):
+    """
+    Returns the series name for `name` with `labels`, e.g.
+    series("x_total", route="/a") -> 'x_total{route="/a"}'.
+    """
+    if not labels:
+        return name
+    escaped = ('%s="%s"' % (key, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+               for key, value in sorted(labels.items()))
+    return f"{name}{{{','.join(escaped)}}}"
+
+def _split_series(name):
+    # 'x{a="1"}' -> ('x', 'a="1"')
+    base, brace, labels = name.partition('{')
+    return base, labels[:-1] if brace else ""
+
+class _Pending:
+    """
+    Lock-free recording: values queue in a deque until folded.
+    """
+
+    def __init__(self):
+        self._pending = collections.deque()
+        self._lock = threading.Lock()
+
+    def _push(self, value):
+        pending = self._pending
+        pending.append(value)
+        if len(pending) >= FOLD_AT and self._lock.acquire(False):
+            try:
+                self._fold_pending()
+            finally:
+                self._lock.release()
+
+    def _fold_pending(self):
+        # Caller holds self._lock; values appended meanwhile wait for next time
+        pending = self._pending
+        values = [pending.popleft() for _ in range(len(pending))]
+        if values:
+            self._fold(values)
+
+class Counter(_Pending):
+    def __init__(self):
+        super().__init__()
+        self._value = 0
+
+    def inc(self, amount=1):
+        self._push(amount)
+
+    def _fold(self, values):
+        self._value += sum(values)
+
+    @property
+    def value(self):
+        with self._lock:
+            self._fold_pending()
+            return self._value
+
+class Histogram(_Pending):
+    """
+    Pre-bucketed histogram. Values above the last bound go into an
+    overflow bucket.
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS_MS):
+        super().__init__()
+        self.buckets = tuple(sorted(buckets))
+        self._counts = [0] * (len(self.buckets) + 1)
+        self._count = 0
+        self._sum = 0.0
+        self._max = 0.0
+
+    def observe(self, value):
+        self._push(value)
+
+    def _fold(self, values):
+        buckets, counts = self.buckets, self._counts
+        for value in values:
+            counts[bisect.bisect_left(buckets, value)] += 1
+        self._count += len(values)
+        self._sum += sum(values)
+        self._max = max(self._max, max(values))
+
+    def raw(self):
+        """
+        Returns the mergeable state: {"buckets", "counts", "count", "sum", "max"}.
+        """
+        with self._lock:
+            self._fold_pending()
+            return {"buckets": list(self.buckets), "counts": list(self._counts),
+                    "count": self._count, "sum": self._sum, "max": self._max}
+
+    def _percentile(self, counts, count, maximum, q):
+        # Caller passes a consistent copy of the counts
+        rank = q * count
+        seen = 0
+        for i, n in enumerate(counts):
+            if n and seen + n >= rank:
+                lower = self.buckets[i - 1] if i else 0.0
+                upper = self.buckets[i] if i < len(self.buckets) else maximum
+                return min(lower + (upper - lower) * (rank - seen) / n, maximum)
+            seen += n
+        return maximum
+
+    def snapshot(self):
+        """
+        Returns count, sum, mean, max, p50/p95/p99 and per-bucket counts
+        (not cumulative).
+        """
+        raw = self.raw()
+        counts, count, total, maximum = raw["counts"], raw["count"], raw["sum"], raw["max"]
+        result = {
+            "count": count,
+            "sum": round(total, 3),
+            "mean": round(total / count, 3) if count else None,
+            "max": round(maximum, 3) if count else None,
+        }
+        for name, q in (("p50", 0.50), ("p95", 0.95), ("p99", 0.99)):
+            result[name] = round(self._percentile(counts, count, maximum, q), 3) if count else None
+        # [upper bound, count] pairs in bound order (JSON objects get re-sorted)
+        result["buckets"] = [[bound, n] for bound, n in zip(self.buckets + ("+Inf",), counts)]
+        return result
+
+class MetricsRegistry:
+    """
+    Named counters and histograms, created on first use.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+
+    def counter(self, name):
+        counter = self._counters.get(name)
+        if counter is None:
+            with self._lock:
+                counter = self._counters.setdefault(name, Counter())
+        return counter
+
+    def histogram(self, name, buckets=DEFAULT_BUCKETS_MS):
+        # `buckets` only applies when the histogram is created
+        histogram = self._histograms.get(name)
+        if histogram is None:
+            with self._lock:
+                histogram = self._histograms.setdefault(name, Histogram(buckets))
+        return histogram
+
+    def inc(self, name, amount=1):
+        self.counter(name).inc(amount)
+
+    def observe(self, name, value, buckets=DEFAULT_BUCKETS_MS):
+        self.histogram(name, buckets).observe(value)
+
+    def snapshot(self, prefix=""):
+        """
+        Returns {"counters": {...}, "histograms": {...}} for names starting
+        with `prefix`.
+        """
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = dict(self._histograms)
+        return {
+            "counters": {name: c.value for name, c in sorted(counters.items()) if name.startswith(prefix)},
+            "histograms": {name: h.snapshot() for name, h in sorted(histograms.items()) if name.startswith(prefix)},
+        }
+
+    def raw(self):
+        """
+        Returns {"counters": {name: value}, "histograms": {name: Histogram.raw()}},
+        the form merge_raw() and render_prometheus() take.
+        """
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = dict(self._histograms)
+        return {
+            "counters": {name: c.value for name, c in counters.items()},
+            "histograms": {name: h.raw() for name, h in histograms.items()},
+        }
+
+def merge_raw(raws):
+    """
+    Sums several raw() snapshots (e.g. one per worker process). Histograms
+    of the same name must share bucket bounds.
+    """
+    counters = collections.Counter()
+    histograms = {}
+    for raw in raws:
+        counters.update(raw.get("counters", {}))
+        for name, h in raw.get("histograms", {}).items():
+            merged = histograms.get(name)
+            if merged is None:
+                histograms[name] = dict(h, counts=list(h["counts"]))
+            elif merged["buckets"] == h["buckets"]:
+                merged["counts"] = [a + b for a, b in zip(merged["counts"], h["counts"])]
+                merged["count"] += h["count"]
+                merged["sum"] += h["sum"]
+                merged["max"] = max(merged["max"], h["max"])
+    return {"counters": dict(counters), "histograms": histograms}
+
+def _with_label(labels, extra):
+    return "{" + ",".join(part for part in (labels, extra) if part) + "}"
+
+def render_prometheus(raw, gauges=(), help_text=None):
+    """
+    Renders a raw() snapshot plus `gauges` ((series name, value) pairs) in
+    the Prometheus text exposition format. Counter names should end in
+    _total; histogram values are exported as-is (milliseconds).
+    """
+    help_text = help_text or {}
+    families = collections.defaultdict(list)   # (base name, type) -> lines
+    for name, value in sorted(raw.get("counters", {}).items()):
+        families[(_split_series(name)[0], "counter")].append(f"{name} {value}")
+    for name, h in sorted(raw.get("histograms", {}).items()):
+        base, labels = _split_series(name)
+        lines = families[(base, "histogram")]
+        cumulative = 0
+        for bound, n in zip(h["buckets"] + ["+Inf"], h["counts"]):
+            cumulative += n
+            le = 'le="%s"' % bound
+            lines.append(f"{base}_bucket{_with_label(labels, le)} {cumulative}")
+        suffix = _with_label(labels, "") if labels else ""
+        lines.append(f"{base}_sum{suffix} {h['sum']:.6g}")
+        lines.append(f"{base}_count{suffix} {h['count']}")
+    for name, value in sorted(gauges):
+        families[(_split_series(name)[0], "gauge")].append(f"{name} {value:.6g}")
+
+    out = []
+    for (base, kind), lines in sorted(families.items()):
+        if base in help_text:
+            out.append(f"# HELP {base} {help_text[base]}")
+        out.append(f"# TYPE {base} {kind}")
+        out.extend(lines)
+    return "\n".join(out) + "\n"
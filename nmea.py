@@ -0,0 +1,280 @@
+"""
+NMEA 0183 parsing for the vehicle GPS receiver.
+
+Validates the *hh checksum and parses GGA, RMC, VTG and GSA sentences from
+any talker (GP, GN, GL, GA, BD, ...). Works directly on bytes so recorded
+logs can be replayed without decoding every line:
+
+    fix = parse_sentence("$GNGGA,...*47")        # one sentence
+    fixes = parse_buffer(open(log, 'rb').read())  # whole buffer, merged by epoch
+    for fix in parse_file(log): ...               # streamed from disk
+"""
+import functools
+import operator
+import re
+
+KNOTS_TO_MPS = 0.514444
+KMH_TO_MPS = 1 / 3.6
+
+FILE_CHUNK_SIZE = 1 << 20  # Bytes read at a time by parse_file
+
+class NmeaFix:
+    """
+    Compact fix record. Fields a sentence does not carry are None.
+    `utc` is the hhmmss.ss time field (str), `speed` is in m/s and
+    `course` is degrees true.
+    """
+    __slots__ = ('kind', 'utc', 'lat', 'lon', 'alt', 'quality', 'satellites',
+                 'hdop', 'speed', 'course', 'valid')
+
+    def __init__(self, kind, utc=None, lat=None, lon=None, alt=None, quality=None,
+                 satellites=None, hdop=None, speed=None, course=None, valid=True):
+        self.kind = kind
+        self.utc = utc
+        self.lat = lat
+        self.lon = lon
+        self.alt = alt
+        self.quality = quality
+        self.satellites = satellites
+        self.hdop = hdop
+        self.speed = speed
+        self.course = course
+        self.valid = valid
+
+    @property
+    def has_position(self):
+        return self.lat is not None and self.lon is not None
+
+    def merge(self, other):
+        """
+        Fills fields that are None here from another fix of the same epoch.
+        """
+        if self.utc is None:
+            self.utc = other.utc
+        if self.lat is None:
+            self.lat = other.lat
+            self.lon = other.lon
+        if self.alt is None:
+            self.alt = other.alt
+        if self.quality is None:
+            self.quality = other.quality
+        if self.satellites is None:
+            self.satellites = other.satellites
+        if self.hdop is None:
+            self.hdop = other.hdop
+        if self.speed is None:
+            self.speed = other.speed
+        if self.course is None:
+            self.course = other.course
+        return self
+
+    def as_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __repr__(self):
+        fields = ', '.join(f"{name}={getattr(self, name)!r}" for name in self.__slots__
+                           if getattr(self, name) is not None)
+        return f"NmeaFix({fields})"
+
+_MASK_512 = (1 << 512) - 1
+_MASK_256 = (1 << 256) - 1
+_MASK_128 = (1 << 128) - 1
+_MASK_64 = (1 << 64) - 1
+
+def xor_checksum(body):
+    """
+    XOR of all bytes in body (the part between '$' and '*').
+    Folds the body as one integer instead of looping over bytes, which is
+    about twice as fast for sentence-sized input (NMEA caps them at 82 chars).
+    """
+    if len(body) > 128:
+        return functools.reduce(operator.xor, body, 0)
+    v = int.from_bytes(body, 'little')
+    v = (v >> 512) ^ (v & _MASK_512)
+    v = (v >> 256) ^ (v & _MASK_256)
+    v = (v >> 128) ^ (v & _MASK_128)
+    v = (v >> 64) ^ (v & _MASK_64)
+    v ^= v >> 32
+    v ^= v >> 16
+    v ^= v >> 8
+    return v & 0xFF
+
+def checksum_ok(sentence):
+    """
+    Verifies the *hh checksum of a sentence (bytes, without line ending).
+    Sentences without a checksum are rejected.
+    """
+    star = sentence.rfind(b'*')
+    if star < 1 or len(sentence) < star + 3:
+        return False
+    try:
+        expected = int(sentence[star + 1:star + 3], 16)
+    except ValueError:
+        return False
+    return xor_checksum(sentence[1:star]) == expected
+
+def _latitude(value, hemisphere):
+    # ddmm.mmmm -> signed decimal degrees
+    if not value:
+        return None
+    degrees = int(value[:2]) + float(value[2:]) / 60.0
+    return -degrees if hemisphere == b'S' else degrees
+
+def _longitude(value, hemisphere):
+    # dddmm.mmmm -> signed decimal degrees
+    if not value:
+        return None
+    degrees = int(value[:3]) + float(value[3:]) / 60.0
+    return -degrees if hemisphere == b'W' else degrees
+
+def _float(value):
+    return float(value) if value else None
+
+def _int(value):
+    return int(value) if value else None
+
+def _parse_gga(f):
+    # $xxGGA,time,lat,N,lon,E,quality,sats,hdop,alt,M,geoid,M,age,station
+    quality = _int(f[6])
+    return NmeaFix('GGA', f[1].decode('ascii') or None,
+                   _latitude(f[2], f[3]), _longitude(f[4], f[5]), _float(f[9]),
+                   quality, _int(f[7]), _float(f[8]), None, None, bool(quality))
+
+def _parse_rmc(f):
+    # $xxRMC,time,status,lat,N,lon,E,speed_knots,course,date,magvar,E[,mode]
+    speed = _float(f[7])
+    return NmeaFix('RMC', f[1].decode('ascii') or None,
+                   _latitude(f[3], f[4]), _longitude(f[5], f[6]), None, None, None, None,
+                   speed * KNOTS_TO_MPS if speed is not None else None, _float(f[8]), f[2] == b'A')
+
+def _parse_vtg(f):
+    # $xxVTG,course_true,T,course_mag,M,speed_knots,N,speed_kmh,K[,mode]
+    speed_kmh = _float(f[7])
+    if speed_kmh is not None:
+        speed = speed_kmh * KMH_TO_MPS
+    else:
+        speed_knots = _float(f[5])
+        speed = speed_knots * KNOTS_TO_MPS if speed_knots is not None else None
+    return NmeaFix('VTG', speed=speed, course=_float(f[1]),
+                   valid=len(f) < 10 or f[9][:1] != b'N')
+
+def _parse_gsa(f):
+    # $xxGSA,mode,fix_type,sv1..sv12,pdop,hdop,vdop[,system]
+    fix_type = _int(f[2])
+    return NmeaFix('GSA', hdop=_float(f[16]), satellites=12 - f[3:15].count(b''),
+                   valid=bool(fix_type and fix_type > 1))
+
+_PARSERS = {
+    b'GGA': _parse_gga,
+    b'RMC': _parse_rmc,
+    b'VTG': _parse_vtg,
+    b'GSA': _parse_gsa,
+}
+
+def parse_sentence(sentence, verify_checksum=True):
+    """
+    Parses one NMEA sentence (str or bytes).
+    Returns an NmeaFix, or None if the sentence is corrupt, has a bad
+    checksum or is of an unsupported type.
+    """
+    if isinstance(sentence, str):
+        sentence = sentence.encode('ascii', errors='replace')
+    sentence = sentence.strip()
+    if sentence[:1] != b'$' or len(sentence) < 7:
+        return None
+    if verify_checksum and not checksum_ok(sentence):
+        return None
+
+    parser = _PARSERS.get(sentence[3:6])
+    if parser is None:
+        return None
+    star = sentence.rfind(b'*')
+    fields = (sentence[:star] if star > 0 else sentence).split(b',')
+    try:
+        return parser(fields)
+    except (ValueError, IndexError, UnicodeDecodeError):
+        return None
+
+def _merge_epochs(fixes):
+    # Receivers emit GGA/RMC/VTG/GSA for each epoch. Sentences with the same
+    # time field share an epoch; VTG/GSA (no time) join the current one.
+    current = None
+    for fix in fixes:
+        if current is not None:
+            if fix.utc and current.utc:
+                same_epoch = fix.utc == current.utc
+            else:
+                same_epoch = not (fix.has_position and current.has_position)
+            if same_epoch:
+                if fix.has_position and not current.has_position:
+                    current.kind = fix.kind
+                current.merge(fix)
+                continue
+            if current.has_position:
+                yield current
+        current = fix
+    if current is not None and current.has_position:
+        yield current
+
+def _sentence_pattern(types):
+    # $ + talker + type, body up to '*', two hex digits of checksum.
+    # Anything between matches (line endings, partial lines, noise) is skipped.
+    alternatives = b'|'.join(re.escape(t) for t in types)
+    return re.compile(rb'\$([A-Z]{2}(' + alternatives + rb'),[^*$\r\n]*)\*([0-9A-Fa-f]{2})')
+
+_SENTENCE_RE = _sentence_pattern(_PARSERS)
+
+def iter_buffer(data, verify_checksum=True, merge=True, types=None):
+    """
+    Parses every sentence in a bytes buffer in one pass.
+    With merge=True, sentences of the same epoch are combined and one fix
+    per epoch (with position, speed, course, HDOP, satellites) is yielded;
+    otherwise every parsed sentence is yielded. `types` limits parsing to
+    some sentence types, e.g. ('GGA',) when only positions are needed.
+    Sentences without a checksum are skipped in bulk mode.
+    """
+    if types is None:
+        pattern = _SENTENCE_RE
+    else:
+        pattern = _sentence_pattern([t.encode('ascii') for t in types])
+    parsers = _PARSERS
+    checksum_of = xor_checksum
+
+    def sentences():
+        for match in pattern.finditer(data):
+            body, kind, checksum = match.groups()
+            if verify_checksum and checksum_of(body) != int(checksum, 16):
+                continue
+            try:
+                yield parsers[kind](body.split(b','))
+            except (ValueError, IndexError, UnicodeDecodeError):
+                continue
+
+    return _merge_epochs(sentences()) if merge else sentences()
+
+def parse_buffer(data, verify_checksum=True, merge=True, types=None):
+    """
+    List form of iter_buffer.
+    """
+    return list(iter_buffer(data, verify_checksum, merge, types))
+
+def parse_file(path, verify_checksum=True, merge=True, types=None, chunk_size=FILE_CHUNK_SIZE):
+    """
+    Streams fixes from an NMEA log file, reading it in large chunks.
+    """
+    def chunks():
+        with open(path, 'rb') as f:
+            tail = b''
+            while True:
+                block = f.read(chunk_size)
+                if not block:
+                    break
+                block = tail + block
+                cut = block.rfind(b'\n') + 1
+                tail = block[cut:]
+                if cut:
+                    yield from iter_buffer(block[:cut], verify_checksum, False, types)
+            if tail:
+                yield from iter_buffer(tail, verify_checksum, False, types)
+
+    return _merge_epochs(chunks()) if merge else chunks()
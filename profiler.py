@@ -0,0 +1,107 @@
+"""
+Sampling profiler that can be switched on at runtime.
+
+While running, a background thread takes the stack of every other thread
+every `interval` seconds (sys._current_frames) and counts identical
+stacks. report() returns them in the "collapsed" format flame graph tools
+read (frame;frame;frame count). Nothing is traced between samples, so the
+cost is one stack walk per thread per interval, and zero while stopped.
+
+The profiler sees the threads of its own process only: under several
+worker processes, each one profiles itself.
+"""
+import collections
+import sys
+import threading
+import time
+
+DEFAULT_INTERVAL = 0.01    # Seconds between samples
+MAX_STACKS = 5000          # Distinct stacks kept; further ones count as "[other]"
+MAX_DEPTH = 64             # Innermost frames kept per stack
+
+class SamplingProfiler:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop_event = threading.Event()
+        self._stacks = collections.Counter()
+        self._samples = 0
+        self._started_at = None
+        self._stopped_at = None
+        self.interval = DEFAULT_INTERVAL
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, interval=DEFAULT_INTERVAL, duration=None):
+        """
+        Clears earlier samples and starts sampling every `interval` seconds,
+        for `duration` seconds if given. Returns False if already running.
+        """
+        with self._lock:
+            if self.running:
+                return False
+            self.interval = interval
+            self._stacks = collections.Counter()
+            self._samples = 0
+            self._started_at = time.time()
+            self._stopped_at = None
+            self._stop_event = threading.Event()
+            self._thread = threading.Thread(target=self._run, args=(self._stop_event, duration),
+                                            name="sampling-profiler", daemon=True)
+            self._thread.start()
+            return True
+
+    def stop(self):
+        """
+        Stops sampling; the samples are kept for report().
+        """
+        self._stop_event.set()
+        thread = self._thread
+        if thread is not None and thread is not threading.current_thread():
+            thread.join()
+
+    def _run(self, stop_event, duration):
+        me = threading.get_ident()
+        deadline = time.monotonic() + duration if duration else None
+        while not stop_event.wait(self.interval):
+            for ident, frame in sys._current_frames().items():
+                if ident != me:
+                    self._record(frame)
+            self._samples += 1
+            if deadline is not None and time.monotonic() >= deadline:
+                break
+        self._stopped_at = time.time()
+
+    def _record(self, frame):
+        names = []
+        while frame is not None and len(names) < MAX_DEPTH:
+            code = frame.f_code
+            names.append(f"{code.co_name} ({code.co_filename.rsplit('/', 1)[-1]}:{code.co_firstlineno})")
+            frame = frame.f_back
+        stack = ";".join(reversed(names))
+        with self._lock:
+            if stack in self._stacks or len(self._stacks) < MAX_STACKS:
+                self._stacks[stack] += 1
+            else:
+                self._stacks["[other]"] += 1
+
+    def status(self):
+        return {
+            "running": self.running,
+            "interval": self.interval,
+            "samples": self._samples,
+            "stacks": len(self._stacks),
+            "started_at": self._started_at,
+            "stopped_at": self._stopped_at,
+        }
+
+    def report(self, limit=None):
+        """
+        Returns the collapsed stacks, most frequent first, one
+        "frame;frame;frame count" line each.
+        """
+        with self._lock:
+            stacks = self._stacks.most_common(limit)
+        return "".join(f"{stack} {count}\n" for stack, count in stacks)
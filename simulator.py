@@ -0,0 +1,328 @@
+"""
+Vectorized fleet simulation.
+
+Every simulated vehicle is one slot in a set of NumPy arrays (path, distance
+travelled along it, cruise speed, running flag), so a tick advances the whole
+fleet with a handful of array operations instead of a Python loop per car.
+
+Paths are closed loops of waypoints. All path segments are laid end to end
+on one "global distance" axis; a vehicle's position is found with a single
+searchsorted over the segment starts, then interpolated inside its segment.
+
+Positions are published to the same FleetStore (and TrackStore and
+GeoIndex) that real vehicle updates go through, in one batched call per tick. A real vehicle that
+reports in is released from the simulation. Simulated vehicles standing
+still report a heartbeat every HEARTBEAT_INTERVAL seconds (more often if
+the store's stale_after is shorter), so they stay online like a parked
+real vehicle that keeps polling.
+"""
+import itertools
+import math
+import threading
+import time
+
+import numpy as np
+
+from metrics import FAST_BUCKETS_MS
+
+DEFAULT_TICK_RATE = 1.0   # Ticks per second
+SPEED_SPREAD = 0.2        # Cruise speed is the path speed +/- 20%
+SPEED_JITTER = 0.05       # Per-tick speed noise (+/- 5%)
+METERS_PER_DEGREE = 111320.0
+HEARTBEAT_INTERVAL = 2.0  # Seconds between liveness heartbeats of stopped vehicles
+
+# Waypoint loops around TiHAN IITH; speed in m/s
+PATHS = {
+    "Path-A": {
+        "waypoints": [(17.601838, 78.126866), (17.603638, 78.126866),
+                      (17.603638, 78.128766), (17.601838, 78.128766)],
+        "speed": 5.0,
+        "description": "North-east loop",
+    },
+    "Path-B": {
+        "waypoints": [(17.601938, 78.126966), (17.601938, 78.123966), (17.604438, 78.123466),
+                      (17.606238, 78.125966), (17.604138, 78.127466)],
+        "speed": 8.0,
+        "description": "Outer campus loop",
+    },
+    "Path-C": {
+        "waypoints": [(17.601738, 78.126766), (17.599738, 78.125766),
+                      (17.598738, 78.127766), (17.600738, 78.128766)],
+        "speed": 3.0,
+        "description": "South test loop",
+    },
+}
+
+class FleetSimulator(threading.Thread):
+    """
+    Drives simulated vehicles along `paths` and publishes their positions to
+    `store` (a FleetStore) `tick_rate` times per second. If `tracks` (a
+    TrackStore) is given, positions are recorded there too, like real updates,
+    and likewise if `geo` (a GeoIndex) is given they are checked against its
+    geofences.
+    If `metrics` (a MetricsRegistry) is given, tick durations are recorded
+    in sim_tick_ms and overruns counted in sim_tick_overruns_total.
+    """
+
+    def __init__(self, store, paths=PATHS, tick_rate=DEFAULT_TICK_RATE, tracks=None, seed=None, metrics=None,
+                 geo=None):
+        super().__init__(name="fleet-simulator", daemon=True)
+        self.store = store
+        self.tracks = tracks
+        self.geo = geo
+        self.metrics = metrics
+        self.tick_rate = tick_rate
+        self.path_names = list(paths)
+        self._path_ids = {name: i for i, name in enumerate(self.path_names)}
+        self._speeds = np.array([paths[name].get("speed", 5.0) for name in self.path_names])
+        self._build_segments(paths)
+
+        self._lock = threading.Lock()
+        self._rng = np.random.default_rng(seed)
+        self._stop_event = threading.Event()
+        self._slots = {}                              # acs_id -> slot
+        self._ids = np.empty(0, dtype=object)
+        self._path = np.empty(0, dtype=np.intp)
+        self._dist = np.empty(0)                      # Metres along the path
+        self._cruise = np.empty(0)                    # m/s
+        self._running = np.empty(0, dtype=bool)
+        self._active = np.empty(0, dtype=bool)        # False once released
+
+        self._next_heartbeat = 0.0
+        self.ticks = 0
+        self.overruns = 0
+        self.last_tick_seconds = 0.0
+
+    def _build_segments(self, paths):
+        starts, lengths, lat0, lon0, dlat, dlon = [], [], [], [], [], []
+        path_start, path_len = [], []
+        offset = 0.0
+        for name in self.path_names:
+            points = paths[name]["waypoints"]
+            path_start.append(offset)
+            total = 0.0
+            for (a_lat, a_lon), (b_lat, b_lon) in zip(points, points[1:] + points[:1]):
+                north = (b_lat - a_lat) * METERS_PER_DEGREE
+                east = (b_lon - a_lon) * METERS_PER_DEGREE * math.cos(math.radians(a_lat))
+                length = math.hypot(north, east)
+                if length == 0.0:
+                    continue
+                starts.append(offset + total)
+                lengths.append(length)
+                lat0.append(a_lat)
+                lon0.append(a_lon)
+                dlat.append(b_lat - a_lat)
+                dlon.append(b_lon - a_lon)
+                total += length
+            if total == 0.0:
+                raise ValueError(f"Path {name} needs at least two distinct waypoints")
+            path_len.append(total)
+            offset += total
+        self._seg_start = np.array(starts)
+        self._seg_len = np.array(lengths)
+        self._seg_lat = np.array(lat0)
+        self._seg_lon = np.array(lon0)
+        self._seg_dlat = np.array(dlat)
+        self._seg_dlon = np.array(dlon)
+        self._path_start = np.array(path_start)
+        self._path_len = np.array(path_len)
+
+    def _path_id(self, name):
+        # Unknown paths (e.g. "Unknown") fall back to the first one
+        return self._path_ids.get(name, 0)
+
+    def _positions(self, slots):
+        # Caller holds self._lock
+        g = self._path_start[self._path[slots]] + self._dist[slots]
+        seg = np.searchsorted(self._seg_start, g, side='right') - 1
+        frac = (g - self._seg_start[seg]) / self._seg_len[seg]
+        return (self._seg_lat[seg] + frac * self._seg_dlat[seg],
+                self._seg_lon[seg] + frac * self._seg_dlon[seg])
+
+    def _nearest_distance(self, path, lat, lon):
+        # Distance along `path` of the waypoint closest to (lat, lon)
+        segments = np.flatnonzero((self._seg_start >= self._path_start[path]) &
+                                  (self._seg_start < self._path_start[path] + self._path_len[path]))
+        error = (self._seg_lat[segments] - lat) ** 2 + (self._seg_lon[segments] - lon) ** 2
+        return self._seg_start[segments[np.argmin(error)]] - self._path_start[path]
+
+    # ------------------------------------------------------------------
+    # Vehicles
+    # ------------------------------------------------------------------
+    def add_many(self, ids, paths, running=True, positions=None):
+        """
+        Adds vehicles to the simulation. `paths` is one path name per vehicle;
+        `positions` is an optional (lat, lon) per vehicle, snapped to the
+        nearest waypoint of its path, otherwise the start is random.
+        Vehicles already simulated are re-activated and moved instead.
+        """
+        ids = list(ids)
+        path = np.array([self._path_id(name) for name in paths], dtype=np.intp)
+        if positions is None:
+            dist = self._rng.random(len(ids)) * self._path_len[path]
+        else:
+            dist = np.array([self._nearest_distance(p, lat, lon)
+                             for p, (lat, lon) in zip(path, positions)])
+        cruise = self._speeds[path] * self._rng.uniform(1 - SPEED_SPREAD, 1 + SPEED_SPREAD, len(ids))
+        running = np.broadcast_to(np.asarray(running, dtype=bool), (len(ids),))
+
+        with self._lock:
+            new = []
+            for i, acs_id in enumerate(ids):
+                slot = self._slots.get(acs_id)
+                if slot is None:
+                    new.append(i)
+                    continue
+                self._path[slot] = path[i]
+                self._dist[slot] = dist[i]
+                self._running[slot] = running[i]
+                self._active[slot] = True
+            first = len(self._ids)
+            for n, i in enumerate(new):
+                self._slots[ids[i]] = first + n
+            added = np.empty(len(new), dtype=object)
+            added[:] = [ids[i] for i in new]
+            self._ids = np.concatenate([self._ids, added])
+            self._path = np.concatenate([self._path, path[new]])
+            self._dist = np.concatenate([self._dist, dist[new]])
+            self._cruise = np.concatenate([self._cruise, cruise[new]])
+            self._running = np.concatenate([self._running, running[new]])
+            self._active = np.concatenate([self._active, np.ones(len(new), dtype=bool)])
+
+    def add(self, acs_id, path, running=False, position=None):
+        self.add_many([acs_id], [path], running, None if position is None else [position])
+
+    def add_synthetic(self, count, prefix="SIM", running=True):
+        """
+        Adds `count` synthetic vehicles spread over all paths, registers them
+        in the store and returns their ids.
+        """
+        width = max(4, len(str(count)))
+        with self._lock:
+            first = sum(1 for acs_id in self._slots if acs_id.startswith(prefix))
+        ids = [f"{prefix}{n:0{width}d}" for n in range(first, first + count)]
+        paths = list(itertools.islice(itertools.cycle(self.path_names), count))
+        self.add_many(ids, paths, running)
+
+        with self._lock:
+            slots = np.array([self._slots[acs_id] for acs_id in ids], dtype=np.intp)
+            lat, lon = self._positions(slots)
+        status = "Running" if running else "Stopped"
+        lat, lon = lat.tolist(), lon.tolist()
+        self.store.update_many(zip(ids, lat, lon, itertools.repeat(status), paths))
+        if self.geo is not None:
+            self.geo.update_many(zip(ids, lat, lon, paths))
+        return ids
+
+    def __contains__(self, acs_id):
+        slot = self._slots.get(acs_id)
+        return slot is not None and bool(self._active[slot])
+
+    def __len__(self):
+        return int(self._active.sum())
+
+    def release(self, acs_id):
+        """
+        Stops simulating a vehicle (a real one took over). Returns True if
+        it was being simulated.
+        """
+        with self._lock:
+            slot = self._slots.get(acs_id)
+            if slot is None or not self._active[slot]:
+                return False
+            self._active[slot] = False
+        print(f"[SIM] {acs_id} reported in, released from simulation")
+        return True
+
+    def set_running(self, acs_id, running):
+        with self._lock:
+            slot = self._slots.get(acs_id)
+            if slot is None:
+                return False
+            self._running[slot] = running
+            return True
+
+    def set_path(self, acs_id, name):
+        """
+        Moves a simulated vehicle to another path. Returns False if the
+        vehicle or the path is unknown.
+        """
+        with self._lock:
+            slot = self._slots.get(acs_id)
+            if slot is None or name not in self._path_ids:
+                return False
+            path = self._path_ids[name]
+            changed = self._path[slot] != path
+            if changed:
+                self._path[slot] = path
+                self._dist[slot] %= self._path_len[path]
+        if changed and self.geo is not None:
+            self.geo.set_path(acs_id, name)
+        return True
+
+    # ------------------------------------------------------------------
+    # Ticks
+    # ------------------------------------------------------------------
+    def step(self, dt):
+        """
+        Advances every running vehicle by `dt` seconds. Returns
+        (ids, lat, lon) of the vehicles that moved.
+        """
+        with self._lock:
+            moving = np.flatnonzero(self._running & self._active)
+            if not len(moving):
+                return [], np.empty(0), np.empty(0)
+            jitter = self._rng.uniform(1 - SPEED_JITTER, 1 + SPEED_JITTER, len(moving))
+            dist = self._dist[moving] + self._cruise[moving] * jitter * dt
+            self._dist[moving] = np.fmod(dist, self._path_len[self._path[moving]])
+            lat, lon = self._positions(moving)
+            return self._ids[moving].tolist(), lat, lon
+
+    def parked(self):
+        """
+        Returns the ids of simulated vehicles that are not running.
+        """
+        with self._lock:
+            return self._ids[self._active & ~self._running].tolist()
+
+    def tick(self, dt):
+        """
+        Advances the simulation and publishes the new positions.
+        Returns the number of vehicles moved.
+        """
+        now = time.monotonic()
+        if now >= self._next_heartbeat:
+            self._next_heartbeat = now + min(HEARTBEAT_INTERVAL, self.store.stale_after / 2)
+            self.store.touch_many(self.parked())
+        ids, lat, lon = self.step(dt)
+        if not ids:
+            return 0
+        lat, lon = lat.tolist(), lon.tolist()
+        self.store.update_many(zip(ids, lat, lon, itertools.repeat(None), itertools.repeat(None)))
+        if self.tracks is not None:
+            self.tracks.append_many(time.time(), zip(ids, lat, lon))
+        if self.geo is not None:
+            self.geo.update_many(zip(ids, lat, lon, itertools.repeat(None)))
+        return len(ids)
+
+    def stop(self):
+        self._stop_event.set()
+
+    def run(self):
+        interval = 1.0 / self.tick_rate
+        last = next_tick = time.monotonic()
+        while not self._stop_event.wait(max(0.0, next_tick - time.monotonic())):
+            now = time.monotonic()
+            self.tick(now - last)
+            last = now
+            self.ticks += 1
+            self.last_tick_seconds = time.monotonic() - now
+            if self.metrics is not None:
+                self.metrics.observe("sim_tick_ms", self.last_tick_seconds * 1000, FAST_BUCKETS_MS)
+            next_tick += interval
+            if next_tick < time.monotonic():
+                # Overran the tick budget: skip ahead instead of bursting
+                self.overruns += 1
+                if self.metrics is not None:
+                    self.metrics.inc("sim_tick_overruns_total")
+                next_tick = time.monotonic() + interval
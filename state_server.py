@@ -0,0 +1,354 @@
+"""
+Fleet state shared by every web worker.
+
+FleetState builds the objects behind the API: the fleet store, position
+history, geofence index, broadcast tracker, command metrics, vehicle stack
+logs and the simulator. A single worker (python app.py, or one gunicorn worker) keeps them in-process.
+
+To run several worker processes, start one state server and point every
+worker at its Unix socket. The workers then reach the same objects through
+multiprocessing.managers proxies, so they share one fleet, one set of
+command queues (a long-poll parked in one worker is woken by a command
+queued through another) and one simulator:
+
+    FLEET_STATE_SOCKET=/run/fleet/state.sock python state_server.py
+    FLEET_STATE_SOCKET=/run/fleet/state.sock gunicorn -w 4 --threads 160 wsgi:app
+
+Size workers x threads for the parked long-polls and streams (see wsgi.py).
+
+The state server runs the background tasks (simulator, liveness sweeper);
+workers never start them.
+"""
+import atexit
+import json
+import os
+import signal
+import threading
+import time
+from multiprocessing.managers import BaseManager, MakeProxyType
+
+from crypto import MAX_COMMAND_AGE
+from fleet_store import FleetStore
+from storage import open_backend
+from track_store import TrackStore
+from simulator import PATHS, FleetSimulator
+from geofence import GeoIndex
+from broadcast import BroadcastTracker
+from metrics import FAST_BUCKETS_MS, MetricsRegistry
+from log_store import VehicleLogStore
+
+# Simulated Car Data - LIMITED TO 3 CARS
+# [INTEGRATION POINT]
+# Replace this 'INITIAL_CARS' dictionary with a database call or Firebase listener.
+# In a real scenario, your Android app pushes GPS data to Firebase/DB,
+# and this Flask app should query that DB to populate the fleet store.
+# Updated to TiHAN IITH Coordinates
+INITIAL_CARS = {
+    "ACS01": {"lat": 17.601838, "lon": 78.126866, "status": "Stopped", "path": "Path-A"},
+    "ACS02": {"lat": 17.601938, "lon": 78.126966, "status": "Stopped", "path": "Path-B"},
+    "ACS03": {"lat": 17.601738, "lon": 78.126766, "status": "Stopped", "path": "Path-C"},
+}
+
+# Named vehicle groups that broadcast commands can target as "group:<name>".
+# FLEET_GROUPS adds more as JSON, e.g. '{"north-yard": ["ACS01", "ACS02"]}'.
+VEHICLE_GROUPS = {"demo": list(INITIAL_CARS)}
+VEHICLE_GROUPS.update(json.loads(os.getenv('FLEET_GROUPS', '{}')))
+
+# Live vehicle state and pending encrypted commands for vehicles to fetch.
+# Set FLEET_DB_PATH to persist it in SQLite (written in batches every
+# FLEET_DB_FLUSH_MS); on startup the store is warmed from that database.
+# Commands fetched with ?ack=1 are redelivered if the vehicle does not ack
+# within COMMAND_ACK_TIMEOUT seconds, up to COMMAND_MAX_ATTEMPTS deliveries.
+# A v2 command is only valid for MAX_COMMAND_AGE seconds after it was
+# sealed, so older ones are expired instead of delivered; all the
+# redeliveries should fit in that window.
+FLEET_DB_PATH = os.getenv('FLEET_DB_PATH')
+FLEET_DB_FLUSH_MS = int(os.getenv('FLEET_DB_FLUSH_MS', '200'))
+COMMAND_ACK_TIMEOUT = float(os.getenv('COMMAND_ACK_TIMEOUT', '20'))
+COMMAND_MAX_ATTEMPTS = int(os.getenv('COMMAND_MAX_ATTEMPTS', '5'))
+COMMAND_MAX_AGE = None if os.getenv('COMMAND_ENVELOPE', 'v2') == 'legacy' else MAX_COMMAND_AGE
+
+# Vehicle liveness: a vehicle is "stale" after VEHICLE_STALE_AFTER seconds
+# without a report and "offline" after VEHICLE_OFFLINE_AFTER. An offline
+# vehicle keeps at most OFFLINE_QUEUE_LIMIT queued commands (the oldest are
+# dropped), each for at most OFFLINE_COMMAND_TTL seconds. The sweeper runs
+# every LIVENESS_SWEEP_INTERVAL seconds.
+VEHICLE_STALE_AFTER = float(os.getenv('VEHICLE_STALE_AFTER', '10'))
+VEHICLE_OFFLINE_AFTER = float(os.getenv('VEHICLE_OFFLINE_AFTER', '60'))
+OFFLINE_QUEUE_LIMIT = int(os.getenv('OFFLINE_QUEUE_LIMIT', '20'))
+OFFLINE_COMMAND_TTL = float(os.getenv('OFFLINE_COMMAND_TTL', '3600'))
+LIVENESS_SWEEP_INTERVAL = 1.0
+
+# Position history for replay and area queries; see track_store.py.
+# Set FLEET_TRACK_DIR to keep finished chunks on disk (memory-mapped).
+FLEET_TRACK_DIR = os.getenv('FLEET_TRACK_DIR')
+TRACK_RETENTION_HOURS = float(os.getenv('TRACK_RETENTION_HOURS', '24'))
+
+# Live spatial index and geofences (see geofence.py). Each simulator path
+# gets a corridor fence GEOFENCE_PATH_CORRIDOR_M wide on either side that
+# raises an "exit" event when a vehicle on that path leaves it (0 disables
+# them); GEOFENCE_EVENTS breach events are kept for the API. A fence that
+# would reach more than GEOFENCE_MAX_CELLS grid cells is rejected.
+GEOFENCE_PATH_CORRIDOR_M = float(os.getenv('GEOFENCE_PATH_CORRIDOR_M', '25'))
+GEOFENCE_EVENTS = int(os.getenv('GEOFENCE_EVENTS', '10000'))
+GEOFENCE_MAX_CELLS = int(os.getenv('GEOFENCE_MAX_CELLS', '100000'))
+
+# Stack log lines uploaded by each vehicle, kept for the log API
+VEHICLE_LOG_LINES = int(os.getenv('VEHICLE_LOG_LINES', '2000'))
+
+# Simulation engine (see simulator.py). The demo cars follow their paths while
+# Running until the real vehicle reports in; SIM_VEHICLES adds synthetic cars
+# (SIM0000, ...) for load testing. Positions go through the fleet store and
+# track store just like real updates.
+SIM_TICK_HZ = float(os.getenv('SIM_TICK_HZ', '1'))
+SIM_VEHICLES = int(os.getenv('SIM_VEHICLES', '0'))
+
+# Multi-worker mode: Unix socket of the state server, and the key workers
+# authenticate with (also protected by the socket's 0600 permissions)
+FLEET_STATE_SOCKET = os.getenv('FLEET_STATE_SOCKET')
+FLEET_STATE_AUTHKEY = os.getenv('FLEET_STATE_AUTHKEY', 'fleet-state-demo-key').encode()
+# Workers publish their request metrics every few seconds; metrics of a
+# worker silent for this long (it exited) are dropped
+WORKER_METRICS_TTL = 60.0
+
+class FleetState:
+    """
+    The shared objects behind the web API, built once per deployment.
+    """
+
+    def __init__(self):
+        # Fleet versions restart with the state; the epoch lets a
+        # reconnecting dashboard stream detect that
+        self.epoch = str(int(time.time()))
+        if COMMAND_MAX_AGE is not None and COMMAND_ACK_TIMEOUT * COMMAND_MAX_ATTEMPTS > COMMAND_MAX_AGE:
+            print(f"[COMMAND] WARNING: {COMMAND_MAX_ATTEMPTS} deliveries x {COMMAND_ACK_TIMEOUT:g} s ack timeout "
+                  f"exceed the {COMMAND_MAX_AGE} s command lifetime; late redeliveries are expired instead")
+        self.groups = {name: list(ids) for name, ids in VEHICLE_GROUPS.items()}
+        self.broadcasts = BroadcastTracker()
+        self.metrics = MetricsRegistry()
+        self.logs = VehicleLogStore(VEHICLE_LOG_LINES)
+        self.fleet = FleetStore(INITIAL_CARS, backend=open_backend(FLEET_DB_PATH, FLEET_DB_FLUSH_MS / 1000.0),
+                                ack_timeout=COMMAND_ACK_TIMEOUT, max_attempts=COMMAND_MAX_ATTEMPTS,
+                                max_age=COMMAND_MAX_AGE, on_expired=self._command_expired,
+                                stale_after=VEHICLE_STALE_AFTER, offline_after=VEHICLE_OFFLINE_AFTER,
+                                offline_queue_limit=OFFLINE_QUEUE_LIMIT, offline_command_ttl=OFFLINE_COMMAND_TTL)
+        self.tracks = TrackStore(FLEET_TRACK_DIR, retention=TRACK_RETENTION_HOURS * 3600)
+        self.geo = GeoIndex(origin=(sum(car["lat"] for car in INITIAL_CARS.values()) / len(INITIAL_CARS),
+                                    sum(car["lon"] for car in INITIAL_CARS.values()) / len(INITIAL_CARS)),
+                            max_events=GEOFENCE_EVENTS, metrics=self.metrics,
+                            max_fence_cells=GEOFENCE_MAX_CELLS)
+        if GEOFENCE_PATH_CORRIDOR_M > 0:
+            for name, path in PATHS.items():
+                self.geo.add_fence({"id": f"path:{name}", "name": f"{name} corridor", "kind": "corridor",
+                                    "points": path["waypoints"], "closed": True,
+                                    "width_m": GEOFENCE_PATH_CORRIDOR_M, "on": "exit", "path": name})
+        _, cars = self.fleet.snapshot()
+        self.geo.update_many((acs_id, car["lat"], car["lon"], car["path"]) for acs_id, car in cars.items())
+        self.simulator = FleetSimulator(self.fleet, tick_rate=SIM_TICK_HZ, tracks=self.tracks, metrics=self.metrics,
+                                        geo=self.geo)
+        self._worker_metrics = {}   # worker id -> (time published, MetricsRegistry.raw())
+        self._stop_event = threading.Event()
+        self._sweeper = threading.Thread(target=self._sweep_liveness, name="liveness-sweeper", daemon=True)
+        for car_id in INITIAL_CARS:
+            car = self.fleet.get(car_id)
+            self.simulator.add(car_id, car["path"], running=car["status"] == "Running",
+                               position=(car["lat"], car["lon"]))
+        if SIM_VEHICLES:
+            self.groups.setdefault("sim", []).extend(self.simulator.add_synthetic(SIM_VEHICLES))
+
+    def _command_expired(self, acs_id, entry):
+        reason = entry.get("reason")
+        if reason:
+            print(f"[COMMAND] {entry['id']} for {acs_id} dropped: {reason}")
+        else:
+            print(f"[COMMAND] {entry['id']} for {acs_id} dropped after {entry['attempts']} unacked deliveries")
+        self.metrics.inc("commands_expired")
+        self.broadcasts.acknowledged(acs_id, entry["id"], ok=False,
+                                     message=reason.capitalize() if reason else "No acknowledgement")
+
+    def _sweep_liveness(self):
+        while not self._stop_event.wait(LIVENESS_SWEEP_INTERVAL):
+            started = time.perf_counter()
+            counts = self.fleet.sweep_liveness()
+            self.metrics.observe("liveness_sweep_ms", (time.perf_counter() - started) * 1000, FAST_BUCKETS_MS)
+            if counts["stale"] or counts["offline"]:
+                self.metrics.inc("vehicles_stale_total", counts["stale"])
+                self.metrics.inc("vehicles_offline_total", counts["offline"])
+                print(f"[LIVENESS] {counts['stale']} vehicle(s) went stale, {counts['offline']} offline")
+
+    def info(self):
+        """
+        Returns {"epoch", "groups"}: the static settings workers need.
+        """
+        return {"epoch": self.epoch, "groups": self.groups}
+
+    def queue_broadcast(self, action, path, commands):
+        """
+        Queues {acs_id: command} atomically and registers them as one
+        broadcast before any vehicle can fetch them. A stop supersedes the
+        commands still pending for its vehicles. Returns the broadcast id.
+        """
+        created = []
+        self.fleet.enqueue_many(commands, on_queued=lambda command_ids: created.append(
+            self.broadcasts.create(action, path, command_ids)), supersede=action == "stop")
+        return created[0]
+
+    def publish_worker_metrics(self, worker, raw):
+        """
+        Stores the request metrics of one web worker process, so /metrics
+        on any worker can report the totals of all of them.
+        """
+        self._worker_metrics[worker] = (time.time(), raw)
+
+    def worker_metrics(self, exclude=None):
+        """
+        Returns the raw metrics published by workers other than `exclude`
+        within the last WORKER_METRICS_TTL seconds; older ones are dropped.
+        """
+        cutoff = time.time() - WORKER_METRICS_TTL
+        for worker, (published, _) in list(self._worker_metrics.items()):
+            if published < cutoff:
+                self._worker_metrics.pop(worker, None)
+        return [raw for worker, (_, raw) in list(self._worker_metrics.items()) if worker != exclude]
+
+    def start_background_tasks(self):
+        if not self.simulator.is_alive():
+            self.simulator.start()
+        if not self._sweeper.is_alive():
+            self._sweeper.start()
+
+    def close(self):
+        self._stop_event.set()
+        self.simulator.stop()
+        self.fleet.backend.close()
+        self.tracks.close()
+
+# ----------------------------------------------------------------------
+# State server
+# ----------------------------------------------------------------------
+STATE_METHODS = ('info', 'queue_broadcast', 'publish_worker_metrics', 'worker_metrics')
+FLEET_METHODS = ('__contains__', '__len__', 'ids', 'get', 'update', 'update_many', 'set_status',
+                 'snapshot', 'changes_since', 'wait_for_change', 'enqueue_command', 'enqueue_many',
+                 'lease_command', 'ack_command', 'pop_command', 'wait_command', 'command_depths',
+                 'update_times', 'liveness_counts')
+TRACK_METHODS = ('append', 'extend', 'track', 'vehicles_in_box')
+BROADCAST_METHODS = ('create', 'delivered', 'acknowledged', 'reported', 'get')
+METRIC_METHODS = ('inc', 'observe', 'snapshot', 'raw')
+LOG_METHODS = ('append_lines', 'lines_since', 'tail')
+GEO_METHODS = ('update', 'update_many', 'set_path', 'within_radius', 'within_box', 'inside',
+               'add_fence', 'remove_fence', 'fences', 'events_since', 'stats')
+SIMULATOR_METHODS = ('__contains__', '__len__', 'release', 'set_running', 'set_path')
+
+_FleetProxyBase = MakeProxyType('_FleetProxyBase', FLEET_METHODS)
+
+class FleetProxy(_FleetProxyBase):
+    # The proxy also reads FleetStore.version, which is a property
+    _exposed_ = FLEET_METHODS + ('__getattribute__',)
+
+    @property
+    def version(self):
+        return self._callmethod('__getattribute__', ('version',))
+
+class StateManager(BaseManager):
+    pass
+
+StateManager.register('state', exposed=STATE_METHODS)
+StateManager.register('fleet', proxytype=FleetProxy)
+StateManager.register('tracks', exposed=TRACK_METHODS)
+StateManager.register('broadcasts', exposed=BROADCAST_METHODS)
+StateManager.register('metrics', exposed=METRIC_METHODS)
+StateManager.register('logs', exposed=LOG_METHODS)
+StateManager.register('geo', exposed=GEO_METHODS)
+StateManager.register('simulator', exposed=SIMULATOR_METHODS)
+
+class RemoteState:
+    """
+    FleetState look-alike whose members are proxies to a state server.
+    Each worker thread gets its own connection, so a parked long-poll does
+    not hold up other requests.
+    """
+
+    def __init__(self, address=None, authkey=FLEET_STATE_AUTHKEY):
+        self.manager = StateManager(address=address or FLEET_STATE_SOCKET, authkey=authkey)
+        self.manager.connect()
+        self._state = self.manager.state()
+        self.fleet = self.manager.fleet()
+        self.tracks = self.manager.tracks()
+        self.broadcasts = self.manager.broadcasts()
+        self.metrics = self.manager.metrics()
+        self.logs = self.manager.logs()
+        self.geo = self.manager.geo()
+        self.simulator = self.manager.simulator()
+        info = self._state.info()
+        self.epoch = info["epoch"]
+        self.groups = info["groups"]
+
+    def info(self):
+        return self._state.info()
+
+    def queue_broadcast(self, action, path, commands):
+        return self._state.queue_broadcast(action, path, commands)
+
+    def publish_worker_metrics(self, worker, raw):
+        self._state.publish_worker_metrics(worker, raw)
+
+    def worker_metrics(self, exclude=None):
+        return self._state.worker_metrics(exclude)
+
+    def start_background_tasks(self):
+        # The state server runs them
+        pass
+
+def connect(address=None, timeout=30.0):
+    """
+    Connects to the state server, waiting up to `timeout` seconds for it to
+    come up. Returns a RemoteState.
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            return RemoteState(address)
+        except (FileNotFoundError, ConnectionRefusedError):
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.1)
+
+def _terminate(signum, frame):
+    # serve_forever shuts down on SystemExit, as on Ctrl+C
+    raise SystemExit(0)
+
+def serve(address=None, authkey=FLEET_STATE_AUTHKEY):
+    """
+    Builds the fleet state, starts its background tasks and serves it on a
+    Unix socket until SIGTERM/SIGINT.
+    """
+    address = address or FLEET_STATE_SOCKET
+    if not address:
+        raise SystemExit("Set FLEET_STATE_SOCKET (or pass --socket) to the state server's Unix socket path")
+    if os.path.exists(address):
+        os.unlink(address)   # Left over from an unclean shutdown
+
+    state = FleetState()
+    StateManager.register('state', callable=lambda: state, exposed=STATE_METHODS)
+    StateManager.register('fleet', callable=lambda: state.fleet, proxytype=FleetProxy)
+    StateManager.register('tracks', callable=lambda: state.tracks, exposed=TRACK_METHODS)
+    StateManager.register('broadcasts', callable=lambda: state.broadcasts, exposed=BROADCAST_METHODS)
+    StateManager.register('metrics', callable=lambda: state.metrics, exposed=METRIC_METHODS)
+    StateManager.register('logs', callable=lambda: state.logs, exposed=LOG_METHODS)
+    StateManager.register('geo', callable=lambda: state.geo, exposed=GEO_METHODS)
+    StateManager.register('simulator', callable=lambda: state.simulator, exposed=SIMULATOR_METHODS)
+
+    server = StateManager(address=address, authkey=authkey).get_server()
+    os.chmod(address, 0o600)
+    atexit.register(state.close)
+    signal.signal(signal.SIGTERM, _terminate)
+    state.start_background_tasks()
+    print(f"[STATE] Serving {len(state.fleet)} vehicles on {address}")
+    # The listener removes the socket file when the process exits
+    server.serve_forever()
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--socket', default=FLEET_STATE_SOCKET, help="Unix socket path (default: FLEET_STATE_SOCKET)")
+    serve(parser.parse_args().socket)
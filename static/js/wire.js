@@ -0,0 +1,50 @@
+// Binary fleet snapshot of /api/data (layout in telemetry_codec.py).
+// About a fifth the size of the JSON snapshot.
+const SNAPSHOT_MIME = 'application/x-fleet-snapshot';
+const SNAPSHOT_HEADER_SIZE = 25;
+const SNAPSHOT_CAR_SIZE = 18;
+const NEVER_SEEN = 0xFFFFFFFF;
+
+function decodeSnapshot(buffer) {
+    const view = new DataView(buffer);
+    const bytes = new Uint8Array(buffer);
+    const text = new TextDecoder();
+    if (bytes[0] !== 0x46 || bytes[1] !== 0x53 || bytes[2] !== 2) {
+        throw new Error('Not a version 2 fleet snapshot');
+    }
+    const now = view.getFloat64(11);
+    const stringCount = view.getUint16(19);
+    const count = view.getUint32(21);
+    let offset = SNAPSHOT_HEADER_SIZE;
+    const strings = [];
+    for (let i = 0; i < stringCount; i++) {
+        const length = bytes[offset];
+        strings.push(text.decode(bytes.subarray(offset + 1, offset + 1 + length)));
+        offset += 1 + length;
+    }
+    const cars = {};
+    for (let i = 0; i < count; i++) {
+        const length = bytes[offset];
+        const acsId = text.decode(bytes.subarray(offset + 1, offset + 1 + length));
+        offset += 1 + length;
+        const age = view.getUint32(offset + 14);
+        cars[acsId] = {
+            lat: view.getInt32(offset) / 1e7,
+            lon: view.getInt32(offset + 4) / 1e7,
+            status: strings[view.getUint16(offset + 8)],
+            path: strings[view.getUint16(offset + 10)],
+            liveness: strings[view.getUint16(offset + 12)],
+            last_seen: age === NEVER_SEEN ? null : now - age / 1000,
+        };
+        offset += SNAPSHOT_CAR_SIZE;
+    }
+    return cars;
+}
+
+// All vehicles, as the binary snapshot if the server offers it, else JSON
+function fetchSnapshot() {
+    return fetch('/api/data', { headers: { Accept: `${SNAPSHOT_MIME}, application/json;q=0.5` } })
+        .then(response => response.headers.get('Content-Type') === SNAPSHOT_MIME
+            ? response.arrayBuffer().then(decodeSnapshot)
+            : response.json());
+}
@@ -0,0 +1,278 @@
+"""
+Process supervisor for the vehicle stack started by vehicle_client.
+
+Start/stop requests are queued to a worker thread and run in order, so the
+command listener and the GPS uplink never wait on them. The supervisor
+launches the stack in its own process group and kills that group directly;
+leftovers it did not start (run.sh from another shell, ROS nodes, the
+terminal windows run.sh opened) are found with a single scan of /proc
+instead of forking ps/pgrep/pkill per process.
+"""
+import collections
+import os
+import queue
+import shutil
+import signal
+import subprocess
+import threading
+import time
+
+# Seconds to wait for the killed process group to be reaped
+STOP_TIMEOUT = 2.0
+
+# One entry of scan_processes(). cmdline is the NUL-separated argv joined
+# with spaces; uid is the owner's real user id.
+ProcInfo = collections.namedtuple('ProcInfo', ['pid', 'ppid', 'comm', 'cmdline', 'uid'])
+
+def scan_processes(proc_root='/proc'):
+    """
+    Returns {pid: ProcInfo} for every process visible in /proc, or {} where
+    there is no /proc. Processes that exit mid-scan are skipped.
+    """
+    table = {}
+    try:
+        entries = os.listdir(proc_root)
+    except OSError:
+        return table
+    for entry in entries:
+        if not entry.isdigit():
+            continue
+        base = f"{proc_root}/{entry}"
+        try:
+            with open(f"{base}/stat", 'rb') as f:
+                stat = f.read().decode(errors='replace')
+            with open(f"{base}/cmdline", 'rb') as f:
+                cmdline = f.read().replace(b'\0', b' ').decode(errors='replace').strip()
+            uid = os.stat(base).st_uid
+        except OSError:
+            continue
+        # comm is in parentheses and may itself contain spaces or ')'
+        open_paren, close_paren = stat.find('('), stat.rfind(')')
+        fields = stat[close_paren + 2:].split()
+        if open_paren < 0 or len(fields) < 2:
+            continue
+        table[int(entry)] = ProcInfo(int(entry), int(fields[1]), stat[open_paren + 1:close_paren], cmdline, uid)
+    return table
+
+def ancestors(table, pid):
+    """
+    Returns the set of pid's ancestors (and pid itself) found in `table`.
+    """
+    chain = set()
+    while pid in table and pid not in chain:
+        chain.add(pid)
+        pid = table[pid].ppid
+    return chain
+
+class SupervisorJob:
+    """
+    A queued start/stop. wait() blocks until it has run; result is then
+    ("ok" | "error", message).
+    """
+
+    def __init__(self, action, on_done=None):
+        self.action = action
+        self.on_done = on_done
+        self.result = None
+        self.elapsed = None
+        self._done = threading.Event()
+
+    def finish(self, result, elapsed):
+        self.result = result
+        self.elapsed = elapsed
+        self._done.set()
+        if self.on_done is not None:
+            self.on_done(self)
+
+    def wait(self, timeout=None):
+        return self._done.wait(timeout)
+
+class ProcessSupervisor(threading.Thread):
+    """
+    Background thread owning the vehicle stack's process group.
+
+    `command` is run with bash in a new session when the stack starts.
+    Stopping kills that session and also: processes whose command line
+    contains one of `stray_patterns`, processes named in `stray_names`, and
+    terminal windows (process name starting with a `terminal_names` entry,
+    owned by this user) with a child whose command line contains one of
+    `terminal_markers`. Terminals this client runs in are never closed.
+    If `capture` (a log_capture.LogCapture) is given, the stack's stdout
+    and stderr are drained into it; otherwise they are discarded.
+    """
+
+    def __init__(self, command, stray_patterns=(), stray_names=(), terminal_names=('gnome-terminal',),
+                 terminal_markers=(), close_windows=True, capture=None):
+        super().__init__(name="process-supervisor", daemon=True)
+        self.command = command
+        self.stray_patterns = tuple(stray_patterns)
+        self.stray_names = frozenset(stray_names)
+        self.terminal_names = tuple(terminal_names)
+        self.terminal_markers = tuple(terminal_markers)
+        self.wmctrl = shutil.which('wmctrl') if close_windows else None
+        self.capture = capture
+        self._jobs = queue.Queue()
+        self._lock = threading.Lock()
+        self._process = None
+        self._state = "Stopped"
+        self._exit_code = None
+
+    # Requests (any thread)
+    def start_stack(self, on_done=None):
+        """
+        Queues a restart of the stack (stop anything running, then launch).
+        Returns the SupervisorJob.
+        """
+        return self._submit('start', on_done)
+
+    def stop_stack(self, on_done=None):
+        """
+        Queues a stop of the stack. Returns the SupervisorJob.
+        """
+        return self._submit('stop', on_done)
+
+    def _submit(self, action, on_done):
+        job = SupervisorJob(action, on_done)
+        with self._lock:
+            self._state = "Starting" if action == 'start' else "Stopping"
+        self._jobs.put(job)
+        return job
+
+    def status(self):
+        """
+        Returns (state, pid, exit_code). state is "Starting", "Running",
+        "Stopping", "Stopped" or "Failed" (the stack exited on its own with
+        a non-zero code, or could not be launched).
+        """
+        with self._lock:
+            process = self._process
+            if process is not None and self._state == "Running":
+                code = process.poll()
+                if code is not None:
+                    print(f"[SUPERVISOR] Stack (PID {process.pid}) exited with code {code}")
+                    self._note(f"--- stack (PID {process.pid}) exited with code {code} ---")
+                    self._process = None
+                    self._exit_code = code
+                    self._state = "Stopped" if code == 0 else "Failed"
+            pid = self._process.pid if self._process is not None else None
+            return self._state, pid, self._exit_code
+
+    def stop(self):
+        """
+        Stops the worker thread (the stack is left as it is).
+        """
+        self._jobs.put(None)
+
+    # Worker
+    def run(self):
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                return
+            started = time.perf_counter()
+            try:
+                result = self._start() if job.action == 'start' else self._stop()
+            except Exception as e:
+                print(f"[SUPERVISOR] {job.action} failed: {e}")
+                with self._lock:
+                    self._state = "Failed"
+                result = ("error", str(e))
+            job.finish(result, time.perf_counter() - started)
+
+    def _start(self):
+        self._stop(restarting=True)
+        output = subprocess.PIPE if self.capture else subprocess.DEVNULL
+        process = subprocess.Popen(
+            ['/bin/bash', '-c', self.command],
+            stdin=subprocess.DEVNULL,
+            stdout=output,
+            stderr=output,
+            start_new_session=True  # Own process group, killed as a whole on stop
+        )
+        self._note(f"--- stack started (PID {process.pid}) ---")
+        if self.capture:
+            self.capture.attach(process)
+        with self._lock:
+            self._process = process
+            self._exit_code = None
+            self._state = "Running"
+        print(f"[SUPERVISOR] Started stack (PID {process.pid}): {self.command}")
+        return "ok", f"Started PID {process.pid}"
+
+    def _stop(self, restarting=False):
+        started = time.perf_counter()
+        table = scan_processes()
+        protected = ancestors(table, os.getpid())
+        with self._lock:
+            process = self._process
+
+        killed = 0
+        if process is not None and process.poll() is None:
+            try:
+                os.killpg(process.pid, signal.SIGKILL)
+                killed += 1
+            except ProcessLookupError:
+                pass
+        for info in self._strays(table, protected):
+            killed += _signal(info.pid, signal.SIGKILL)
+        closed = sum(_signal(pid, signal.SIGTERM) for pid in self._terminals(table, protected))
+        closed += self._close_windows()
+
+        code = None
+        if process is not None:
+            try:
+                code = process.wait(STOP_TIMEOUT)
+            except subprocess.TimeoutExpired:
+                print(f"[SUPERVISOR] PID {process.pid} still running {STOP_TIMEOUT:g} s after SIGKILL")
+        with self._lock:
+            if self._process is process:
+                self._process = None
+                self._exit_code = code
+            if not restarting:
+                self._state = "Stopped"
+        message = (f"Stopped {killed} process groups/processes, closed {closed} terminals "
+                   f"in {(time.perf_counter() - started) * 1000:.0f} ms")
+        print(f"[SUPERVISOR] {message}")
+        if process is not None:
+            self._note(f"--- stack (PID {process.pid}) stopped ---")
+        return "ok", message
+
+    def _note(self, text):
+        if self.capture:
+            self.capture.note(text)
+
+    def _strays(self, table, protected):
+        return [info for info in table.values() if info.pid not in protected and (
+            info.comm in self.stray_names
+            or any(pattern in info.cmdline for pattern in self.stray_patterns))]
+
+    def _terminals(self, table, protected):
+        if not self.terminal_markers:
+            return []
+        uid = os.getuid()
+        terminals = {info.pid for info in table.values() if info.uid == uid and info.pid not in protected
+                     and info.comm.startswith(self.terminal_names)}
+        return {info.ppid for info in table.values() if info.ppid in terminals
+                and any(marker in info.cmdline for marker in self.terminal_markers)}
+
+    def _close_windows(self):
+        # Windows hosted by a shared terminal server have no process of their own
+        if not self.wmctrl or not self.terminal_markers:
+            return 0
+        try:
+            listing = subprocess.run([self.wmctrl, '-l'], capture_output=True, text=True, timeout=1)
+        except (OSError, subprocess.SubprocessError):
+            return 0
+        closed = 0
+        for line in listing.stdout.splitlines():
+            if line.split() and any(marker in line for marker in self.terminal_markers):
+                subprocess.run([self.wmctrl, '-i', '-c', line.split()[0]], capture_output=True, timeout=1)
+                closed += 1
+        return closed
+
+def _signal(pid, signum):
+    try:
+        os.kill(pid, signum)
+        return 1
+    except (ProcessLookupError, PermissionError):
+        return 0
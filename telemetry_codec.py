@@ -0,0 +1,202 @@
+"""
+Compact binary wire formats for vehicle telemetry and fleet snapshots.
+
+Both are fixed-layout big-endian records behind a small header. Strings
+that repeat on every record (vehicle id, status, path, liveness) are sent
+once in a string table and referenced by index. Coordinates travel as
+int32 multiples of 1e-7 degrees (about 1 cm), and times as offsets from a
+base time in the header.
+
+Telemetry (vehicle -> server, Content-Type TELEMETRY_MIME):
+
+    header  magic "FT" | version | base time (float64) | string count (uint8)
+    strings length (uint8) | UTF-8, ...   string 0 is the vehicle id
+    fixes   ms after base (uint32) | lat | lon (int32) | status | path (uint8 index)
+            | gps quality (uint8) | gps age in 10 ms units (uint16, 0xFFFF = none)
+
+Snapshot (server -> dashboard, Accept SNAPSHOT_MIME):
+
+    header  magic "FS" | version | fleet version (uint64) | server time (float64)
+            | string count (uint16) | vehicle count (uint32)
+    strings length (uint8) | UTF-8, ...
+    cars    id length (uint8) | id | lat | lon (int32) | status | path (uint16 index)
+            | liveness (uint16 index) | ms since last seen (uint32, 0xFFFFFFFF = never)
+
+static/js/wire.js decodes snapshots in the browser. Every field is
+validated on decode; malformed bodies raise ValueError, and telemetry of
+another wire version raises UnsupportedVersion (a ValueError). A snapshot that
+does not fit the format (e.g. more than 65535 distinct strings) raises
+ValueError on encode, and /api/data then answers in JSON.
+"""
+import struct
+import zlib
+
+TELEMETRY_MIME = 'application/x-fleet-telemetry'
+SNAPSHOT_MIME = 'application/x-fleet-snapshot'
+WIRE_VERSION = 1
+SNAPSHOT_VERSION = 2        # 1 had an uint8 liveness index
+COORD_SCALE = 10000000      # int32 units per degree
+NO_GPS_AGE = 0xFFFF
+NEVER_SEEN = 0xFFFFFFFF
+
+class UnsupportedVersion(ValueError):
+    """A well-formed telemetry body of a wire version this side cannot read."""
+
+_TELEMETRY_HEADER = struct.Struct('>2sBdB')      # magic, version, base time, string count
+_FIX = struct.Struct('>IiiBBBH')                 # 17 bytes per fix
+_SNAPSHOT_HEADER = struct.Struct('>2sBQdHI')     # magic, version, fleet version, time, strings, cars
+_CAR = struct.Struct('>iiHHHI')                  # 18 bytes + id per vehicle
+
+def _pack_strings(strings):
+    parts = []
+    for text in strings:
+        data = text.encode()
+        if len(data) > 255:
+            raise ValueError(f"String too long for the wire format: {text[:32]!r}...")
+        parts.append(bytes((len(data),)) + data)
+    return b''.join(parts)
+
+def _unpack_strings(body, offset, count):
+    strings = []
+    for _ in range(count):
+        if offset >= len(body):
+            raise ValueError("Truncated string table")
+        length = body[offset]
+        end = offset + 1 + length
+        if end > len(body):
+            raise ValueError("Truncated string table")
+        strings.append(body[offset + 1:end].decode('utf-8', 'replace'))
+        offset = end
+    return strings, offset
+
+def _scaled(degrees):
+    value = round(degrees * COORD_SCALE)
+    if not -0x80000000 <= value <= 0x7FFFFFFF:
+        raise ValueError(f"Coordinate out of range: {degrees}")
+    return value
+
+# ----------------------------------------------------------------------
+# Telemetry
+# ----------------------------------------------------------------------
+def encode_fixes(acs_id, fixes):
+    """
+    Encodes a batch of fixes, as dicts with "t", "lat", "lon", "status",
+    "path" and optionally "gps_quality" and "gps_age" (seconds), into a
+    telemetry body for `acs_id`.
+    """
+    if not fixes:
+        raise ValueError("No fixes to encode")
+    base = min(fix["t"] for fix in fixes)
+    strings = {acs_id: 0}
+    records = []
+    for fix in fixes:
+        status = strings.setdefault(str(fix.get("status", "Unknown")), len(strings))
+        path = strings.setdefault(str(fix.get("path", "Unknown")), len(strings))
+        age = fix.get("gps_age")
+        records.append(_FIX.pack(round((fix["t"] - base) * 1000), _scaled(fix["lat"]), _scaled(fix["lon"]),
+                                 status, path, min(int(fix.get("gps_quality") or 0), 255),
+                                 NO_GPS_AGE if age is None else min(round(age * 100), NO_GPS_AGE - 1)))
+    if len(strings) > 255:
+        raise ValueError("Too many distinct strings in one batch")
+    return (_TELEMETRY_HEADER.pack(b'FT', WIRE_VERSION, base, len(strings))
+            + _pack_strings(strings) + b''.join(records))
+
+def decode_fixes(body):
+    """
+    Decodes a telemetry body. Returns (acs_id, fixes) with one
+    (t, lat, lon, status, path, gps_quality, gps_age) tuple per fix, in the
+    order sent; gps_age is None if the vehicle had no fix.
+    """
+    if len(body) < _TELEMETRY_HEADER.size:
+        raise ValueError("Truncated telemetry header")
+    magic, version, base, count = _TELEMETRY_HEADER.unpack_from(body)
+    if magic != b'FT':
+        raise ValueError("Not a telemetry body")
+    if version != WIRE_VERSION:
+        raise UnsupportedVersion(f"Telemetry wire version {version} is not {WIRE_VERSION}")
+    if count == 0:
+        raise ValueError("Missing vehicle id")
+    strings, offset = _unpack_strings(body, _TELEMETRY_HEADER.size, count)
+    if (len(body) - offset) % _FIX.size:
+        raise ValueError("Truncated fix")
+    fixes = []
+    append = fixes.append
+    try:
+        for dt, lat, lon, status, path, quality, age in _FIX.iter_unpack(memoryview(body)[offset:]):
+            append((base + dt / 1000, lat / COORD_SCALE, lon / COORD_SCALE, strings[status], strings[path],
+                    quality, None if age == NO_GPS_AGE else age / 100))
+    except IndexError:
+        raise ValueError("String index out of range") from None
+    return strings[0], fixes
+
+# ----------------------------------------------------------------------
+# Snapshots
+# ----------------------------------------------------------------------
+def encode_snapshot(version, cars, now):
+    """
+    Encodes a fleet snapshot ({acs_id: car dict} as FleetStore.snapshot
+    returns it) taken at fleet `version`, with last-seen times relative to
+    `now`. Raises ValueError if it does not fit the format.
+    """
+    strings = {}
+    setdefault = strings.setdefault
+    parts = []
+    try:
+        for acs_id, car in cars.items():
+            key = acs_id.encode()
+            if len(key) > 255:
+                raise ValueError(f"Vehicle id too long for the wire format: {acs_id[:32]!r}...")
+            seen = car["last_seen"]
+            parts.append(bytes((len(key),)) + key + _CAR.pack(
+                _scaled(car["lat"]), _scaled(car["lon"]),
+                setdefault(car["status"], len(strings)), setdefault(car["path"], len(strings)),
+                setdefault(car["liveness"], len(strings)),
+                NEVER_SEEN if seen is None else min(max(0, round((now - seen) * 1000)), NEVER_SEEN - 1)))
+    except struct.error:
+        # A string index past 0xFFFF
+        raise ValueError("Too many distinct strings in one snapshot") from None
+    if len(strings) > 0xFFFF:
+        raise ValueError("Too many distinct strings in one snapshot")
+    return (_SNAPSHOT_HEADER.pack(b'FS', SNAPSHOT_VERSION, version, now, len(strings), len(cars))
+            + _pack_strings(strings) + b''.join(parts))
+
+def decode_snapshot(body):
+    """
+    Decodes a snapshot body. Returns (version, {acs_id: car dict}) in the
+    same shape as the JSON /api/data.
+    """
+    if len(body) < _SNAPSHOT_HEADER.size:
+        raise ValueError("Truncated snapshot header")
+    magic, wire_version, version, now, string_count, count = _SNAPSHOT_HEADER.unpack_from(body)
+    if magic != b'FS' or wire_version != SNAPSHOT_VERSION:
+        raise ValueError(f"Not a version {SNAPSHOT_VERSION} snapshot body")
+    strings, offset = _unpack_strings(body, _SNAPSHOT_HEADER.size, string_count)
+    cars = {}
+    try:
+        for _ in range(count):
+            length = body[offset]
+            acs_id = body[offset + 1:offset + 1 + length].decode('utf-8', 'replace')
+            lat, lon, status, path, liveness, age = _CAR.unpack_from(body, offset + 1 + length)
+            offset += 1 + length + _CAR.size
+            cars[acs_id] = {"lat": lat / COORD_SCALE, "lon": lon / COORD_SCALE, "status": strings[status],
+                            "path": strings[path], "liveness": strings[liveness],
+                            "last_seen": None if age == NEVER_SEEN else now - age / 1000}
+    except (IndexError, struct.error):
+        raise ValueError("Truncated or corrupt snapshot") from None
+    return version, cars
+
+# ----------------------------------------------------------------------
+# gzip
+# ----------------------------------------------------------------------
+def gunzip(data, limit):
+    """
+    Decompresses a gzip body, refusing to inflate it beyond `limit` bytes.
+    """
+    inflater = zlib.decompressobj(wbits=31)
+    try:
+        result = inflater.decompress(data, limit)
+    except zlib.error as e:
+        raise ValueError(f"Invalid gzip body: {e}") from None
+    if inflater.unconsumed_tail:
+        raise ValueError(f"Body inflates beyond {limit} bytes")
+    return result
@@ -0,0 +1,92 @@
+"""
+Hashed timing wheel for many coarse timeouts.
+
+Time is cut into ticks of `resolution` seconds and each tick maps to one
+of `slots` buckets (tick % slots). schedule() appends to one bucket and
+advance() empties only the buckets of the ticks that passed, so the cost
+of a sweep grows with the number of timers due, not with the number of
+timers pending. Timers further out than one turn of the wheel stay in
+their bucket and are passed over once per turn.
+
+Each key has at most one live timer: scheduling it again replaces the
+earlier one, which is dropped lazily when its bucket comes round.
+"""
+import math
+
+class TimerWheel:
+    """
+    Not thread-safe; callers serialize schedule/cancel/advance.
+    """
+
+    def __init__(self, now, resolution=1.0, slots=512):
+        self.resolution = resolution
+        self._slots = [[] for _ in range(slots)]
+        self._tick = int(now // resolution)   # Last tick advanced past
+        self._due = {}                        # key -> tick of its live timer
+
+    def __len__(self):
+        return len(self._due)
+
+    def __contains__(self, key):
+        return key in self._due
+
+    def schedule(self, key, when):
+        """
+        Fires `key` at the first advance() at or after time `when`
+        (rounded up to the next tick, and never in a tick already passed).
+        """
+        tick = max(math.ceil(when / self.resolution), self._tick + 1)
+        self._due[key] = tick
+        self._slots[tick % len(self._slots)].append((tick, key))
+
+    def schedule_many(self, timers):
+        """
+        schedule() for each (key, when) in `timers`.
+        """
+        resolution, slots, due, ceil = self.resolution, self._slots, self._due, math.ceil
+        count, first = len(slots), self._tick + 1
+        for key, when in timers:
+            tick = ceil(when / resolution)
+            if tick < first:
+                tick = first
+            due[key] = tick
+            slots[tick % count].append((tick, key))
+
+    def cancel(self, key):
+        self._due.pop(key, None)
+
+    def advance(self, now):
+        """
+        Moves the wheel to `now`. Returns the keys whose timers are due,
+        in deadline order.
+        """
+        target = int(now // self.resolution)
+        if target <= self._tick:
+            return []
+        slots, due = self._slots, self._due
+        count = len(slots)
+        # After a whole turn or more, every bucket is visited once and holds
+        # timers of several past ticks, so the result needs sorting
+        lapped = target - self._tick >= count
+        ticks = range(self._tick + 1, self._tick + 1 + count) if lapped else range(self._tick + 1, target + 1)
+        fired = []
+        for tick in ticks:
+            index = tick % count
+            bucket = slots[index]
+            if not bucket:
+                continue
+            keep = []
+            for entry in bucket:
+                entry_tick, key = entry
+                if due.get(key) != entry_tick:
+                    continue   # Replaced or cancelled
+                if entry_tick <= target:
+                    del due[key]
+                    fired.append(entry)
+                else:
+                    keep.append(entry)
+            slots[index] = keep
+        self._tick = target
+        if lapped:
+            fired.sort(key=lambda entry: entry[0])
+        return [key for _, key in fired]
@@ -0,0 +1,367 @@
+"""
+Append-only position history for every vehicle.
+
+Each vehicle's track is split into chunks covering CHUNK_SECONDS of time.
+A chunk stores timestamps, latitudes and longitudes as separate columnar
+arrays of doubles. When a chunk is complete (a newer chunk has started) and a
+directory is configured, it is written to disk and memory-mapped, so a day of
+fleet history lives in the page cache rather than the Python heap.
+
+A spatial index maps (time bucket, grid cell) to the vehicles seen there, so
+"which vehicles were in this box between t0 and t1" only looks at the cells
+under the box instead of every point of every vehicle.
+"""
+import array
+import bisect
+import json
+import math
+import mmap
+import os
+import re
+import threading
+import time
+
+CHUNK_SECONDS = 600          # Time covered by one chunk / index bucket
+GRID_DEGREES = 0.001         # Index cell size (~110 m of latitude)
+DEFAULT_RETENTION = 86400    # Seconds of history kept
+
+_SAFE_NAME = re.compile(r'^[A-Za-z0-9_-]{1,64}$')
+_ESCAPED = '~'   # Prefix of hex-escaped directory names; no safe name contains it
+
+def _cell(lat, lon):
+    return (math.floor(lat / GRID_DEGREES), math.floor(lon / GRID_DEGREES))
+
+class _Chunk:
+    __slots__ = ('bucket', 'ts', 'lat', 'lon', 'cells', 'path', '_mmap')
+
+    def __init__(self, bucket):
+        self.bucket = bucket
+        self.ts = array.array('d')
+        self.lat = array.array('d')
+        self.lon = array.array('d')
+        self.cells = set()
+        self.path = None
+        self._mmap = None
+
+    @property
+    def sealed(self):
+        return self._mmap is not None
+
+    def __len__(self):
+        return len(self.ts)
+
+    def writable(self):
+        # Copy a memory-mapped chunk back into arrays (late fixes after an outage)
+        if self._mmap is not None:
+            self.ts = array.array('d', self.ts)
+            self.lat = array.array('d', self.lat)
+            self.lon = array.array('d', self.lon)
+            self._release()
+        return self
+
+    def seal(self, path):
+        """
+        Writes the chunk to `path` and replaces the arrays with views of a
+        read-only memory map of the file.
+        """
+        if self.sealed or not self.ts:
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = path + '.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(len(self.ts).to_bytes(8, 'little'))
+            self.ts.tofile(f)
+            self.lat.tofile(f)
+            self.lon.tofile(f)
+        os.replace(tmp, path)
+        with open(path + '.cells', 'w') as f:
+            json.dump(sorted(self.cells), f)
+        self.path = path
+        self._map(path)
+
+    def _map(self, path):
+        with open(path, 'rb') as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        count = int.from_bytes(mapped[:8], 'little')
+        view = memoryview(mapped)
+        size = 8 * count
+        self.ts = view[8:8 + size].cast('d')
+        self.lat = view[8 + size:8 + 2 * size].cast('d')
+        self.lon = view[8 + 2 * size:8 + 3 * size].cast('d')
+        self._mmap = mapped
+
+    def _release(self):
+        mapped, self._mmap = self._mmap, None
+        if mapped is not None:
+            try:
+                mapped.close()
+            except BufferError:
+                # A query still holds a view; the map is freed with it
+                pass
+
+    @classmethod
+    def load(cls, bucket, path):
+        chunk = cls(bucket)
+        chunk._map(path)
+        chunk.path = path
+        try:
+            with open(path + '.cells') as f:
+                chunk.cells = {tuple(cell) for cell in json.load(f)}
+        except (OSError, ValueError):
+            chunk.cells = {_cell(lat, lon) for lat, lon in zip(chunk.lat, chunk.lon)}
+        return chunk
+
+    def remove_files(self):
+        self._release()
+        if self.path:
+            for name in (self.path, self.path + '.cells'):
+                try:
+                    os.remove(name)
+                except OSError:
+                    pass
+
+    def window(self, t0, t1):
+        return bisect.bisect_left(self.ts, t0), bisect.bisect_right(self.ts, t1)
+
+class TrackStore:
+    """
+    Per-vehicle position history with time-window and bounding-box queries.
+    `directory` enables on-disk, memory-mapped chunks; without it history is
+    kept in memory. Chunks more than `retention` seconds older than `clock()`
+    are dropped; fix timestamps never move that horizon, so one vehicle with
+    a wrong clock cannot expire anyone's history.
+    """
+
+    def __init__(self, directory=None, retention=DEFAULT_RETENTION, clock=time.time):
+        self.directory = directory
+        self.retention = retention
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._tracks = {}   # acs_id -> {bucket: _Chunk}
+        self._index = {}    # bucket -> {cell: set(acs_id)}
+        self._current_bucket = None   # Bucket of clock() at the last write
+        if directory:
+            self._load(directory)
+
+    def _chunk_path(self, acs_id, bucket):
+        name = acs_id if _SAFE_NAME.match(acs_id) else _ESCAPED + acs_id.encode('utf-8').hex()
+        return os.path.join(self.directory, name, f"{bucket}.trk")
+
+    def _load(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        for name in os.listdir(directory):
+            vehicle_dir = os.path.join(directory, name)
+            if not os.path.isdir(vehicle_dir):
+                continue
+            if name.startswith(_ESCAPED):
+                try:
+                    acs_id = bytes.fromhex(name[len(_ESCAPED):]).decode('utf-8')
+                except ValueError:
+                    print(f"[TRACKS] Skipping unreadable track directory {name}")
+                    continue
+            else:
+                acs_id = name
+            for filename in os.listdir(vehicle_dir):
+                if not filename.endswith('.trk'):
+                    continue
+                bucket = int(filename[:-4])
+                chunk = _Chunk.load(bucket, os.path.join(vehicle_dir, filename))
+                self._tracks.setdefault(acs_id, {})[bucket] = chunk
+                self._index_cells(acs_id, bucket, chunk.cells)
+
+    def _index_cells(self, acs_id, bucket, cells):
+        grid = self._index.setdefault(bucket, {})
+        for cell in cells:
+            grid.setdefault(cell, set()).add(acs_id)
+
+    # ------------------------------------------------------------------
+    # Writes
+    # ------------------------------------------------------------------
+    def append(self, acs_id, t, lat, lon):
+        """
+        Records one fix. Fixes may arrive late (e.g. replayed after an
+        outage); they are inserted in time order.
+        """
+        self.extend(acs_id, ((t, lat, lon),))
+
+    def extend(self, acs_id, fixes):
+        """
+        Records an iterable of (t, lat, lon) fixes for one vehicle.
+        """
+        with self._lock:
+            self._advance()
+            late = set()
+            for t, lat, lon in fixes:
+                self._insert(acs_id, t, lat, lon, late)
+            self._seal_late(late)
+
+    def append_many(self, t, positions):
+        """
+        Records (acs_id, lat, lon) positions of many vehicles taken at the
+        same time `t`, under one lock acquisition.
+        """
+        with self._lock:
+            self._advance()
+            late = set()
+            for acs_id, lat, lon in positions:
+                self._insert(acs_id, t, lat, lon, late)
+            self._seal_late(late)
+
+    def _insert(self, acs_id, t, lat, lon, late):
+        # Caller holds self._lock; (acs_id, bucket) of late fixes go in `late`
+        bucket = int(t // CHUNK_SECONDS)
+        chunks = self._tracks.get(acs_id)
+        if chunks is None:
+            chunks = self._tracks[acs_id] = {}
+        chunk = chunks.get(bucket)
+        if chunk is None:
+            chunk = chunks[bucket] = _Chunk(bucket)
+        elif chunk.sealed:
+            chunk.writable()
+        if not chunk.ts or t >= chunk.ts[-1]:
+            chunk.ts.append(t)
+            chunk.lat.append(lat)
+            chunk.lon.append(lon)
+        else:
+            i = bisect.bisect_right(chunk.ts, t)
+            chunk.ts.insert(i, t)
+            chunk.lat.insert(i, lat)
+            chunk.lon.insert(i, lon)
+        cell = _cell(lat, lon)
+        if cell not in chunk.cells:
+            chunk.cells.add(cell)
+            self._index.setdefault(bucket, {}).setdefault(cell, set()).add(acs_id)
+        if bucket < self._current_bucket:
+            late.add((acs_id, bucket))
+
+    def _advance(self):
+        # Caller holds self._lock
+        current = int(self._clock() // CHUNK_SECONDS)
+        if current != self._current_bucket:
+            # A new time bucket started: seal finished chunks, drop old ones
+            self._current_bucket = current
+            self._seal_and_prune()
+
+    def _seal_late(self, late):
+        # Caller holds self._lock
+        if self.directory:
+            for acs_id, bucket in late:
+                chunk = self._tracks[acs_id].get(bucket)
+                if chunk is not None:
+                    chunk.seal(self._chunk_path(acs_id, bucket))
+
+    def _seal_and_prune(self):
+        # Caller holds self._lock
+        newest = self._current_bucket
+        oldest_kept = newest - int(self.retention // CHUNK_SECONDS)
+        for acs_id, chunks in self._tracks.items():
+            for bucket in [b for b in chunks if b < oldest_kept]:
+                chunks.pop(bucket).remove_files()
+            if self.directory:
+                for bucket, chunk in chunks.items():
+                    if bucket < newest and not chunk.sealed:
+                        chunk.seal(self._chunk_path(acs_id, bucket))
+        for bucket in [b for b in self._index if b < oldest_kept]:
+            del self._index[bucket]
+
+    def close(self):
+        """
+        Writes every unsealed chunk, including the current one, to disk.
+        """
+        if not self.directory:
+            return
+        with self._lock:
+            for acs_id, chunks in self._tracks.items():
+                for bucket, chunk in chunks.items():
+                    if not chunk.sealed:
+                        chunk.seal(self._chunk_path(acs_id, bucket))
+
+    # ------------------------------------------------------------------
+    # Queries
+    # ------------------------------------------------------------------
+    def track(self, acs_id, t0, t1, max_points=None):
+        """
+        Returns (points, total) where points is a list of [t, lat, lon] for
+        one vehicle between t0 and t1, evenly downsampled to at most
+        max_points (the last point is always kept), and total is the number
+        of points in the window before downsampling.
+        """
+        with self._lock:
+            chunks = self._tracks.get(acs_id, {})
+            windows = []
+            total = 0
+            for bucket in sorted(chunks):
+                if (bucket + 1) * CHUNK_SECONDS < t0 or bucket * CHUNK_SECONDS > t1:
+                    continue
+                chunk = chunks[bucket]
+                lo, hi = chunk.window(t0, t1)
+                if hi > lo:
+                    windows.append((chunk, lo, hi))
+                    total += hi - lo
+
+            step = 1
+            if max_points and total > max_points:
+                # One slot is reserved for the last point
+                step = math.ceil(total / max(max_points - 1, 1))
+            points = []
+            offset = 0
+            for chunk, lo, hi in windows:
+                # Keep every step-th point of the whole window, across chunks
+                start = lo + (-offset) % step
+                ts, lats, lons = chunk.ts, chunk.lat, chunk.lon
+                for i in range(start, hi, step):
+                    points.append([ts[i], lats[i], lons[i]])
+                offset += hi - lo
+            if step > 1 and windows:
+                chunk, lo, hi = windows[-1]
+                last = [chunk.ts[hi - 1], chunk.lat[hi - 1], chunk.lon[hi - 1]]
+                if points[-1] != last:
+                    points.append(last)
+        return points, total
+
+    def vehicles_in_box(self, min_lat, min_lon, max_lat, max_lon, t0, t1):
+        """
+        Returns {acs_id: first time seen} for vehicles with at least one
+        fix inside the box between t0 and t1.
+        """
+        lat_lo, lon_lo = _cell(min_lat, min_lon)
+        lat_hi, lon_hi = _cell(max_lat, max_lon)
+        box_cells = (lat_hi - lat_lo + 1) * (lon_hi - lon_lo + 1)
+        found = {}
+
+        with self._lock:
+            # Only buckets that hold fixes, however wide the window
+            first, last = t0 // CHUNK_SECONDS, t1 // CHUNK_SECONDS
+            for bucket in sorted(b for b in self._index if first <= b <= last):
+                grid = self._index[bucket]
+                if not grid:
+                    continue
+                if box_cells <= len(grid):
+                    cells = ((a, b) for a in range(lat_lo, lat_hi + 1) for b in range(lon_lo, lon_hi + 1))
+                else:
+                    cells = (cell for cell in grid
+                             if lat_lo <= cell[0] <= lat_hi and lon_lo <= cell[1] <= lon_hi)
+                candidates = set()
+                for cell in cells:
+                    candidates.update(grid.get(cell, ()))
+
+                for acs_id in candidates:
+                    if acs_id in found and found[acs_id] <= bucket * CHUNK_SECONDS:
+                        continue
+                    chunk = self._tracks.get(acs_id, {}).get(bucket)
+                    if chunk is None:
+                        continue
+                    lo, hi = chunk.window(t0, t1)
+                    lats, lons, ts = chunk.lat, chunk.lon, chunk.ts
+                    for i in range(lo, hi):
+                        if min_lat <= lats[i] <= max_lat and min_lon <= lons[i] <= max_lon:
+                            if acs_id not in found or ts[i] < found[acs_id]:
+                                found[acs_id] = ts[i]
+                            break
+        return found
+
+    def stats(self):
+        with self._lock:
+            points = sum(len(c) for chunks in self._tracks.values() for c in chunks.values())
+            mapped = sum(1 for chunks in self._tracks.values() for c in chunks.values() if c.sealed)
+            return {"vehicles": len(self._tracks), "points": points, "mapped_chunks": mapped}
@@ -1,365 +1,456 @@
 import time
+import collections
+import gzip
+import itertools
 import requests
 import json
 import base64
 import random
 import os
-import signal
-import serial  # For GPS communication
+import threading
+from gps_reader import GpsReader, parse_nmea_sentence  # parse_nmea_sentence kept importable from here
 # Re-using the crypto module from the server for simplicity in this demo.
-# In production, these encryption keys must be securely stored on the vehicle.
-from crypto import decrypt_execute 
+# The vehicle only holds its own v2 key (VEHICLE_KEY), never the master key.
+from crypto import open_command, EnvelopeCodec, ReplayWindow
+from telemetry_codec import TELEMETRY_MIME, encode_fixes
+from supervisor import ProcessSupervisor
+from log_capture import LogCapture
 import subprocess
 
 SERVER_URL = "http://192.168.20.18:8085" # Server IP address
 ACS_ID = "ACS03" # UNIQUE ID FOR EACH CAR
+# This vehicle's v2 command key (base64), printed on the server by
+# `python crypto.py vehicle-key <ACS_ID>`. Keep it out of version control.
+VEHICLE_KEY = base64.b64decode(os.getenv('VEHICLE_KEY', ''))
 
 # GPS Configuration
 GPS_PORT = "/dev/ttyACM0"  # GPS serial port
 GPS_BAUDRATE = 38400       # GPS baud rate
 GPS_TIMEOUT = 1            # Serial timeout in seconds
+GPS_STALE_AFTER = 3.0      # Seconds before the latest fix counts as lost
 
-# Global variable to track running processes
-running_process = None
+# Command delivery
+LONG_POLL_TIMEOUT = 25        # Seconds the server may park a command request
+COMMAND_POLL_INTERVAL = 0.2   # Legacy poll interval / retry backoff
+GPS_UPDATE_INTERVAL = 0.2     # 5 updates per second
 
-# Global GPS connection
-gps_serial = None
+# Migration window: also accept old-format (CBC) commands, which have no
+# replay protection. Turn off once the server sends only v2 envelopes.
+ACCEPT_LEGACY_COMMANDS = True
+
+# Commands are acked after they run; the server redelivers unacked ones, so
+# results of recently executed command ids are kept to re-ack without
+# running the command twice
+COMMAND_DEDUP_SIZE = 256
+
+# Telemetry uplink: fixes are sampled every GPS_UPDATE_INTERVAL into a ring
+# buffer and uploaded in batches over one keep-alive connection
+TELEMETRY_BATCH_SIZE = 5         # Upload once this many fixes are buffered
+TELEMETRY_FLUSH_INTERVAL = 1.0   # ...or when this many seconds have passed
+TELEMETRY_MAX_BATCH = 200        # Max fixes per request when replaying
+TELEMETRY_BUFFER_SIZE = 3000     # ~10 minutes at 5 Hz kept during an outage
+# Wire format of uploads: "binary" (telemetry_codec.py, ~17 bytes per fix),
+# "gzip" (gzipped JSON) or "json". If the server rejects a format, uploads
+# fall back to the next one in TELEMETRY_FORMATS.
+TELEMETRY_FORMAT = "binary"
+TELEMETRY_FORMATS = ("binary", "gzip", "json")
+TELEMETRY_GZIP_MIN_FIXES = 20    # Binary batches this large (replays) are gzipped too
+
+# Vehicle stack launched on "start" and torn down on "stop" by the
+# supervisor thread (see supervisor.py). Stopping kills the launched process
+# group plus any leftovers: other run.sh instances, ROS/RViz processes and
+# the terminal windows run.sh opened (found with one /proc scan).
+STACK_ENV_SCRIPT = "source /home/tihan/DMRC/run_wr.sh"
+STACK_RUN_SCRIPT = "/home/tihan/PHASE1/run.sh"
+STACK_PROCESS_NAMES = ('rviz', 'roscore', 'rosmaster', 'roslaunch', 'rosrun')
+STACK_TERMINAL_MARKERS = ('PHASE1', 'run.sh')
+
+# Stack stdout/stderr: the last STACK_LOG_LINES lines are kept in memory and
+# uploaded to the server every LOG_UPLOAD_INTERVAL seconds (at most
+# LOG_UPLOAD_MAX_LINES per request); STACK_LOG_FILE keeps a size-rotated
+# copy on disk (None to disable)
+STACK_LOG_LINES = 2000
+STACK_LOG_FILE = "vehicle_stack.log"
+STACK_LOG_MAX_BYTES = 10 * 1024 * 1024
+STACK_LOG_BACKUPS = 3
+LOG_UPLOAD_INTERVAL = 1.0
+LOG_UPLOAD_MAX_LINES = 500
+
+# Supervisor of the vehicle stack (started in main)
+supervisor = None
+
+# Opens v2 commands with this vehicle's key only
+envelope = EnvelopeCodec(master_key=None, vehicle_keys={ACS_ID: VEHICLE_KEY} if VEHICLE_KEY else None)
+
+# Sequence numbers of accepted v2 commands, so a captured command cannot be replayed
+replay_window = ReplayWindow()
+
+# command id -> (status, message) of recently executed commands
+# (None while its start/stop is still running on the supervisor)
+executed_commands = collections.OrderedDict()
+executed_lock = threading.Lock()
+
+# Telemetry wire format in use (may fall back from TELEMETRY_FORMAT)
+telemetry_format = TELEMETRY_FORMAT
+
+# Background GPS reader (started in main)
+gps_reader = None
 last_gps_position = {"lat": 17.5947, "lon": 78.1230}  # Fallback position
 
-def execute_bash_command(command_str, background=False):
+def execute_bash_command(command_str):
     """
     Executes a command within the context of .bashrc to ensure all aliases/functions are available.
-    If background=True, runs the process in background and stores it globally.
+    Runs synchronously; the vehicle stack itself is started by the supervisor.
     """
-    global running_process
-    
     try:
         # Source the run.sh script and execute the command
         # Adjust the path to your actual run.sh location
-        full_cmd = f"source /home/tihan/DMRC/run_wr.sh && {command_str}"
+        full_cmd = f"{STACK_ENV_SCRIPT} && {command_str}"
+        result = subprocess.run(full_cmd, shell=True, executable='/bin/bash', capture_output=True, text=True)
         
-        if background:
-            # Start process in background
-            running_process = subprocess.Popen(
-                full_cmd, 
-                shell=True, 
-                executable='/bin/bash',
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                preexec_fn=os.setsid  # Create new process group
-            )
-            print(f">>> Started in background (PID: {running_process.pid}): {full_cmd}")
-            return True
-        else:
-            # Run synchronously
-            result = subprocess.run(full_cmd, shell=True, executable='/bin/bash', capture_output=True, text=True)
-            
-            print(f">>> Executed: {full_cmd}")
-            print(f"    Stdout: {result.stdout.strip()}")
-            if result.stderr:
-                print(f"    Stderr: {result.stderr.strip()}")
-            return True
+        print(f">>> Executed: {full_cmd}")
+        print(f"    Stdout: {result.stdout.strip()}")
+        if result.stderr:
+            print(f"    Stderr: {result.stderr.strip()}")
+        return True
     except Exception as e:
         print(f"!!! Execution Error: {e}")
         return False
 
-def parse_nmea_sentence(nmea_sentence):
+def get_gps_data():
     """
-    Parse NMEA GNGGA sentence to extract GPS coordinates.
-    Extracted from gps.py for use without ROS dependency.
+    Returns the current position from the background GPS reader.
+    Never touches the serial port, so it returns immediately.
+    Falls back to last known position if GPS unavailable or the fix is stale.
     """
-    data = nmea_sentence.split(',')
+    global last_gps_position
     
-    if data[0] == "$GNGGA":
-        try:
-            lat_deg = float(data[2][:2])
-            lat_min = float(data[2][2:])
-            latitude = lat_deg + (lat_min / 60.0)
-            if data[3] == 'S':
-                latitude = -latitude
-            
-            lon_deg = float(data[4][:3])
-            lon_min = float(data[4][3:])
-            longitude = lon_deg + (lon_min / 60.0)
-            if data[5] == 'W':
-                longitude = -longitude
-            
-            altitude = float(data[9]) if data[9] else 0.0
-            
-            return latitude, longitude, altitude
-        except (ValueError, IndexError):
-            return None, None, None
-    return None, None, None
+    fix = gps_reader.latest() if gps_reader else None
+    fix_age = time.monotonic() - fix.timestamp if fix else None
+    
+    if fix is not None and fix_age <= GPS_STALE_AFTER:
+        # Update last known position
+        last_gps_position = {"lat": fix.lat, "lon": fix.lon}
+    
+    return {
+        "acs_id": ACS_ID,
+        "lat": last_gps_position["lat"],
+        "lon": last_gps_position["lon"],
+        "status": supervisor.status()[0] if supervisor else "Stopped",
+        "path": "Active-Path",
+        "gps_quality": (fix.quality or 0) if fix else 0,
+        "gps_age": round(fix_age, 2) if fix_age is not None else None
+    }
 
-def kill_all_processes():
+def handle_command(encrypted_cmd, on_done=None):
     """
-    Kills ONLY processes spawned by run.sh AND closes their terminal windows.
-    Keeps vehicle_client.py and main terminal running.
+    Decrypts a command fetched from the server and executes its action.
+    Start/stop is handed to the supervisor: returns None and calls
+    on_done(result) from the supervisor thread once it has run. Otherwise
+    returns ("ok" | "error", message) for the acknowledgement.
     """
-    global running_process
+    print(f"\n[COMMAND] Received encrypted command: {encrypted_cmd[:50]}...")
     
-    killed_count = 0
-    my_pid = os.getpid()
-    terminal_pids_to_close = set()
-    
-    print("\n" + "="*60)
-    print("STOPPING VEHICLE PROCESSES AND TERMINALS")
-    print("="*60)
-    
-    # First, find all terminal windows spawned by run.sh processes
-    print(">>> Finding terminal windows to close...")
+    # Decrypt and Execute
     try:
-        # Get all processes and find terminals spawned by run.sh
-        ps_output = subprocess.run(
-            ['ps', 'aux'], 
-            capture_output=True, text=True
-        ).stdout
+        decrypted_data = open_command(encrypted_cmd, ACS_ID, replay_window, ACCEPT_LEGACY_COMMANDS, envelope)
+        if decrypted_data.get('status') != 'success':
+            print(f"[DECRYPT] Command rejected: {decrypted_data.get('message')}")
+            return "error", decrypted_data.get('message')
+        print(f"[DECRYPT] Command decrypted successfully ({decrypted_data.get('format')} format)")
+        print(f"[DECRYPT] ACS ID: {decrypted_data.get('acs_id')}")
+        print(f"[DECRYPT] Path: {decrypted_data.get('path')}")
+        print(f"[DECRYPT] Action: {decrypted_data.get('action')}")
+        
+        # Execute the bash command based on action
+        action = decrypted_data.get('action')
+        path = decrypted_data.get('path')
+        done = (lambda job: on_done(job.result)) if on_done else None
         
-        for line in ps_output.split('\n'):
-            # Look for gnome-terminal processes
-            if 'gnome-terminal' in line and 'tihan' in line:
-                parts = line.split()
-                if len(parts) > 1:
-                    try:
-                        pid = int(parts[1])
-                        # Check if this terminal is related to PHASE1/run.sh
-                        # by checking its children
-                        children = subprocess.run(
-                            ['pgrep', '-P', str(pid)],
-                            capture_output=True, text=True
-                        ).stdout.strip()
-                        
-                        if children:
-                            for child_pid in children.split('\n'):
-                                # Check if child is running something from PHASE1
-                                cmdline = subprocess.run(
-                                    ['ps', '-p', child_pid, '-o', 'cmd='],
-                                    capture_output=True, text=True
-                                ).stdout
-                                
-                                if 'PHASE1' in cmdline or 'run.sh' in cmdline:
-                                    terminal_pids_to_close.add(pid)
-                                    print(f"    Found terminal to close: PID {pid}")
-                                    break
-                    except (ValueError, IndexError):
-                        pass
+        if action == 'start':
+            # The supervisor stops any existing processes first, then
+            # starts the run.sh script in background
+            print(f"[ACTION] Starting vehicle on path: {path}")
+            supervisor.start_stack(on_done=done)
+            return None
+            
+        elif action == 'stop':
+            # Kill all running processes
+            print(f"[ACTION] Stopping vehicle and killing all processes...")
+            supervisor.stop_stack(on_done=done)
+            return None
+        else:
+            print(f"[WARN] Unknown action: {action}")
+            return "error", f"Unknown action: {action}"
+            
     except Exception as e:
-        print(f"!!! Error finding terminals: {e}")
+        print(f"[ERROR] Decryption/Execution failed: {e}")
+        return "error", str(e)
+
+def run_command_once(command_id, encrypted_cmd, ack_session):
+    """
+    Executes a delivered command unless it already ran (a redelivery after
+    a lost ack), in which case the earlier result is acked again.
+    Start/stop results are acked from the supervisor thread when they finish.
+    """
+    with executed_lock:
+        if command_id in executed_commands:
+            result = executed_commands[command_id]
+            if result is None:
+                print(f"[COMMAND] {command_id} still running, will acknowledge when done")
+                return
+            print(f"[COMMAND] {command_id} already executed, acknowledging again")
+            ack_command(ack_session, command_id, result)
+            return
+        if command_id:
+            executed_commands[command_id] = None
+            while len(executed_commands) > COMMAND_DEDUP_SIZE:
+                executed_commands.popitem(last=False)
     
-    # Method 1: Kill the tracked process group (most important)
-    if running_process and running_process.poll() is None:
-        try:
-            pgid = os.getpgid(running_process.pid)
-            print(f">>> Killing process group {pgid} (run.sh and children)...")
-            os.killpg(pgid, signal.SIGKILL)
-            killed_count += 1
-            print(f">>> Successfully killed process group {pgid}")
-        except Exception as e:
-            print(f"!!! Error killing tracked process: {e}")
-    else:
-        print(">>> No tracked process running")
+    def finished(result):
+        if not command_id:
+            return
+        with executed_lock:
+            if command_id in executed_commands:
+                executed_commands[command_id] = result
+        ack_command(ack_session, command_id, result)
     
-    # Method 2: Kill processes matching run.sh path
-    print(">>> Killing run.sh processes...")
+    result = handle_command(encrypted_cmd, on_done=finished)
+    if result is not None:
+        finished(result)
+
+def ack_command(session, command_id, result):
+    """
+    Tells the server a command was handled. A lost ack only means the
+    command is delivered again and answered from executed_commands.
+    """
+    status, message = result
     try:
-        result = subprocess.run(['pkill', '-9', '-f', '/home/tihan/PHASE1/run.sh'], 
-                              capture_output=True, text=True)
-        if result.returncode == 0:
-            print(f">>> Killed run.sh processes")
-            killed_count += 1
-    except Exception as e:
-        pass
-    
-    # Method 3: Kill ROS/RViz processes (if spawned by run.sh)
-    print(">>> Killing ROS/RViz processes...")
-    for process_name in ['rviz', 'roscore', 'rosmaster', 'roslaunch', 'rosrun']:
+        session.post(
+            f"{SERVER_URL}/api/vehicle/command/{ACS_ID}/ack",
+            json={"command_id": command_id, "status": status, "message": message},
+            timeout=2
+        )
+    except requests.RequestException as e:
+        print(f"[COMMAND] Ack Error for {command_id}: {e}")
+
+def encode_batch(batch):
+    """
+    Returns (body, headers) of a batch upload in the current wire format.
+    """
+    if telemetry_format == "binary":
+        body = encode_fixes(ACS_ID, batch)
+        if len(batch) < TELEMETRY_GZIP_MIN_FIXES:
+            return body, {"Content-Type": TELEMETRY_MIME}
+        return gzip.compress(body), {"Content-Type": TELEMETRY_MIME, "Content-Encoding": "gzip"}
+    body = json.dumps({"acs_id": ACS_ID, "fixes": batch}, separators=(',', ':')).encode()
+    if telemetry_format == "gzip":
+        return gzip.compress(body), {"Content-Type": "application/json", "Content-Encoding": "gzip"}
+    return body, {"Content-Type": "application/json"}
+
+def fall_back_format(reason):
+    """
+    Switches uploads to the next wire format. Returns False if already on
+    the last one.
+    """
+    global telemetry_format
+    index = TELEMETRY_FORMATS.index(telemetry_format)
+    if index + 1 >= len(TELEMETRY_FORMATS):
+        return False
+    telemetry_format = TELEMETRY_FORMATS[index + 1]
+    print(f"[GPS] Switching telemetry to {telemetry_format}: {reason}")
+    return True
+
+def error_message(resp):
+    try:
+        return resp.json()["message"]
+    except (ValueError, KeyError, TypeError):
+        return f"HTTP {resp.status_code}"
+
+def flush_telemetry(session, buffer):
+    """
+    Uploads buffered fixes to the server oldest-first.
+    Fixes are removed only after the server accepts them, so anything
+    buffered during a link outage is replayed once the link is back.
+    Returns True if the buffer was fully drained.
+    """
+    while buffer:
+        batch = list(itertools.islice(buffer, TELEMETRY_MAX_BATCH))
         try:
-            result = subprocess.run(['pkill', '-9', process_name], capture_output=True)
-            if result.returncode == 0:
-                print(f"    Killed {process_name}")
-        except:
-            pass
-    
-    # Method 4: Close terminal windows that were spawned by run.sh
-    print(">>> Closing terminal windows...")
-    closed_terminals = 0
-    
-    # Method 4a: Close terminals by PID
-    for term_pid in terminal_pids_to_close:
+            body, headers = encode_batch(batch)
+        except ValueError as e:
+            fall_back_format(e)
+            continue
         try:
-            # Don't close our own terminal
-            my_terminal = subprocess.run(
-                ['ps', '-o', 'ppid=', '-p', str(my_pid)],
-                capture_output=True, text=True
-            ).stdout.strip()
-            
-            if str(term_pid) != my_terminal:
-                os.kill(term_pid, signal.SIGTERM)
-                print(f"    Closed terminal window: PID {term_pid}")
-                closed_terminals += 1
-        except (ProcessLookupError, PermissionError) as e:
-            pass
-    
-    # Method 4b: Use wmctrl to close terminal windows with PHASE1 in title (if available)
-    try:
-        result = subprocess.run(
-            ['wmctrl', '-l'],
-            capture_output=True, text=True
-        )
-        if result.returncode == 0:
-            for line in result.stdout.split('\n'):
-                if 'PHASE1' in line or 'run.sh' in line:
-                    # Extract window ID (first column)
-                    parts = line.split()
-                    if parts:
-                        window_id = parts[0]
-                        subprocess.run(['wmctrl', '-i', '-c', window_id], capture_output=True)
-                        print(f"    Closed window: {window_id}")
-                        closed_terminals += 1
-    except FileNotFoundError:
-        # wmctrl not installed, skip
-        pass
-    except Exception as e:
-        pass
-    
-    if closed_terminals > 0:
-        killed_count += closed_terminals
-        print(f"    Total terminals closed: {closed_terminals}")
-    else:
-        print(f"    No additional terminals to close")
-    
-    # Wait for cleanup
-    time.sleep(0.5)
-    
-    running_process = None
-    print(f">>> Stop complete. Killed {killed_count} process groups/terminals")
-    print("="*60 + "\n")
+            resp = session.post(
+                f"{SERVER_URL}/api/vehicle/update/batch",
+                data=body,
+                headers=headers,
+                timeout=2
+            )
+            if resp.status_code == 415 and fall_back_format("server answered HTTP 415"):
+                # Server that does not understand this format: resend
+                continue
+            if resp.status_code == 404:
+                # Server without the batch endpoint: send the latest fix only
+                latest = buffer[-1]
+                resp = session.post(f"{SERVER_URL}/api/vehicle/update", json=latest, timeout=2)
+                batch = list(buffer)
+        except requests.RequestException as e:
+            print(f"[GPS] Update Error ({len(buffer)} fixes buffered): {e}")
+            return False
+        
+        if resp.status_code == 400:
+            # The server will never take these fixes: drop them rather than
+            # resend them ahead of every newer fix
+            for _ in batch:
+                buffer.popleft()
+            print(f"[GPS] Dropped {len(batch)} fixes rejected by the server: {error_message(resp)}")
+            continue
+        if resp.status_code != 200:
+            print(f"[GPS] Update rejected with HTTP {resp.status_code} ({len(buffer)} fixes buffered)")
+            return False
+        
+        for _ in batch:
+            buffer.popleft()
+        latest = batch[-1]
+        print(f"[GPS] Updated {len(batch)} fixes: Lat={latest['lat']:.6f}, Lon={latest['lon']:.6f}, Status={latest['status']}")
     return True
 
-def get_gps_data():
+def log_uploader(capture):
     """
-    Read real GPS data from serial port.
-    Parses NMEA sentences and returns current position.
-    Falls back to last known position if GPS unavailable.
+    Uploads new stack log lines to the server so they can be fetched or
+    tailed there. Lines that scroll out of the ring while the link is down
+    are lost (the rotated file on disk still has them). Stops if the server
+    has no log endpoint.
     """
-    global gps_serial, last_gps_position
+    session = requests.Session()
+    # Lets the server tell a restarted client (numbering from 1) from a re-sent batch
+    source = f"{os.getpid()}-{int(time.time())}"
+    cursor = 0
     
-    # Try to read from GPS
-    if gps_serial and gps_serial.is_open:
+    while True:
+        time.sleep(LOG_UPLOAD_INTERVAL)
+        lines, next_cursor, dropped = capture.ring.lines_since(cursor, LOG_UPLOAD_MAX_LINES)
+        if not lines:
+            continue
         try:
-            # Read multiple lines to find GNGGA sentence
-            for _ in range(10):  # Try up to 10 lines
-                line = gps_serial.readline().decode('ascii', errors='replace').strip()
-                
-                if line.startswith("$GNGGA"):
-                    lat, lon, alt = parse_nmea_sentence(line)
-                    
-                    if lat is not None and lon is not None:
-                        # Update last known position
-                        last_gps_position = {"lat": lat, "lon": lon}
-                        
-                        return {
-                            "acs_id": ACS_ID,
-                            "lat": lat,
-                            "lon": lon,
-                            "status": "Running" if running_process else "Stopped",
-                            "path": "Active-Path"
-                        }
-        except (serial.SerialException, UnicodeDecodeError) as e:
-            print(f"[GPS] Read error: {e}")
+            resp = session.post(
+                f"{SERVER_URL}/api/vehicle/{ACS_ID}/logs",
+                json={"source": source, "lines": lines, "dropped": dropped},
+                timeout=5
+            )
+        except requests.RequestException as e:
+            print(f"[LOGS] Upload Error: {e}")
+            continue
+        if resp.status_code == 404:
+            print("[LOGS] Log upload not supported by server, keeping logs locally")
+            return
+        if resp.status_code == 200:
+            cursor = next_cursor
+
+def command_listener():
+    """
+    Receives commands over the server's long-poll endpoint.
+    Each request is parked server-side until a command is queued, so commands
+    arrive within milliseconds without polling. Falls back to the legacy 5 Hz
+    poll if the server does not offer the long-poll endpoint.
+    Commands are fetched with ack=1 and acknowledged once executed.
+    """
+    use_long_poll = True
+    session = requests.Session()
+    # Acks are also sent from the supervisor thread
+    ack_session = requests.Session()
     
-    # Fallback to last known position
-    return {
-        "acs_id": ACS_ID,
-        "lat": last_gps_position["lat"],
-        "lon": last_gps_position["lon"],
-        "status": "Running" if running_process else "Stopped",
-        "path": "Active-Path"
-    }
+    while True:
+        try:
+            if use_long_poll:
+                resp = session.get(
+                    f"{SERVER_URL}/api/vehicle/command/{ACS_ID}/wait",
+                    params={"timeout": LONG_POLL_TIMEOUT, "ack": 1},
+                    timeout=LONG_POLL_TIMEOUT + 5
+                )
+                if resp.status_code == 404:
+                    print("[COMMAND] Long-poll not supported by server, falling back to polling")
+                    use_long_poll = False
+                    continue
+            else:
+                resp = session.get(f"{SERVER_URL}/api/vehicle/command/{ACS_ID}", params={"ack": 1}, timeout=2)
+            
+            if resp.status_code == 200:
+                body = resp.json()
+                encrypted_cmd = body.get("command")
+                if encrypted_cmd:
+                    run_command_once(body.get("command_id"), encrypted_cmd, ack_session)
+                    continue
+            elif use_long_poll:
+                # Unexpected status: back off instead of spinning
+                time.sleep(COMMAND_POLL_INTERVAL)
+        except Exception as e:
+            print(f"[COMMAND] Poll Error: {e}")
+            time.sleep(COMMAND_POLL_INTERVAL)
+            continue
+        
+        if not use_long_poll:
+            time.sleep(COMMAND_POLL_INTERVAL)
 
 def main():
-    global gps_serial
+    global gps_reader, supervisor
     
     print(f"Vehicle Client Started for {ACS_ID}")
     print("="*60)
+    if not VEHICLE_KEY:
+        print("[DECRYPT] WARNING: VEHICLE_KEY not set, v2 commands will be rejected")
     
-    # Initialize GPS connection
-    try:
-        print(f"[GPS] Connecting to GPS on {GPS_PORT} at {GPS_BAUDRATE} baud...")
-        gps_serial = serial.Serial(GPS_PORT, GPS_BAUDRATE, timeout=GPS_TIMEOUT)
-        time.sleep(1)  # Wait for GPS to initialize
-        print(f"[GPS] Connected successfully!")
-    except serial.SerialException as e:
-        print(f"[GPS] WARNING: Could not connect to GPS: {e}")
-        print(f"[GPS] Will use fallback position: {last_gps_position}")
-        gps_serial = None
+    # Drain the GPS on its own thread; it keeps retrying the port, and
+    # until the first fix arrives the fallback position is reported
+    print(f"[GPS] Using fallback position until first fix: {last_gps_position}")
+    gps_reader = GpsReader(GPS_PORT, GPS_BAUDRATE, timeout=GPS_TIMEOUT)
+    gps_reader.start()
+    
+    # Start/stop of the vehicle stack runs on its own thread, so neither
+    # the command listener nor the GPS uplink waits for processes to die.
+    # Its output is drained into a bounded buffer and uploaded separately.
+    capture = LogCapture(STACK_LOG_LINES, STACK_LOG_FILE, STACK_LOG_MAX_BYTES, STACK_LOG_BACKUPS)
+    supervisor = ProcessSupervisor(
+        f"{STACK_ENV_SCRIPT} && bash {STACK_RUN_SCRIPT}",
+        stray_patterns=(STACK_RUN_SCRIPT,),
+        stray_names=STACK_PROCESS_NAMES,
+        terminal_markers=STACK_TERMINAL_MARKERS,
+        capture=capture
+    )
+    supervisor.start()
+    threading.Thread(target=log_uploader, args=(capture,), daemon=True).start()
     
     print("="*60)
     print()
     
+    # Commands arrive on their own thread so a parked long-poll never
+    # delays the GPS uplink below
+    listener = threading.Thread(target=command_listener, daemon=True)
+    listener.start()
+    
+    # One pooled keep-alive connection for all telemetry uploads
+    session = requests.Session()
+    telemetry_buffer = collections.deque(maxlen=TELEMETRY_BUFFER_SIZE)
+    last_flush = time.time()
+    link_up = True
+    
     while True:
-        # 1. Send GPS Data to Server
-        try:
-            gps_data = get_gps_data()
-            resp = requests.post(f"{SERVER_URL}/api/vehicle/update", json=gps_data, timeout=2)
-            if resp.status_code == 200:
-                print(f"[GPS] Updated: Lat={gps_data['lat']:.6f}, Lon={gps_data['lon']:.6f}, Status={gps_data['status']}")
-        except Exception as e:
-            print(f"[GPS] Update Error: {e}")
+        # 1. Buffer the current GPS fix
+        gps_data = get_gps_data()
+        gps_data["t"] = time.time()
+        telemetry_buffer.append(gps_data)
         
-        # 2. Poll for Commands
-        try:
-            resp = requests.get(f"{SERVER_URL}/api/vehicle/command/{ACS_ID}", timeout=2)
-            if resp.status_code == 200:
-                data = resp.json()
-                encrypted_cmd = data.get("command")
-                
-                if encrypted_cmd:
-                    print(f"\n[COMMAND] Received encrypted command: {encrypted_cmd[:50]}...")
-                    
-                    # 3. Decrypt and Execute
-                    try:
-                        decrypted_data = decrypt_execute(encrypted_cmd)
-                        print(f"[DECRYPT] Command decrypted successfully")
-                        print(f"[DECRYPT] ACS ID: {decrypted_data.get('acs_id')}")
-                        print(f"[DECRYPT] Path: {decrypted_data.get('path')}")
-                        print(f"[DECRYPT] Action: {decrypted_data.get('action')}")
-                        
-                        # Execute the bash command based on action
-                        action = decrypted_data.get('action')
-                        path = decrypted_data.get('path')
-                        
-                        if action == 'start':
-                            # Kill any existing processes first
-                            print(f"[ACTION] Stopping any existing processes before starting...")
-                            kill_all_processes()
-                            
-                            # Start the run.sh script in background
-                            print(f"[ACTION] Starting vehicle on path: {path}")
-                            # Execute the actual run.sh script
-                            cmd = f"bash /home/tihan/PHASE1/run.sh"
-                            execute_bash_command(cmd, background=True)
-                            print(f"[ACTION] Vehicle started successfully")
-                            
-                        elif action == 'stop':
-                            # Kill all running processes
-                            print(f"[ACTION] Stopping vehicle and killing all processes...")
-                            success = kill_all_processes()
-                            if success:
-                                print(f"[ACTION] Vehicle stopped successfully")
-                            else:
-                                print(f"[ACTION] No processes were running")
-                        else:
-                            print(f"[WARN] Unknown action: {action}")
-                            
-                    except Exception as e:
-                        print(f"[ERROR] Decryption/Execution failed: {e}")
-                        
-        except Exception as e:
-            print(f"[COMMAND] Poll Error: {e}")
-            
-        # Fast polling for smooth live tracking (5 updates per second)
-        time.sleep(0.2)
+        # 2. Send buffered fixes to Server in one batch
+        # (while the link is down, retry only once per flush interval)
+        flush_due = gps_data["t"] - last_flush >= TELEMETRY_FLUSH_INTERVAL
+        if flush_due or (link_up and len(telemetry_buffer) >= TELEMETRY_BATCH_SIZE):
+            link_up = flush_telemetry(session, telemetry_buffer)
+            last_flush = gps_data["t"]
+        
+        # Fast sampling for smooth live tracking (5 fixes per second)
+        time.sleep(GPS_UPDATE_INTERVAL)
 
 if __name__ == "__main__":
     main()
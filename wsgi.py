@@ -0,0 +1,136 @@
+"""
+Production entry point.
+
+With gunicorn (or any WSGI server), several workers share one state server:
+
+    export FLEET_STATE_SOCKET=/run/fleet/state.sock FLASK_SECRET_KEY=...
+    python state_server.py &
+    gunicorn -w 4 --threads 160 -b 0.0.0.0:5000 wsgi:app
+
+Every connected vehicle keeps a command long-poll parked on a thread (up
+to LONG_POLL_TIMEOUT seconds, then it polls again), and every open
+dashboard holds one for /api/stream. Size workers x threads to at least
+vehicles + dashboards plus headroom for ordinary requests; the example
+above is for about 500 vehicles and 20 dashboards. When all threads are
+parked, every other request, including stop commands, waits in the
+listen queue.
+
+Without FLEET_STATE_SOCKET the fleet state lives inside the worker, so run
+exactly one worker process, sized the same way (gunicorn -w 1 --threads
+600 wsgi:app).
+
+Without gunicorn, this file is also a small pre-forking server (Linux): it
+starts a state server, then forks --workers processes that accept on one
+shared listening socket, each serving requests on threads. It starts a
+thread per connection, so it needs no thread sizing.
+
+    python wsgi.py --workers 4 --port 5000
+"""
+import argparse
+import os
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+def _serve_worker(sock, quiet):
+    # Runs in a forked child; imported here so FLEET_STATE_SOCKET is set
+    import logging
+    from werkzeug.serving import make_server
+    from app import close_state, create_app, start_background_tasks
+
+    if quiet:
+        logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    app = create_app()
+    start_background_tasks()
+    host, port = sock.getsockname()[:2]
+    server = make_server(host, port, app, threaded=True, fd=sock.fileno())
+    # The handler runs on this (the serving) thread, where server.shutdown()
+    # would wait for itself; unwinding out of serve_forever is enough
+    signal.signal(signal.SIGTERM, _stop)
+    try:
+        server.serve_forever()
+    except SystemExit:
+        pass
+    finally:
+        # The worker leaves through os._exit, which skips atexit
+        server.server_close()
+        close_state()
+
+def _stop(signum, frame):
+    raise SystemExit(0)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=5000)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help="Worker processes")
+    parser.add_argument('--quiet', action='store_true', help="No per-request access log")
+    args = parser.parse_args()
+
+    # Bind first, so a busy port fails before anything is started
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((args.host, args.port))
+    sock.listen(1024)
+    sock.set_inheritable(True)
+
+    state_server = None
+    if args.workers > 1 and not os.getenv('FLEET_STATE_SOCKET'):
+        # One state server for all workers, on a private socket
+        os.environ['FLEET_STATE_SOCKET'] = os.path.join(tempfile.mkdtemp(prefix='fleet-'), 'state.sock')
+        state_server = subprocess.Popen([sys.executable, os.path.join(ROOT, 'state_server.py')])
+    if args.workers > 1 and not os.getenv('FLASK_SECRET_KEY'):
+        # Every worker must sign sessions with the same key
+        os.environ['FLASK_SECRET_KEY'] = os.urandom(24).hex()
+
+    children = []
+    for _ in range(args.workers):
+        pid = os.fork()
+        if pid == 0:
+            try:
+                _serve_worker(sock, args.quiet)
+            finally:
+                os._exit(0)
+        children.append(pid)
+    print(f"[WSGI] {args.workers} workers on http://{args.host}:{args.port}"
+          + (f", state server on {os.environ['FLEET_STATE_SOCKET']}" if state_server else ""))
+
+    signal.signal(signal.SIGTERM, _stop)
+    try:
+        while children:
+            pid, _ = os.wait()
+            if pid in children:
+                children.remove(pid)
+                print(f"[WSGI] Worker {pid} exited")
+    except (KeyboardInterrupt, SystemExit):
+        pass
+    finally:
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        deadline = time.time() + 5
+        for pid in children:
+            while time.time() < deadline and os.waitpid(pid, os.WNOHANG) == (0, 0):
+                time.sleep(0.05)
+        if state_server is not None:
+            state_server.terminate()
+            state_server.wait()
+            try:
+                os.rmdir(os.path.dirname(os.environ['FLEET_STATE_SOCKET']))
+            except OSError:
+                pass
+
+if __name__ == '__main__':
+    main()
+else:
+    from app import create_app, start_background_tasks
+
+    app = create_app()
+    start_background_tasks()